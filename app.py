@@ -1,19 +1,31 @@
 import streamlit as st
 from static.styles import load_styles
 from config.constants import init_session_state
+from models.ikea_data import prepare_ikea_dataset
 from modes.ikea_mode import run_ikea_mode
 from modes.simple_mode import run_simple_mode
 from utils.ui_components import check_notifications
+from utils.metrics import start_metrics_server
+from utils.cpu_tuning import apply_cpu_tuning
 
 # Configuration de la page
 st.set_page_config(layout="wide", page_title="IKEA AI Room Designer Pro")
 
 def main():
+    # Affinité CPU et nombres de threads mesurés (une seule fois par processus)
+    apply_cpu_tuning()
+
     # Chargement des styles CSS
     load_styles()
     
     # Initialisation des états de session
     init_session_state()
+
+    # Installation du bundle IKEA local (une seule fois par processus)
+    prepare_ikea_dataset()
+
+    # Endpoint local des métriques si AI_FURNISHER_METRICS_PORT est défini
+    start_metrics_server()
     
     # Vérifier et afficher les notifications
     check_notifications()
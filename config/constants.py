@@ -1,15 +1,104 @@
 import os
 import torch
 
+
+def _env_choice(name, choices, default):
+    """Valeur d'une variable d'environnement parmi choices (défaut, avec avertissement, si inconnue)"""
+    value = os.environ.get(name, default)
+    if value not in choices:
+        print(f"Warning: unknown {name}={value!r}, expected one of {tuple(choices)}; using {default!r}")
+        return default
+    return value
+
 # Constants
 IKEA_DATASET_DIR = "ikea_dataset"
 MODELS_DIR = "models"
 RESULTS_DIR = "results"
 IKEA_CATALOG_FILE = os.path.join(IKEA_DATASET_DIR, "ikea_catalog.json")
 IKEA_EMBEDDINGS_FILE = os.path.join(IKEA_DATASET_DIR, "ikea_embeddings.pkl")
+IKEA_IMAGE_EMBEDS_DIR = os.path.join(IKEA_DATASET_DIR, "image_embeds")
+METRICS_DIR = os.path.join(RESULTS_DIR, "metrics")
+METRICS_PORT = int(os.environ.get("AI_FURNISHER_METRICS_PORT", "0"))
+PROFILES_DIR = os.path.join(RESULTS_DIR, "profiles")
+PROFILE_ENV_VAR = "AI_FURNISHER_PROFILE"
+PROFILE_ADMIN_TOKEN = os.environ.get("AI_FURNISHER_PROFILE_TOKEN", "")
+CPU_TUNING_FILE = os.path.join(MODELS_DIR, "cpu_tuning.json")
+WORKER_INDEX = int(os.environ.get("AI_FURNISHER_WORKER_INDEX", "0"))
+NUM_WORKERS = int(os.environ.get("AI_FURNISHER_NUM_WORKERS", "1"))
+DEPTH_MODEL_ID = "Intel/dpt-hybrid-midas"
+# Estimateurs de profondeur: "hybrid" (DPT hybride), "small" (Depth Anything small), "classical" (sans réseau)
+DEPTH_MODEL_IDS = {"hybrid": DEPTH_MODEL_ID, "small": "LiheYoung/depth-anything-small-hf"}
+DEPTH_ESTIMATORS = ("hybrid", "small", "classical")
+DEPTH_ESTIMATOR = _env_choice("AI_FURNISHER_DEPTH_ESTIMATOR", DEPTH_ESTIMATORS, "hybrid")
+DEPTH_INFERENCE_SIZE = int(os.environ.get("AI_FURNISHER_DEPTH_SIZE", "384"))
+QUANTIZATION_MODES = ("none", "int8")
+QUANTIZATION_MODE = _env_choice("AI_FURNISHER_QUANTIZE", QUANTIZATION_MODES, "none")
+QUANTIZED_MODELS_DIR = os.path.join(MODELS_DIR, "quantized")
+ONNX_MODELS_DIR = os.path.join(MODELS_DIR, "onnx")
+# Moteur d'inférence par pipeline ("torch" ou "onnx"), AI_FURNISHER_<PIPELINE>_BACKEND prioritaire
+BACKENDS = ("torch", "onnx")
+DEFAULT_BACKEND = _env_choice("AI_FURNISHER_BACKEND", BACKENDS, "torch")
+INFERENCE_BACKENDS = {
+    pipeline: _env_choice(f"AI_FURNISHER_{pipeline.upper()}_BACKEND", BACKENDS, DEFAULT_BACKEND)
+    for pipeline in ("simple", "controlnet", "ikea", "depth")
+}
+CPU_FAST_PATH = os.environ.get("AI_FURNISHER_CPU_FAST_PATH", "0") == "1"
+CPU_BF16 = os.environ.get("AI_FURNISHER_CPU_BF16", "auto")
+COMPILE_CACHE_DIR = os.path.join(MODELS_DIR, "compile_cache")
+# Plafond mémoire par worker (Mo, 0 = désactivé): RAM sur CPU, mémoire GPU sur CUDA
+MEMORY_BUDGET_MB = int(os.environ.get("AI_FURNISHER_MEMORY_BUDGET_MB", "0"))
+PREVIEW_DECODER_ID = "madebyollin/taesdxl"
+PREVIEW_EVERY_N_STEPS = int(os.environ.get("AI_FURNISHER_PREVIEW_EVERY", "5"))
+PREVIEW_METHODS = ("linear", "taesd", "off")
+PREVIEW_METHOD = _env_choice("AI_FURNISHER_PREVIEW_METHOD", PREVIEW_METHODS, "linear")
+# Inpainting limité à la boîte englobante du masque (marge relative, bornes de résolution, fondu en px)
+INPAINT_CROP_TO_MASK = os.environ.get("AI_FURNISHER_CROP_TO_MASK", "1") == "1"
+INPAINT_CROP_PADDING = 0.15
+INPAINT_CROP_MIN_SIDE = 512
+INPAINT_CROP_MAX_SIDE = 1024
+INPAINT_FEATHER = 16
+# Génération en deux temps: brouillon basse résolution puis affinage court à pleine résolution
+DRAFT_LONG_SIDE = 512
+DRAFT_STEPS = 12
+REFINE_STRENGTH = 0.5
+REFINE_STEPS = 15
+# Encodages VAE de pièces conservés entre générations (0 = désactivé)
+LATENT_CACHE_SIZE = int(os.environ.get("AI_FURNISHER_LATENT_CACHE_SIZE", "8"))
+# Paliers de budget ControlNet: (début, fin) de la fenêtre en fraction des pas, recalcul des résidus tous les N pas
+CONTROLNET_TIERS = {"quality": (0.0, 1.0, 1), "balanced": (0.0, 0.8, 2), "fast": (0.0, 0.5, 2)}
+CONTROLNET_TIER = _env_choice("AI_FURNISHER_CONTROLNET_TIER", CONTROLNET_TIERS, "quality")
+# Planning de guidance: "constant", "truncate" (CFG coupée après CFG_CUTOFF des pas) ou "decay" (décroissance jusqu'à la coupure)
+GUIDANCE_SCHEDULES = ("constant", "truncate", "decay")
+GUIDANCE_SCHEDULE = _env_choice("AI_FURNISHER_GUIDANCE_SCHEDULE", GUIDANCE_SCHEDULES, "constant")
+CFG_CUTOFF = float(os.environ.get("AI_FURNISHER_CFG_CUTOFF", "0.75"))
+# DeepCache: UNet complet tous les N pas, traits profonds réutilisés entre deux (0 = désactivé)
+DEEP_CACHE_INTERVAL = int(os.environ.get("AI_FURNISHER_DEEP_CACHE_INTERVAL", "0"))
+# Fusion de tokens (ToMe) avant l'auto-attention: part des tokens fusionnés, rendus finaux inclus ou non
+TOKEN_MERGING_RATIO = float(os.environ.get("AI_FURNISHER_TOKEN_MERGING", "0"))
+TOKEN_MERGING_FINAL = os.environ.get("AI_FURNISHER_TOKEN_MERGING_FINAL", "0") == "1"
+TOKEN_MERGING_MAX_DOWNSAMPLE = 2
+INTERIOR_STYLES = ["Scandinave", "Moderne", "Industriel", "Classique", "Minimaliste"]
+# LoRA de style optionnelle: AI_FURNISHER_LORA_<STYLE>="dépôt_ou_dossier[:fichier.safetensors]"
+STYLE_LORAS = {
+    style: os.environ[f"AI_FURNISHER_LORA_{style.upper()}"]
+    for style in INTERIOR_STYLES if os.environ.get(f"AI_FURNISHER_LORA_{style.upper()}")
+}
+STYLE_LORA_SCALE = float(os.environ.get("AI_FURNISHER_LORA_SCALE", "0.8"))
+STYLE_ADAPTER_CACHE_SIZE = int(os.environ.get("AI_FURNISHER_LORA_CACHE_SIZE", "2"))
+# Conditionnement par l'image des produits IKEA (IP-Adapter SDXL, 0 = désactivé)
+IP_ADAPTER_MODEL_ID = "h94/IP-Adapter"
+IP_ADAPTER_SUBFOLDER = "sdxl_models"
+IP_ADAPTER_WEIGHTS = "ip-adapter_sdxl.safetensors"
+PRODUCT_CONDITIONING_SCALE = float(os.environ.get("AI_FURNISHER_PRODUCT_SCALE", "0"))
+# Régénération incrémentale: part maximale de l'image à re-rendre avant de repasser en rendu complet
+INCREMENTAL_MAX_AREA = float(os.environ.get("AI_FURNISHER_INCREMENTAL_MAX_AREA", "0.5"))
 DEVICE = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 IKEA_BASE_PATH = "/content/ikea"
 IKEA_DATA_PATH = os.path.join(IKEA_BASE_PATH, "text_data")
+IKEA_METADATA_DIR = os.path.join(IKEA_DATASET_DIR, "metadata")
+IKEA_RETRIEVAL_DIR = os.path.join(IKEA_DATASET_DIR, "retrieval")
+IKEA_RETRIEVAL_TOP_K = 3
+IKEA_BUNDLE_DIR = os.environ.get("IKEA_BUNDLE_DIR", "bundles")
 
 # Création des répertoires nécessaires
 os.makedirs(MODELS_DIR, exist_ok=True)
@@ -40,8 +129,24 @@ def init_session_state():
         st.session_state.inpainting_mode = "avec_meubles"
     if 'use_depth_map' not in st.session_state:
         st.session_state.use_depth_map = True
+    if 'draft_render' not in st.session_state:
+        st.session_state.draft_render = False
+    if 'two_stage' not in st.session_state:
+        st.session_state.two_stage = False
+    if 'style_sweep' not in st.session_state:
+        st.session_state.style_sweep = False
+    if 'ikea_draft' not in st.session_state:
+        st.session_state.ikea_draft = None
+    if 'refine_requested' not in st.session_state:
+        st.session_state.refine_requested = False
     if 'composited_img' not in st.session_state:
         st.session_state.composited_img = None
+    if 'item_masks' not in st.session_state:
+        st.session_state.item_masks = None
+    if 'last_render' not in st.session_state:
+        st.session_state.last_render = None
+    if 'incremental_regen' not in st.session_state:
+        st.session_state.incremental_regen = True
     if 'generate_button_clicked' not in st.session_state:
         st.session_state.generate_button_clicked = False
     if 'active_step' not in st.session_state:
@@ -56,6 +161,10 @@ def init_session_state():
         st.session_state.original_image = None
     if 'result_image' not in st.session_state:
         st.session_state.result_image = None
+    if 'result_is_draft' not in st.session_state:
+        st.session_state.result_is_draft = False
+    if 'simple_draft' not in st.session_state:
+        st.session_state.simple_draft = None
     if 'last_uploaded_filename' not in st.session_state:
         st.session_state.last_uploaded_filename = None
     if 'ikea_products' not in st.session_state or 'ikea_img_desc' not in st.session_state:
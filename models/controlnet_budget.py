@@ -0,0 +1,157 @@
+import sys
+import time
+import argparse
+import numpy as np
+import torch
+
+from config.constants import CONTROLNET_TIER, CONTROLNET_TIERS
+from utils.metrics import inc, results_path, write_results
+
+
+def controlnet_window_kwargs(pipe, tier=CONTROLNET_TIER, call_kwargs=None):
+    """Fenêtre de pas où le ControlNet s'applique (control_guidance_start/end de diffusers)"""
+    if "controlnet" not in pipe.components or tier not in CONTROLNET_TIERS:
+        return {}
+    call_kwargs = call_kwargs or {}
+    start, end, _ = CONTROLNET_TIERS[tier]
+    window = {}
+    if "control_guidance_start" not in call_kwargs:
+        window["control_guidance_start"] = start
+    if "control_guidance_end" not in call_kwargs:
+        window["control_guidance_end"] = end
+    return window
+
+
+def enable_controlnet_budget(pipe):
+    """Remplace controlnet.forward sur l'instance: pas hors fenêtre sautés, résidus réutilisés entre pas voisins
+
+    diffusers appelle le ControlNet à chaque pas, avec une échelle nulle hors de la fenêtre: ces appels
+    renvoient des résidus nuls sans calcul. L'état est remis à zéro par apply_controlnet_budget au
+    début de chaque génération. Dans la fenêtre, le ControlNet n'est recalculé que tous les
+    `reuse_every` pas (pipe._controlnet_reuse_every); entre deux, les résidus du pas précédent resservent.
+    """
+    controlnet = getattr(pipe, "controlnet", None)
+    if controlnet is None or getattr(controlnet, "_budget_state", None) is not None:
+        return pipe
+    forward = controlnet.forward
+    state = {"calls": 0, "residuals": None, "scale": None, "zeros": None}
+
+    def budgeted_forward(sample, timestep, encoder_hidden_states, controlnet_cond, conditioning_scale=1.0,
+                         return_dict=True, **kwargs):
+        batch = sample.shape[0]
+        cached = state["residuals"]
+        if cached is not None and cached[1].shape[0] != batch:
+            # CFG tronquée: le lot est réduit à sa moitié conditionnelle, qui est la fin du lot précédent
+            cached = ([r[-batch:] for r in cached[0]], cached[1][-batch:]) if cached[1].shape[0] > batch else None
+            state["residuals"] = cached
+        if state["zeros"] is not None and state["zeros"][1].shape[0] != batch:
+            state["zeros"] = None
+
+        if conditioning_scale == 0:
+            inc("controlnet_steps_total", status="skipped")
+            if state["zeros"] is None:
+                if cached is not None:
+                    state["zeros"] = ([torch.zeros_like(r) for r in cached[0]], torch.zeros_like(cached[1]))
+                else:
+                    # Aucun résidu de référence pour les formes: un seul appel à échelle nulle les fournit
+                    state["zeros"] = forward(sample, timestep, encoder_hidden_states, controlnet_cond,
+                                             conditioning_scale=0.0, return_dict=False, **kwargs)
+            down, mid = state["zeros"]
+        elif cached is not None and state["calls"] % max(1, getattr(pipe, "_controlnet_reuse_every", 1)) != 0:
+            inc("controlnet_steps_total", status="reused")
+            ratio = conditioning_scale / state["scale"]
+            down, mid = cached if ratio == 1 else ([r * ratio for r in cached[0]], cached[1] * ratio)
+            state["calls"] += 1
+        else:
+            inc("controlnet_steps_total", status="computed")
+            down, mid = forward(sample, timestep, encoder_hidden_states, controlnet_cond,
+                                conditioning_scale=conditioning_scale, return_dict=False, **kwargs)
+            state.update(residuals=(down, mid), scale=conditioning_scale)
+            state["calls"] += 1
+
+        if return_dict:
+            from diffusers.models.controlnet import ControlNetOutput
+            return ControlNetOutput(down_block_res_samples=down, mid_block_res_sample=mid)
+        return down, mid
+
+    controlnet.forward = budgeted_forward
+    controlnet._budget_state = state
+    return pipe
+
+
+def reset_controlnet_budget(pipe):
+    """Oublie les résidus de la génération précédente (à appeler au début de chaque génération)"""
+    state = getattr(getattr(pipe, "controlnet", None), "_budget_state", None)
+    if state is not None:
+        state.update(calls=0, residuals=None, scale=None, zeros=None)
+
+
+def apply_controlnet_budget(pipe, tier, call_kwargs):
+    """Fixe la fenêtre et l'intervalle de réutilisation du palier pour cet appel du pipeline"""
+    reset_controlnet_budget(pipe)
+    window = controlnet_window_kwargs(pipe, tier, call_kwargs)
+    if window:
+        call_kwargs.update(window)
+        pipe._controlnet_reuse_every = CONTROLNET_TIERS[tier][2]
+    return window
+
+
+def _depth_adherence(image, control_depth):
+    """Corrélation entre la profondeur du rendu et la carte de contrôle"""
+    from utils.depth_estimation import estimate_depth
+
+    rendered = np.asarray(estimate_depth(image, "hybrid").resize(control_depth.size), dtype=np.float32)
+    control = np.asarray(control_depth.convert("L"), dtype=np.float32)
+    return float(np.corrcoef(rendered.ravel(), control.ravel())[0, 1])
+
+
+def benchmark(image_path, steps, seed, tiers):
+    """Latence et respect de la profondeur par palier (fenêtre ControlNet, réutilisation des résidus)"""
+    from PIL import Image
+    from diffusers import StableDiffusionXLControlNetInpaintPipeline, ControlNetModel
+    from models.model_loader import SDXL_BASE_MODEL_ID, CONTROLNET_DEPTH_MODEL_ID
+    from models.generation import run_pipeline
+    from utils.depth_estimation import estimate_depth
+    from utils.image_processing import generate_inpainting_mask
+
+    image = Image.open(image_path).convert("RGB").resize((768, 512))
+    mask = generate_inpainting_mask(image.size, strategy="center_rect")
+    depth = estimate_depth(image, "hybrid").convert("RGB")
+    controlnet = ControlNetModel.from_pretrained(CONTROLNET_DEPTH_MODEL_ID, torch_dtype=torch.float32)
+    pipe = StableDiffusionXLControlNetInpaintPipeline.from_pretrained(SDXL_BASE_MODEL_ID, controlnet=controlnet,
+                                                                       torch_dtype=torch.float32)
+    enable_controlnet_budget(pipe)
+
+    report = {"steps": steps, "seed": seed}
+    for tier in tiers:
+        start = time.perf_counter()
+        result = run_pipeline(pipe, "benchmark", controlnet_tier=tier,
+                              prompt="a cozy living room with a grey sofa and a wooden coffee table",
+                              image=image, mask_image=mask, control_image=depth, num_inference_steps=steps,
+                              generator=torch.Generator("cpu").manual_seed(seed))
+        latency = time.perf_counter() - start
+        result.images[0].save(results_path(f"controlnet_budget_{tier}.png"))
+        report[tier] = {"window": CONTROLNET_TIERS[tier][:2], "reuse_every": CONTROLNET_TIERS[tier][2],
+                        "latency_s": latency, "depth_correlation": _depth_adherence(result.images[0], depth)}
+    baseline = report.get("quality", {}).get("latency_s")
+    for tier in tiers:
+        report[tier]["speedup"] = baseline / report[tier]["latency_s"] if baseline else None
+
+    write_results("controlnet_budget_benchmark.json", report)
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Latence et respect de la profondeur par palier de budget ControlNet")
+    parser.add_argument("--image", required=True, help="Image de pièce servant de référence")
+    parser.add_argument("--steps", type=int, default=30)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--tiers", default=",".join(CONTROLNET_TIERS))
+    args = parser.parse_args(argv)
+
+    benchmark(args.image, args.steps, args.seed, args.tiers.split(","))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,101 @@
+import os
+import torch
+
+from config.constants import DEVICE, CPU_FAST_PATH, CPU_BF16, COMPILE_CACHE_DIR
+
+
+def fast_path_enabled():
+    return CPU_FAST_PATH and DEVICE.type == "cpu"
+
+
+def bf16_supported():
+    """Indique si le CPU exécute le bfloat16 nativement (AVX512-BF16 / AMX)"""
+    if CPU_BF16 in ("0", "1"):
+        return CPU_BF16 == "1"
+    try:
+        return bool(torch.ops.mkldnn._is_mkldnn_bf16_supported())
+    except (AttributeError, RuntimeError):
+        pass
+    try:
+        with open("/proc/cpuinfo") as f:
+            flags = f.read()
+        return "avx512_bf16" in flags or "amx_bf16" in flags
+    except OSError:
+        return False
+
+
+def _enable_compile_cache():
+    """Cache Inductor persistant: la compilation n'est payée qu'une fois par déploiement"""
+    cache_dir = os.path.join(COMPILE_CACHE_DIR, f"torch{torch.__version__}")
+    os.makedirs(cache_dir, exist_ok=True)
+    os.environ.setdefault("TORCHINDUCTOR_CACHE_DIR", cache_dir)
+    os.environ.setdefault("TORCHINDUCTOR_FX_GRAPH_CACHE", "1")
+    try:
+        import torch._inductor.config as inductor_config
+        inductor_config.fx_graph_cache = True
+    except (ImportError, AttributeError):
+        pass
+    return os.environ["TORCHINDUCTOR_CACHE_DIR"]
+
+
+def _channels_last(value):
+    if torch.is_tensor(value) and value.dim() == 4:
+        return value.contiguous(memory_format=torch.channels_last)
+    return value
+
+
+def _to_float32(output):
+    if torch.is_tensor(output):
+        return output.float() if output.is_floating_point() else output
+    if isinstance(output, (tuple, list)):
+        return type(output)(_to_float32(o) for o in output)
+    if isinstance(output, dict):
+        # BaseOutput de diffusers: l'affectation par clé met aussi à jour l'attribut
+        for key in list(output.keys()):
+            output[key] = _to_float32(output[key])
+    return output
+
+
+def _is_quantized(module):
+    return any(isinstance(m, torch.ao.nn.quantized.dynamic.Linear) for m in module.modules())
+
+
+def optimize_module(module, use_bf16, forward_name="forward"):
+    """channels_last + autocast bf16 éventuel + torch.compile, en remplaçant forward sur l'instance"""
+    if forward_name in vars(module) or _is_quantized(module):
+        # Déjà remplacé (ONNX Runtime, DeepCache) ou quantifié int8: pas de compilation
+        return False
+    module.to(memory_format=torch.channels_last)
+    forward = getattr(module, forward_name)
+
+    def fast_forward(*args, **kwargs):
+        args = tuple(_channels_last(a) for a in args)
+        kwargs = {k: _channels_last(v) for k, v in kwargs.items()}
+        with torch.autocast("cpu", dtype=torch.bfloat16, enabled=use_bf16):
+            output = forward(*args, **kwargs)
+        # Le scheduler et le reste du pipeline restent en float32
+        return _to_float32(output) if use_bf16 else output
+
+    # dynamic=None: après un premier changement de taille (pièces, brouillon/affinage, CFG), le graphe est
+    # recompilé une fois avec des dimensions symboliques au lieu d'une fois par forme
+    setattr(module, forward_name, torch.compile(fast_forward, dynamic=None))
+    return True
+
+
+def apply_cpu_fast_path(pipe):
+    """Compile l'UNet, le ControlNet éventuel et le décodeur VAE d'un pipeline pour le CPU"""
+    if not fast_path_enabled():
+        return pipe
+    cache_dir = _enable_compile_cache()
+    use_bf16 = bf16_supported()
+
+    # vae.decode remplacé par ONNX Runtime: le décodeur torch n'est plus appelé, inutile de le compiler
+    vae_decoder = None if "decode" in vars(pipe.vae) else pipe.vae.decoder
+    compiled = []
+    for name, module in (("unet", pipe.unet), ("controlnet", getattr(pipe, "controlnet", None)),
+                         ("vae_decoder", vae_decoder)):
+        if module is not None and optimize_module(module, use_bf16):
+            compiled.append(name)
+    print(f"CPU fast path: compiled {', '.join(compiled) or 'nothing'} "
+          f"(channels_last, bf16 autocast {'on' if use_bf16 else 'off'}, cache {cache_dir})")
+    return pipe
@@ -0,0 +1,103 @@
+import torch
+
+from config.constants import DEEP_CACHE_INTERVAL
+from utils.metrics import inc
+
+
+def deep_cache_supported(unet):
+    """UNet de type SDXL: premier bloc descendant et dernier bloc montant sans attention croisée"""
+    first, last = unet.down_blocks[0], unet.up_blocks[-1]
+    return (unet.config.addition_embed_type == "text_time"
+            and not getattr(first, "has_cross_attention", False)
+            and not getattr(last, "has_cross_attention", False)
+            and len(last.resnets) == len(first.resnets) + 1
+            and unet.class_embedding is None)
+
+
+def _shallow_forward(unet, sample, timestep, added_cond_kwargs, deep_features, residuals):
+    """Pas peu coûteux: conv_in et premier bloc descendant, puis dernier bloc montant sur les traits profonds en cache"""
+    timesteps = timestep if torch.is_tensor(timestep) else torch.tensor([timestep], device=sample.device)
+    if timesteps.dim() == 0:
+        timesteps = timesteps[None].to(sample.device)
+    timesteps = timesteps.expand(sample.shape[0])
+    emb = unet.time_embedding(unet.time_proj(timesteps).to(dtype=sample.dtype))
+    text_embeds = added_cond_kwargs["text_embeds"]
+    time_embeds = unet.add_time_proj(added_cond_kwargs["time_ids"].flatten()).reshape((text_embeds.shape[0], -1))
+    emb = emb + unet.add_embedding(torch.concat([text_embeds, time_embeds], dim=-1).to(emb.dtype))
+    if unet.time_embed_act is not None:
+        emb = unet.time_embed_act(emb)
+
+    # Seules les connexions de saut du dernier bloc montant sont recalculées (pas de sous-échantillonnage)
+    hidden_states = unet.conv_in(sample)
+    skips = (hidden_states,)
+    for resnet in unet.down_blocks[0].resnets:
+        hidden_states = resnet(hidden_states, emb)
+        skips += (hidden_states,)
+    if residuals is not None:
+        skips = tuple(skip + residual for skip, residual in zip(skips, residuals))
+
+    sample = unet.up_blocks[-1](hidden_states=deep_features, temb=emb, res_hidden_states_tuple=skips)
+    if unet.conv_norm_out:
+        sample = unet.conv_act(unet.conv_norm_out(sample))
+    return unet.conv_out(sample)
+
+
+def enable_deep_cache(pipe, interval=DEEP_CACHE_INTERVAL):
+    """Cache DeepCache des traits profonds de l'UNet: calcul complet tous les `interval` pas, superficiel sinon
+
+    Remplace unet.forward sur l'instance. Au pas complet, la sortie de l'avant-dernier bloc montant est
+    conservée; aux pas suivants, seuls conv_in, les resnets du premier bloc descendant et le dernier bloc
+    montant sont évalués. Sans effet si l'UNet est déjà remplacé (ONNX) ou n'a pas la structure SDXL.
+    Le cache est vidé par reset_deep_cache au début de chaque génération.
+    """
+    unet = pipe.unet
+    if interval <= 1 or "forward" in vars(unet):
+        return pipe
+    if not deep_cache_supported(unet):
+        print(f"DeepCache skipped: unsupported UNet layout for {type(pipe).__name__}")
+        return pipe
+
+    forward = unet.forward
+    state = {"step": 0, "deep": None, "capture": False}
+
+    def capture(module, inputs, output):
+        if state["capture"]:
+            state["deep"] = output
+
+    unet.up_blocks[-2].register_forward_hook(capture)
+
+    def deep_cache_forward(sample, timestep, encoder_hidden_states, *args, return_dict=True, **kwargs):
+        from diffusers.models.unet_2d_condition import UNet2DConditionOutput
+
+        deep = state["deep"]
+        extra = {k: v for k, v in kwargs.items()
+                 if v is not None and k not in ("added_cond_kwargs", "down_block_additional_residuals",
+                                                "mid_block_additional_residual")}
+        shallow = (not args and not extra and deep is not None and state["step"] % interval != 0
+                   and deep.shape[0] == sample.shape[0] and deep.shape[-2:] == sample.shape[-2:])
+        state["step"] += 1
+        if not shallow:
+            inc("deep_cache_steps_total", status="full")
+            state["capture"] = True
+            try:
+                return forward(sample, timestep, encoder_hidden_states, *args, return_dict=return_dict, **kwargs)
+            finally:
+                state["capture"] = False
+
+        inc("deep_cache_steps_total", status="shallow")
+        residuals = kwargs.get("down_block_additional_residuals")
+        noise_pred = _shallow_forward(unet, sample, timestep, kwargs["added_cond_kwargs"], deep,
+                                      None if residuals is None else residuals[:len(unet.up_blocks[-1].resnets)])
+        return UNet2DConditionOutput(sample=noise_pred) if return_dict else (noise_pred,)
+
+    unet.forward = deep_cache_forward
+    unet._deep_cache_state = state
+    print(f"DeepCache enabled for {type(pipe).__name__} (full UNet every {interval} steps)")
+    return pipe
+
+
+def reset_deep_cache(pipe):
+    """Oublie les traits profonds de la génération précédente (à appeler au début de chaque génération)"""
+    state = getattr(pipe.unet, "_deep_cache_state", None)
+    if state is not None:
+        state.update(step=0, deep=None, capture=False)
@@ -0,0 +1,92 @@
+import time
+import threading
+
+from config.constants import CONTROLNET_TIER, GUIDANCE_SCHEDULE, CFG_CUTOFF, TOKEN_MERGING_RATIO, PRODUCT_CONDITIONING_SCALE
+from models.controlnet_budget import apply_controlnet_budget
+from models.deep_cache import reset_deep_cache
+from models.guidance import GuidanceSchedule
+from models.memory_budget import apply_memory_plan
+from models.product_conditioning import load_product_adapter, apply_product_conditioning
+from models.style_adapters import activate_style
+from models.token_merging import apply_token_merging, token_merging_ratio
+from models.preview_decoder import decode_preview
+from utils.metrics import observe, record_stage, sample_memory, timed
+
+_locks_guard = threading.Lock()
+
+
+def pipeline_lock(pipe):
+    """Verrou de génération propre à un pipeline (partagé entre sessions via st.cache_resource)
+
+    Style LoRA, planning de guidance, caches de pas, embedding produit et fusion de tokens vivent sur le
+    pipeline ou son UNet: une seule génération à la fois les configure puis débruite.
+    """
+    with _locks_guard:
+        lock = getattr(pipe, "_generation_lock", None)
+        if lock is None:
+            lock = pipe._generation_lock = threading.Lock()
+    return lock
+
+
+def run_pipeline(pipe, mode, step_callbacks=(), decoder="full", controlnet_tier=CONTROLNET_TIER,
+                 guidance_schedule=GUIDANCE_SCHEDULE, cfg_cutoff=CFG_CUTOFF, token_merging=TOKEN_MERGING_RATIO,
+                 product_embeds=None, product_scale=PRODUCT_CONDITIONING_SCALE, style=None, **call_kwargs):
+    """Exécute un pipeline diffusers en mesurant débruitage et décodage VAE séparément
+
+    decoder="preview" saute le VAE complet et décode les latents finaux avec TAESD (brouillon);
+    decoder="latent" renvoie les latents finaux sans décodage. controlnet_tier fixe la fenêtre et la
+    réutilisation des résidus ControlNet (sans effet sur les pipelines sans ControlNet);
+    guidance_schedule et cfg_cutoff le planning de guidance des derniers pas; token_merging la part de
+    tokens fusionnés avant l'auto-attention (brouillons seulement, sauf configuration contraire);
+    product_embeds l'embedding d'image des produits sélectionnés (IP-Adapter, échelle product_scale);
+    style la LoRA de style à activer (None: UNet de base). Tout l'état par rendu est fixé puis consommé
+    sous le verrou du pipeline: une session concurrente ne peut pas le modifier en cours de débruitage.
+    """
+    timings = {"start": None, "last_step": None}
+    callbacks = list(step_callbacks)
+
+    def on_step_end(pipeline, step, timestep, callback_kwargs):
+        now = time.perf_counter()
+        previous = timings["last_step"] or timings["start"]
+        observe("denoising_step_seconds", now - previous, mode=mode)
+        timings["last_step"] = now
+        sample_memory()
+        for callback in callbacks:
+            callback_kwargs = callback(pipeline, step, timestep, callback_kwargs) or callback_kwargs
+        return callback_kwargs
+
+    if decoder in ("preview", "latent"):
+        call_kwargs["output_type"] = "latent"
+
+    with pipeline_lock(pipe):
+        with timed("style_adapter", mode=mode):
+            activate_style(pipe, style)
+        # Le planning de guidance passe en premier: il fixe l'échelle du pas suivant
+        callbacks.insert(0, GuidanceSchedule(pipe, guidance_schedule, cfg_cutoff))
+
+        # Caches de pas (DeepCache, résidus ControlNet) remis à zéro: rien ne fuit d'une génération interrompue
+        reset_deep_cache(pipe)
+        apply_controlnet_budget(pipe, controlnet_tier, call_kwargs)
+        # Avant le plan mémoire: le chargement de l'IP-Adapter remplace tous les processeurs d'attention
+        load_product_adapter(pipe, product_embeds, product_scale)
+        apply_memory_plan(pipe, mode, call_kwargs)
+        # Après le plan mémoire: le slicing d'attention remplace les processeurs
+        apply_product_conditioning(pipe, product_embeds, product_scale)
+        token_merging = token_merging_ratio(decoder, token_merging)
+        # Appariement ToMe tiré avec la graine du rendu (premier générateur d'un lot)
+        generator = call_kwargs.get("generator")
+        generator = generator[0] if isinstance(generator, list) else generator
+        seed = generator.initial_seed() if generator is not None else 0
+        with apply_token_merging(pipe, token_merging, seed), \
+                timed("generation", mode=mode, decoder=decoder, guidance=guidance_schedule, token_merging=token_merging):
+            timings["start"] = time.perf_counter()
+            result = pipe(callback_on_step_end=on_step_end, **call_kwargs)
+            if decoder == "preview":
+                result.images = decode_preview(result.images)
+
+            # Tout ce qui suit le dernier pas (décodage VAE, post-traitement) est imputé au décodage
+            end = time.perf_counter()
+            last_step = timings["last_step"] or end
+            record_stage("denoising", last_step - timings["start"], mode=mode)
+            record_stage("vae_decode", end - last_step, mode=mode, decoder=decoder)
+    return result
@@ -0,0 +1,173 @@
+import sys
+import math
+import time
+import argparse
+import torch
+
+from config.constants import GUIDANCE_SCHEDULES, GUIDANCE_SCHEDULE, CFG_CUTOFF
+from utils.metrics import inc, psnr, results_path, write_results
+
+
+def _halve(value, batch):
+    """Moitié conditionnelle d'un tenseur de lot CFG (négatifs d'abord, positifs ensuite)"""
+    if torch.is_tensor(value) and value.dim() > 0 and value.shape[0] == batch:
+        return value[batch // 2:]
+    if isinstance(value, (list, tuple)):
+        return type(value)(_halve(v, batch) for v in value)
+    if isinstance(value, dict):
+        return {k: _halve(v, batch) for k, v in value.items()}
+    return value
+
+
+def _guidance_state(pipe):
+    return getattr(pipe, "_cfg_state", None) or {"ratio": 1.0, "truncated": False}
+
+
+def enable_guidance_schedule(pipe):
+    """Remplace unet.forward (et controlnet.forward) sur l'instance pour appliquer le planning de guidance
+
+    Les pipelines doublent toujours le lot (négatif, positif) et combinent u + g * (c - u) avec leur
+    échelle initiale g. Le wrapper réécrit la moitié négative pour obtenir l'échelle planifiée; une fois
+    la CFG tronquée, seule la moitié conditionnelle est calculée et renvoyée en double (u = c).
+    """
+    if getattr(pipe.unet, "_cfg_wrapped", False):
+        return pipe
+    unet_forward = pipe.unet.forward
+
+    def guided_unet_forward(sample, timestep, encoder_hidden_states, *args, return_dict=True, **kwargs):
+        from diffusers.models.unet_2d_condition import UNet2DConditionOutput
+
+        state = _guidance_state(pipe)
+        batch = sample.shape[0]
+        if batch % 2 or (not state["truncated"] and state["ratio"] == 1.0):
+            return unet_forward(sample, timestep, encoder_hidden_states, *args, return_dict=return_dict, **kwargs)
+        if state["truncated"]:
+            inc("unet_passes_total", guidance="conditional_only")
+            noise_pred = unet_forward(_halve(sample, batch), _halve(timestep, batch), _halve(encoder_hidden_states, batch),
+                                      *args, return_dict=False, **_halve(kwargs, batch))[0]
+            noise_pred = torch.cat([noise_pred, noise_pred])
+        else:
+            noise_pred = unet_forward(sample, timestep, encoder_hidden_states, *args, return_dict=False, **kwargs)[0]
+            uncond, cond = noise_pred.chunk(2)
+            noise_pred = torch.cat([cond + state["ratio"] * (uncond - cond), cond])
+        return UNet2DConditionOutput(sample=noise_pred) if return_dict else (noise_pred,)
+
+    pipe.unet.forward = guided_unet_forward
+    pipe.unet._cfg_wrapped = True
+
+    controlnet = getattr(pipe, "controlnet", None)
+    if controlnet is not None:
+        controlnet_forward = controlnet.forward
+
+        def guided_controlnet_forward(sample, timestep, encoder_hidden_states, controlnet_cond, *args,
+                                      return_dict=True, **kwargs):
+            from diffusers.models.controlnet import ControlNetOutput
+
+            batch = sample.shape[0]
+            if batch % 2 or not _guidance_state(pipe)["truncated"]:
+                return controlnet_forward(sample, timestep, encoder_hidden_states, controlnet_cond, *args,
+                                          return_dict=return_dict, **kwargs)
+            down, mid = controlnet_forward(_halve(sample, batch), _halve(timestep, batch),
+                                           _halve(encoder_hidden_states, batch), _halve(controlnet_cond, batch),
+                                           *args, return_dict=False, **_halve(kwargs, batch))
+            # Le wrapper de l'UNet ne garde que la moitié conditionnelle: la répétition n'est jamais calculée
+            down = None if down is None else [torch.cat([r, r]) for r in down]
+            mid = None if mid is None else torch.cat([mid, mid])
+            return ControlNetOutput(down_block_res_samples=down, mid_block_res_sample=mid) if return_dict else (down, mid)
+
+        controlnet.forward = guided_controlnet_forward
+    return pipe
+
+
+class GuidanceSchedule:
+    """Callback de pas: échelle de guidance du pas suivant selon le planning ("constant", "truncate", "decay")
+
+    "truncate" garde l'échelle initiale jusqu'à `cutoff` (fraction des pas) puis coupe la CFG;
+    "decay" la fait décroître linéairement jusqu'à 1 à `cutoff`, puis la coupe.
+    """
+
+    def __init__(self, pipe, schedule=GUIDANCE_SCHEDULE, cutoff=CFG_CUTOFF):
+        if schedule not in GUIDANCE_SCHEDULES:
+            raise ValueError(f"Unknown guidance schedule {schedule!r}, expected one of {GUIDANCE_SCHEDULES}")
+        self.schedule = schedule
+        self.cutoff = cutoff
+        pipe._cfg_state = {"ratio": 1.0, "truncated": False}
+
+    def scale_at(self, base, progress):
+        """Échelle planifiée à une fraction donnée de la génération"""
+        if self.schedule == "constant" or base <= 1:
+            return base
+        if progress >= self.cutoff:
+            return 1.0
+        if self.schedule == "decay":
+            return 1.0 + (base - 1.0) * (1.0 - progress / self.cutoff)
+        return base
+
+    def __call__(self, pipeline, step, timestep, callback_kwargs):
+        if self.schedule == "constant":
+            return callback_kwargs
+        total = getattr(pipeline, "_num_timesteps", None) or 1
+        base = pipeline.guidance_scale
+        scale = self.scale_at(base, (step + 1) / total)
+        # Une fois la CFG coupée, le reste de la génération n'évalue plus la branche négative
+        pipeline._cfg_state = {"ratio": (scale - 1.0) / (base - 1.0) if base > 1 else 1.0,
+                               "truncated": scale <= 1.0 and base > 1}
+        return callback_kwargs
+
+
+def cfg_passes(schedule, steps, cutoff=CFG_CUTOFF):
+    """Nombre d'évaluations de l'UNet (par image) sur toute la génération"""
+    if schedule == "constant":
+        return 2 * steps
+    full = max(1, math.ceil(cutoff * steps))
+    return 2 * min(full, steps) + max(0, steps - full)
+
+
+def benchmark(image_path, steps, seed, cutoffs):
+    """Latence et écart au rendu CFG constant (PSNR) pour chaque planning et seuil de coupure"""
+    from PIL import Image
+    from diffusers import StableDiffusionXLInpaintPipeline
+    from models.generation import run_pipeline
+    from models.model_loader import SDXL_INPAINT_MODEL_ID
+    from utils.image_processing import generate_inpainting_mask
+
+    image = Image.open(image_path).convert("RGB").resize((512, 512))
+    mask = generate_inpainting_mask(image.size, strategy="center_rect")
+    pipe = enable_guidance_schedule(StableDiffusionXLInpaintPipeline.from_pretrained(SDXL_INPAINT_MODEL_ID,
+                                                                                      torch_dtype=torch.float32))
+
+    runs = [("constant", 1.0)] + [(schedule, cutoff) for schedule in ("truncate", "decay") for cutoff in cutoffs]
+    report = {"steps": steps, "seed": seed}
+    reference = None
+    for schedule, cutoff in runs:
+        start = time.perf_counter()
+        image_out = run_pipeline(pipe, "benchmark", guidance_schedule=schedule, cfg_cutoff=cutoff,
+                                 prompt="a cozy living room with a grey sofa and a wooden coffee table", image=image,
+                                 mask_image=mask, width=512, height=512, num_inference_steps=steps, guidance_scale=7.5,
+                                 generator=torch.Generator("cpu").manual_seed(seed)).images[0]
+        latency = time.perf_counter() - start
+        if reference is None:
+            reference = image_out
+        name = schedule if schedule == "constant" else f"{schedule}@{cutoff}"
+        image_out.save(results_path(f"guidance_{name.replace('@', '_')}.png"))
+        report[name] = {"latency_s": latency, "unet_passes": cfg_passes(schedule, steps, cutoff),
+                        "psnr_vs_constant_db": psnr(reference, image_out)}
+
+    write_results("guidance_benchmark.json", report)
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Latence et qualité des plannings de guidance (troncature, décroissance)")
+    parser.add_argument("--image", required=True, help="Image de pièce servant de référence")
+    parser.add_argument("--steps", type=int, default=30)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--cutoffs", default="0.5,0.75", help="Fractions des pas après lesquelles la CFG est coupée")
+    args = parser.parse_args(argv)
+
+    benchmark(args.image, args.steps, args.seed, [float(c) for c in args.cutoffs.split(",")])
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,352 @@
+import io
+import os
+import sys
+import json
+import time
+import glob
+import fcntl
+import random
+import shutil
+import hashlib
+import tarfile
+import argparse
+import contextlib
+import tempfile
+import subprocess
+
+from config.constants import IKEA_BASE_PATH, IKEA_DATASET_DIR, IKEA_CATALOG_FILE, IKEA_BUNDLE_DIR, IKEA_IMAGE_EMBEDS_DIR
+
+BUNDLE_FORMAT = 1
+MANIFEST_NAME = "manifest.json"
+DELTA_NAME = "delta.json"
+IKEA_REPO_URL = "https://github.com/IvonaTau/ikea.git"
+
+
+def _sha256(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def build_manifest(root, version):
+    """Calcule le manifeste (taille et sha256 de chaque fichier) d'une arborescence"""
+    files = {}
+    for dirpath, _, filenames in os.walk(root):
+        for filename in sorted(filenames):
+            path = os.path.join(dirpath, filename)
+            rel_path = os.path.relpath(path, root).replace(os.sep, "/")
+            if rel_path == MANIFEST_NAME:
+                continue
+            files[rel_path] = {"sha256": _sha256(path), "size": os.path.getsize(path)}
+    return {"format": BUNDLE_FORMAT, "version": version, "created": time.time(), "files": files}
+
+
+def verify_tree(root, manifest):
+    """Retourne la liste des fichiers absents ou corrompus par rapport au manifeste"""
+    errors = []
+    for rel_path, info in manifest["files"].items():
+        path = os.path.join(root, rel_path)
+        if not os.path.isfile(path) or os.path.getsize(path) != info["size"] or _sha256(path) != info["sha256"]:
+            errors.append(rel_path)
+    return errors
+
+
+def read_manifest(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def installed_version(dataset_dir=IKEA_DATASET_DIR):
+    """Version du bundle installé, ou None"""
+    manifest_path = os.path.join(dataset_dir, MANIFEST_NAME)
+    if not os.path.exists(manifest_path):
+        return None
+    return read_manifest(manifest_path).get("version")
+
+
+def resolve_catalog_paths(catalog, dataset_dir):
+    """Joint au dossier du dataset les chemins d'images du catalogue (relatifs à ce dossier)
+
+    Les anciens catalogues stockaient des chemins relatifs au dossier courant: ils restent lus tels quels
+    quand seul ce chemin existe.
+    """
+    for items in catalog.values():
+        for item in items:
+            image_path = item.get("image_path")
+            if not image_path:
+                continue
+            path = os.path.join(dataset_dir, image_path)
+            if os.path.exists(path) or not os.path.exists(image_path):
+                item["image_path"] = path
+    return catalog
+
+
+def stage_dataset(source_dir, staging_dir, version, image_embeds=False):
+    """Prépare l'arborescence du dataset: images, métadonnées, catalogue, index (et embeddings d'image)"""
+    from models.ikea_store import convert_ikea_pickles, open_metadata_tables
+    from models.ikea_retrieval import build_bm25_index
+    from models.ikea_data import scan_ikea_dataset
+
+    shutil.copytree(os.path.join(source_dir, "images"), os.path.join(staging_dir, "images"))
+
+    metadata_dir = os.path.join(staging_dir, "metadata")
+    convert_ikea_pickles(os.path.join(source_dir, "text_data"), metadata_dir)
+    _, img_to_desc = open_metadata_tables(metadata_dir)
+    build_bm25_index(img_to_desc).save(os.path.join(staging_dir, "retrieval"))
+
+    # Catalogue reproductible d'une construction à l'autre; le fichier garde des chemins relatifs au dataset,
+    # joints au dossier réellement installé au chargement
+    catalog_file = os.path.join(staging_dir, os.path.basename(IKEA_CATALOG_FILE))
+    catalog = scan_ikea_dataset(staging_dir, catalog_file, rng=random.Random(version))
+    if image_embeds:
+        from models.product_conditioning import build_product_embeddings
+        build_product_embeddings(catalog, os.path.join(staging_dir, os.path.basename(IKEA_IMAGE_EMBEDS_DIR)))
+
+
+def bundle_paths(version, output_dir=IKEA_BUNDLE_DIR):
+    """Chemins de l'archive et de son manifeste pour une version"""
+    base = os.path.join(output_dir, f"ikea-{version}")
+    return f"{base}.tar", f"{base}.manifest.json"
+
+
+def build_bundle(source_dir, version, output_dir=IKEA_BUNDLE_DIR, image_embeds=False):
+    """Construit un bundle versionné et vérifiable à partir d'un clone du dépôt IKEA"""
+    os.makedirs(output_dir, exist_ok=True)
+    bundle_path, manifest_path = bundle_paths(version, output_dir)
+
+    with tempfile.TemporaryDirectory(dir=output_dir) as staging_dir:
+        stage_dataset(source_dir, staging_dir, version, image_embeds)
+        manifest = build_manifest(staging_dir, version)
+        with open(os.path.join(staging_dir, MANIFEST_NAME), "w") as f:
+            json.dump(manifest, f, indent=2)
+
+        # Archive non compressée: les images le sont déjà et l'extraction reste rapide
+        with tarfile.open(f"{bundle_path}.tmp", "w") as tar:
+            for rel_path in [MANIFEST_NAME] + sorted(manifest["files"]):
+                tar.add(os.path.join(staging_dir, rel_path), arcname=rel_path)
+        os.replace(f"{bundle_path}.tmp", bundle_path)
+
+    with open(manifest_path, "w") as f:
+        json.dump(manifest, f, indent=2)
+    print(f"Built bundle {bundle_path} ({len(manifest['files'])} files)")
+    return bundle_path
+
+
+def build_delta(base_manifest_path, target_bundle_path, output_dir=IKEA_BUNDLE_DIR):
+    """Construit une archive différentielle entre un manifeste de base et un bundle cible"""
+    base = read_manifest(base_manifest_path)
+    with tarfile.open(target_bundle_path, "r") as tar:
+        target = json.load(tar.extractfile(MANIFEST_NAME))
+        changed = [path for path, info in target["files"].items()
+                   if base["files"].get(path, {}).get("sha256") != info["sha256"]]
+        removed = sorted(set(base["files"]) - set(target["files"]))
+        delta = {"format": BUNDLE_FORMAT, "base_version": base["version"], "version": target["version"],
+                 "changed": changed, "removed": removed}
+
+        delta_path = os.path.join(output_dir, f"ikea-{base['version']}-to-{target['version']}.delta.tar")
+        with tarfile.open(f"{delta_path}.tmp", "w") as out:
+            for name, payload in ((DELTA_NAME, delta), (MANIFEST_NAME, target)):
+                data = json.dumps(payload, indent=2).encode("utf-8")
+                info = tarfile.TarInfo(name)
+                info.size = len(data)
+                info.mtime = time.time()
+                out.addfile(info, io.BytesIO(data))
+            for rel_path in changed:
+                member = tar.getmember(rel_path)
+                out.addfile(member, tar.extractfile(member))
+        os.replace(f"{delta_path}.tmp", delta_path)
+
+    print(f"Built delta {delta_path} ({len(changed)} changed, {len(removed)} removed)")
+    return delta_path
+
+
+def _safe_members(tar):
+    for member in tar.getmembers():
+        if member.name.startswith("/") or ".." in member.name.split("/") or not (member.isfile() or member.isdir()):
+            raise ValueError(f"Entrée d'archive refusée: {member.name}")
+        yield member
+
+
+@contextlib.contextmanager
+def _install_lock(dataset_dir):
+    """Verrou exclusif inter-processus des installations (chaque worker prépare le dataset au démarrage)"""
+    dataset_dir = os.path.abspath(dataset_dir)
+    os.makedirs(os.path.dirname(dataset_dir), exist_ok=True)
+    with open(f"{dataset_dir}.lock", "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            # Restes d'une installation interrompue (préparation, lien temporaire, versions remplacées):
+            # sans risque, aucune autre installation ne tourne et le lien pointe vers la version active
+            # Bascule interrompue entre la mise de côté d'un ancien dossier et la pose du lien
+            if not os.path.lexists(dataset_dir) and os.path.isdir(f"{dataset_dir}.old"):
+                os.rename(f"{dataset_dir}.old", dataset_dir)
+            active = os.path.realpath(dataset_dir)
+            for leftover in glob.glob(f"{dataset_dir}.new-*") + glob.glob(f"{dataset_dir}.v-*"):
+                if os.path.realpath(leftover) != active:
+                    shutil.rmtree(leftover, ignore_errors=True)
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(f"{dataset_dir}.link")
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _swap_in(new_dir, dataset_dir):
+    """Bascule atomique: dataset_dir est un lien symbolique vers un dossier versionné, remplacé par os.replace
+
+    À aucun moment le chemin du dataset n'est absent pour les autres workers. Un ancien dataset qui est
+    un vrai dossier (installation antérieure) est mis de côté le temps du remplacement, puis restauré si
+    celui-ci échoue.
+    """
+    version_dir = f"{dataset_dir}.v-{new_dir.rsplit('.new-', 1)[-1]}"
+    os.rename(new_dir, version_dir)
+    link_path = f"{dataset_dir}.link"
+    os.symlink(os.path.basename(version_dir), link_path)
+
+    previous = os.path.realpath(dataset_dir) if os.path.islink(dataset_dir) else None
+    old_dir = None
+    if previous is None and os.path.exists(dataset_dir):
+        old_dir = f"{dataset_dir}.old"
+        os.rename(dataset_dir, old_dir)
+    try:
+        os.replace(link_path, dataset_dir)
+    except OSError:
+        if old_dir is not None:
+            os.rename(old_dir, dataset_dir)
+        os.remove(link_path)
+        shutil.rmtree(version_dir, ignore_errors=True)
+        raise
+    # Les processus qui ont encore des fichiers mappés gardent leurs inodes jusqu'à fermeture
+    for stale in (previous, old_dir):
+        if stale is not None:
+            shutil.rmtree(stale, ignore_errors=True)
+
+
+def install_bundle(bundle_path, dataset_dir=IKEA_DATASET_DIR):
+    """Installe un bundle complet ou différentiel après vérification des sommes de contrôle"""
+    with _install_lock(dataset_dir):
+        return _install_bundle(bundle_path, dataset_dir)
+
+
+def _install_bundle(bundle_path, dataset_dir):
+    # Dossier de préparation unique: jamais partagé avec une autre installation
+    dataset_dir = os.path.abspath(dataset_dir)
+    new_dir = tempfile.mkdtemp(dir=os.path.dirname(dataset_dir), prefix=f"{os.path.basename(dataset_dir)}.new-")
+
+    with tarfile.open(bundle_path, "r") as tar:
+        names = tar.getnames()
+        if DELTA_NAME in names:
+            delta = json.load(tar.extractfile(DELTA_NAME))
+            current = installed_version(dataset_dir)
+            if current != delta["base_version"]:
+                raise ValueError(f"Le delta s'applique à la version {delta['base_version']}, version installée: {current}")
+            # Liens physiques: seuls les fichiers modifiés sont réécrits
+            shutil.copytree(dataset_dir, new_dir, copy_function=os.link, dirs_exist_ok=True)
+            for rel_path in delta["removed"]:
+                os.remove(os.path.join(new_dir, rel_path))
+            for member in _safe_members(tar):
+                if member.name == DELTA_NAME:
+                    continue
+                target_path = os.path.join(new_dir, member.name)
+                if os.path.isfile(target_path):
+                    os.remove(target_path)
+                tar.extract(member, new_dir)
+        else:
+            tar.extractall(new_dir, members=_safe_members(tar))
+
+    manifest = read_manifest(os.path.join(new_dir, MANIFEST_NAME))
+    errors = verify_tree(new_dir, manifest)
+    if errors:
+        shutil.rmtree(new_dir, ignore_errors=True)
+        raise ValueError(f"Bundle corrompu ({len(errors)} fichiers invalides, ex: {errors[0]})")
+
+    _swap_in(new_dir, dataset_dir)
+    print(f"Installed IKEA dataset version {manifest['version']} into {dataset_dir}")
+    return manifest["version"]
+
+
+def latest_bundle(bundle_dir=IKEA_BUNDLE_DIR):
+    """Retourne (version, chemin) du bundle complet le plus récent disponible localement"""
+    if not os.path.isdir(bundle_dir):
+        return None, None
+    candidates = []
+    for filename in os.listdir(bundle_dir):
+        if filename.endswith(".manifest.json"):
+            manifest = read_manifest(os.path.join(bundle_dir, filename))
+            bundle_path, _ = bundle_paths(manifest["version"], bundle_dir)
+            if os.path.exists(bundle_path):
+                candidates.append((manifest["created"], manifest["version"], bundle_path))
+    if not candidates:
+        return None, None
+    _, version, bundle_path = max(candidates)
+    return version, bundle_path
+
+
+def install_latest_bundle(bundle_dir=IKEA_BUNDLE_DIR, dataset_dir=IKEA_DATASET_DIR):
+    """Met à jour le dataset installé vers le bundle le plus récent (delta si disponible)"""
+    version, bundle_path = latest_bundle(bundle_dir)
+    if version is None or version == installed_version(dataset_dir):
+        return installed_version(dataset_dir)
+
+    with _install_lock(dataset_dir):
+        # Un autre worker a pu installer cette version pendant l'attente du verrou
+        current = installed_version(dataset_dir)
+        if version == current:
+            return current
+        delta_path = os.path.join(bundle_dir, f"ikea-{current}-to-{version}.delta.tar")
+        if current is not None and os.path.exists(delta_path):
+            return _install_bundle(delta_path, dataset_dir)
+        return _install_bundle(bundle_path, dataset_dir)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Provisionnement du dataset IKEA sous forme de bundles versionnés")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    build_parser = subparsers.add_parser("build", help="Construit un bundle complet")
+    build_parser.add_argument("--source", default=IKEA_BASE_PATH, help="Clone local du dépôt IKEA")
+    build_parser.add_argument("--version", required=True)
+    build_parser.add_argument("--output", default=IKEA_BUNDLE_DIR)
+    build_parser.add_argument("--clone", action="store_true", help="Clone le dépôt IKEA si la source est absente")
+    build_parser.add_argument("--image-embeds", action="store_true",
+                              help="Inclut les embeddings d'image IP-Adapter du catalogue (encodeur CLIP requis)")
+
+    diff_parser = subparsers.add_parser("diff", help="Construit un delta entre deux versions")
+    diff_parser.add_argument("--base", required=True, help="Manifeste de la version de base")
+    diff_parser.add_argument("--target", required=True, help="Bundle complet de la version cible")
+    diff_parser.add_argument("--output", default=IKEA_BUNDLE_DIR)
+
+    install_parser = subparsers.add_parser("install", help="Installe un bundle (ou le plus récent)")
+    install_parser.add_argument("--bundle", default=None)
+    install_parser.add_argument("--dataset-dir", default=IKEA_DATASET_DIR)
+
+    verify_parser = subparsers.add_parser("verify", help="Vérifie le dataset installé")
+    verify_parser.add_argument("--dataset-dir", default=IKEA_DATASET_DIR)
+
+    args = parser.parse_args(argv)
+
+    if args.command == "build":
+        if not os.path.exists(args.source):
+            if not args.clone:
+                parser.error(f"Source introuvable: {args.source} (utilisez --clone sur une machine connectée)")
+            subprocess.run(["git", "clone", IKEA_REPO_URL, args.source], check=True)
+        build_bundle(args.source, args.version, args.output, args.image_embeds)
+    elif args.command == "diff":
+        build_delta(args.base, args.target, args.output)
+    elif args.command == "install":
+        if args.bundle:
+            install_bundle(args.bundle, args.dataset_dir)
+        else:
+            install_latest_bundle(dataset_dir=args.dataset_dir)
+    elif args.command == "verify":
+        errors = verify_tree(args.dataset_dir, read_manifest(os.path.join(args.dataset_dir, MANIFEST_NAME)))
+        for rel_path in errors:
+            print(f"Invalid: {rel_path}")
+        return 1 if errors else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,69 +1,113 @@
 import os
-import pickle
 import json
 import random
 import glob
-import subprocess
 import streamlit as st
-from config.constants import IKEA_BASE_PATH, IKEA_DATA_PATH, IKEA_DATASET_DIR, IKEA_CATALOG_FILE
+from config.constants import IKEA_DATASET_DIR, IKEA_CATALOG_FILE, IKEA_METADATA_DIR, IKEA_RETRIEVAL_DIR, IKEA_BUNDLE_DIR, IKEA_IMAGE_EMBEDS_DIR
+from models.ikea_bundle import install_latest_bundle, installed_version, resolve_catalog_paths
+from models.ikea_store import open_metadata_tables
+from models.ikea_retrieval import BM25Index
+from models.product_conditioning import ProductEmbeddings, IMAGE_ENCODER
 from utils.ui_components import show_notification, show_loading_spinner
 
+@st.cache_resource(show_spinner=False)
+def _open_ikea_metadata():
+    """Ouvre une seule fois par processus les tables de métadonnées mappées en mémoire"""
+    return open_metadata_tables(IKEA_METADATA_DIR)
+
 def load_ikea_metadata():
     """Charge les métadonnées IKEA pour le mode simple"""
     products_dict = None
     img_to_desc = None
-    print("Attempting to load IKEA metadata...")
     try:
-        # Clone le repo si non présent.
-        if not os.path.exists(IKEA_BASE_PATH):
-            print(f"IKEA repository not found at {IKEA_BASE_PATH}. Cloning now...")
-            subprocess.run(["git", "clone", "https://github.com/IvonaTau/ikea.git", IKEA_BASE_PATH], check=True)
-            print("IKEA repository cloned.")
-        else:
-            print(f"IKEA repository found at {IKEA_BASE_PATH}.")
-
-        with open(os.path.join(IKEA_DATA_PATH, "products_dict.p"), "rb") as f:
-            products_dict = pickle.load(f)
-        with open(os.path.join(IKEA_DATA_PATH, "img_to_desc.p"), "rb") as f:
-            img_to_desc = pickle.load(f)
-        print("Successfully loaded IKEA metadata (products_dict, img_to_desc).")
+        products_dict, img_to_desc = _open_ikea_metadata()
     except FileNotFoundError as fnf_error:
-        st.error(f"Error loading IKEA metadata: {fnf_error}. Make sure the IKEA repo is cloned to {IKEA_BASE_PATH} and contains the text_data directory.")
+        st.error(f"Error loading IKEA metadata: {fnf_error}. Install a dataset bundle with `python -m models.ikea_bundle install` (expected: {IKEA_METADATA_DIR}).")
     except Exception as e:
         st.error(f"Error loading IKEA metadata: {e}")
     return products_dict, img_to_desc
 
+@st.cache_resource(show_spinner=False)
+def _open_retrieval_index():
+    """Ouvre une seule fois par processus l'index BM25 construit hors ligne"""
+    return BM25Index.load(IKEA_RETRIEVAL_DIR)
+
+def load_retrieval_index():
+    """Charge l'index de recherche des descriptions IKEA (None s'il n'est pas construit)"""
+    try:
+        return _open_retrieval_index()
+    except FileNotFoundError:
+        print(f"IKEA retrieval index not found at {IKEA_RETRIEVAL_DIR}. Build it with `python -m models.ikea_retrieval`.")
+    except Exception as e:
+        print(f"Error loading IKEA retrieval index: {e}")
+    return None
+
+@st.cache_resource(show_spinner=False)
+def _open_product_embeddings():
+    """Ouvre une seule fois par processus les embeddings d'image du catalogue"""
+    return ProductEmbeddings.load(IKEA_IMAGE_EMBEDS_DIR)
+
+def load_product_embeddings():
+    """Charge les embeddings d'image IP-Adapter du catalogue (None s'ils ne sont pas calculés)"""
+    try:
+        embeddings = _open_product_embeddings()
+    except FileNotFoundError:
+        print(f"IKEA image embeddings not found at {IKEA_IMAGE_EMBEDS_DIR}. Build them with `python -m models.product_conditioning`.")
+        return None
+    except Exception as e:
+        print(f"Error loading IKEA image embeddings: {e}")
+        return None
+    if embeddings.encoder != IMAGE_ENCODER:
+        print(f"IKEA image embeddings were computed with {embeddings.encoder}, expected {IMAGE_ENCODER}. Rebuild them.")
+        return None
+    return embeddings
+
+@st.cache_resource(show_spinner=False)
+def prepare_ikea_dataset():
+    """Installe au démarrage le bundle local le plus récent (une fois par processus)"""
+    try:
+        return install_latest_bundle(IKEA_BUNDLE_DIR, IKEA_DATASET_DIR)
+    except Exception as e:
+        print(f"Error installing IKEA bundle from {IKEA_BUNDLE_DIR}: {e}")
+        return installed_version(IKEA_DATASET_DIR)
+
 def ensure_ikea_dataset():
-    """Garantit que le dataset IKEA est disponible, sinon le télécharge"""
-    if not os.path.exists(IKEA_DATASET_DIR):
-        with st.spinner("Téléchargement du dataset IKEA..."):
-            show_loading_spinner("Téléchargement du catalogue IKEA...")
-            st.info("Téléchargement du dataset IKEA depuis GitHub...")
+    """Garantit que le dataset IKEA est disponible à partir du bundle local"""
+    if installed_version(IKEA_DATASET_DIR) is None:
+        with st.spinner("Installation du dataset IKEA..."):
+            show_loading_spinner("Installation du catalogue IKEA...")
             try:
-                subprocess.check_call(["git", "clone", "https://github.com/IvonaTau/ikea.git", IKEA_DATASET_DIR])
-                show_notification("Dataset IKEA téléchargé avec succès!", "success")
+                prepare_ikea_dataset.clear()
+                if prepare_ikea_dataset() is None:
+                    st.error(f"Aucun bundle IKEA trouvé dans {IKEA_BUNDLE_DIR}. Construisez-le avec `python -m models.ikea_bundle build`.")
+                    return False
+                show_notification("Dataset IKEA installé avec succès!", "success")
                 return True
             except Exception as e:
-                st.error(f"Erreur lors du téléchargement du dataset IKEA: {e}")
-                os.makedirs(IKEA_DATASET_DIR, exist_ok=True)
+                st.error(f"Erreur lors de l'installation du dataset IKEA: {e}")
                 return False
     return True
 
-def scan_ikea_dataset():
-    """Analyse le dataset IKEA et crée un catalogue"""
-    if not os.path.exists(IKEA_DATASET_DIR):
+def scan_ikea_dataset(dataset_dir=IKEA_DATASET_DIR, catalog_file=IKEA_CATALOG_FILE, rng=random):
+    """Analyse le dataset IKEA et crée un catalogue
+
+    Le fichier du catalogue stocke des chemins d'images relatifs à dataset_dir; le catalogue renvoyé
+    les joint au dossier réel. rng fixe catégories et prix tirés au hasard (random.Random pour un
+    catalogue reproductible).
+    """
+    if not os.path.exists(dataset_dir):
         return {}
 
-    if os.path.exists(IKEA_CATALOG_FILE):
+    if os.path.exists(catalog_file):
         try:
-            with open(IKEA_CATALOG_FILE, 'r') as f:
-                return json.load(f)
+            with open(catalog_file, 'r') as f:
+                return resolve_catalog_paths(json.load(f), dataset_dir)
         except json.JSONDecodeError:
-            os.remove(IKEA_CATALOG_FILE)
+            os.remove(catalog_file)
 
     catalog = {}
-    rooms_dir = os.path.join(IKEA_DATASET_DIR, "rooms")
-    images_dir = os.path.join(IKEA_DATASET_DIR, "images")
+    rooms_dir = os.path.join(dataset_dir, "rooms")
+    images_dir = os.path.join(dataset_dir, "images")
 
     if not os.path.exists(rooms_dir) and not os.path.exists(images_dir):
         os.makedirs(rooms_dir, exist_ok=True)
@@ -84,7 +128,7 @@ def scan_ikea_dataset():
 
         for img_path in all_images:
             img_name = os.path.basename(img_path)
-            category = random.choice(default_categories)
+            category = rng.choice(default_categories)
             try:
                 os.rename(img_path, os.path.join(images_dir, category, img_name))
             except Exception as e:
@@ -115,12 +159,12 @@ def scan_ikea_dataset():
                 "name": f"IKEA {image_id.upper()}",
                 "category": category,
                 "description": f"Meuble IKEA de type {category}",
-                "image_path": image_path,
-                "price": f"{random.randint(49, 499)},99 €"
+                "image_path": os.path.relpath(image_path, dataset_dir).replace(os.sep, "/"),
+                "price": f"{rng.randint(49, 499)},99 €"
             })
 
-    os.makedirs(os.path.dirname(IKEA_CATALOG_FILE), exist_ok=True)
-    with open(IKEA_CATALOG_FILE, 'w') as f:
+    os.makedirs(os.path.dirname(catalog_file), exist_ok=True)
+    with open(catalog_file, 'w') as f:
         json.dump(catalog, f, indent=2)
 
-    return catalog
+    return resolve_catalog_paths(catalog, dataset_dir)
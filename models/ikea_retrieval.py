@@ -0,0 +1,194 @@
+import os
+import re
+import sys
+import json
+import time
+import argparse
+import numpy as np
+
+from config.constants import IKEA_METADATA_DIR, IKEA_RETRIEVAL_DIR
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+_TOKEN_RE = re.compile(r"[a-zà-ÿ0-9]+")
+
+_STOPWORDS = {
+    "a", "an", "the", "and", "or", "of", "for", "with", "in", "on", "to", "by", "is", "it", "this", "that",
+    "un", "une", "le", "la", "les", "de", "des", "du", "et", "ou", "avec", "en", "pour", "sur", "au", "aux",
+    "style", "ikea", "design",
+}
+
+# Les prompts utilisateurs sont en français, les descriptions IKEA en anglais
+_FR_TO_EN = {
+    "canapé": "sofa", "canape": "sofa", "fauteuil": "armchair", "chaise": "chair", "chaises": "chair",
+    "table": "table", "basse": "coffee", "lit": "bed", "lampe": "lamp", "suspension": "pendant",
+    "étagère": "shelf", "etagere": "shelf", "bibliothèque": "bookcase", "bureau": "desk",
+    "tapis": "rug", "horloge": "clock", "commode": "dresser", "armoire": "wardrobe", "miroir": "mirror",
+    "chevet": "nightstand", "coussins": "cushion", "coussin": "cushion", "rideaux": "curtain",
+    "bois": "wood", "verre": "glass", "métal": "metal", "metal": "metal", "tissu": "fabric", "cuir": "leather",
+    "gris": "grey", "blanc": "white", "noir": "black", "bleu": "blue", "vert": "green", "beige": "beige",
+    "salon": "living", "chambre": "bedroom", "cuisine": "kitchen", "manger": "dining", "bain": "bathroom",
+}
+
+
+def tokenize(text):
+    """Découpe un texte en termes normalisés (minuscules, sans mots vides, traduits en anglais)"""
+    tokens = []
+    for token in _TOKEN_RE.findall(str(text).lower()):
+        token = _FR_TO_EN.get(token, token)
+        if token not in _STOPWORDS and len(token) > 1:
+            tokens.append(token)
+    return tokens
+
+
+def description_text(value):
+    """Aplatit une valeur de métadonnées (texte, liste ou dictionnaire) en texte"""
+    if isinstance(value, dict):
+        return " ".join(description_text(v) for v in value.values())
+    if isinstance(value, (list, tuple)):
+        return " ".join(description_text(v) for v in value)
+    return str(value)
+
+
+class BM25Index:
+    """Index BM25 précalculé (listes inversées compressées, poids déjà pondérés)"""
+
+    def __init__(self, vocab, offsets, doc_ids, weights, doc_keys):
+        self.vocab = vocab
+        self.offsets = offsets
+        self.doc_ids = doc_ids
+        self.weights = weights
+        self.doc_keys = doc_keys
+
+    def search(self, query, k=3):
+        """Retourne les k clés de documents les plus pertinentes avec leur score"""
+        term_ids = {self.vocab[t] for t in tokenize(query) if t in self.vocab}
+        if not term_ids:
+            return []
+
+        scores = np.zeros(len(self.doc_keys), dtype=np.float32)
+        for term_id in term_ids:
+            start, end = self.offsets[term_id], self.offsets[term_id + 1]
+            # Un document n'apparaît qu'une fois par liste: l'indexation avancée suffit
+            scores[self.doc_ids[start:end]] += self.weights[start:end]
+
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(self.doc_keys[i], float(scores[i])) for i in top if scores[i] > 0]
+
+    def save(self, index_dir=IKEA_RETRIEVAL_DIR):
+        """Sauvegarde l'index (tableaux .npy chargeables par mmap)"""
+        os.makedirs(index_dir, exist_ok=True)
+        np.save(os.path.join(index_dir, "offsets.npy"), self.offsets)
+        np.save(os.path.join(index_dir, "doc_ids.npy"), self.doc_ids)
+        np.save(os.path.join(index_dir, "weights.npy"), self.weights)
+        with open(os.path.join(index_dir, "vocab.json"), "w") as f:
+            json.dump(self.vocab, f, ensure_ascii=False)
+        with open(os.path.join(index_dir, "doc_keys.json"), "w") as f:
+            json.dump(self.doc_keys, f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, index_dir=IKEA_RETRIEVAL_DIR):
+        """Charge un index construit hors ligne (tableaux mappés en mémoire)"""
+        with open(os.path.join(index_dir, "vocab.json")) as f:
+            vocab = json.load(f)
+        with open(os.path.join(index_dir, "doc_keys.json")) as f:
+            doc_keys = json.load(f)
+        return cls(
+            vocab,
+            np.load(os.path.join(index_dir, "offsets.npy"), mmap_mode="r"),
+            np.load(os.path.join(index_dir, "doc_ids.npy"), mmap_mode="r"),
+            np.load(os.path.join(index_dir, "weights.npy"), mmap_mode="r"),
+            doc_keys,
+        )
+
+
+def build_bm25_index(documents):
+    """Construit un index BM25 à partir d'un mapping clé -> description"""
+    doc_keys = []
+    doc_terms = []
+    for key, value in documents.items():
+        doc_keys.append(str(key))
+        doc_terms.append(tokenize(description_text(value)))
+
+    doc_lengths = np.array([len(terms) for terms in doc_terms], dtype=np.float32)
+    avg_length = float(doc_lengths.mean()) if len(doc_lengths) else 0.0
+
+    postings = {}
+    for doc_id, terms in enumerate(doc_terms):
+        counts = {}
+        for term in terms:
+            counts[term] = counts.get(term, 0) + 1
+        for term, tf in counts.items():
+            postings.setdefault(term, []).append((doc_id, tf))
+
+    vocab = {}
+    offsets = [0]
+    doc_ids = []
+    weights = []
+    n_docs = len(doc_keys)
+    for term in sorted(postings):
+        entries = postings[term]
+        idf = np.log(1.0 + (n_docs - len(entries) + 0.5) / (len(entries) + 0.5))
+        for doc_id, tf in entries:
+            norm = BM25_K1 * (1.0 - BM25_B + BM25_B * doc_lengths[doc_id] / max(avg_length, 1e-6))
+            doc_ids.append(doc_id)
+            weights.append(idf * tf * (BM25_K1 + 1.0) / (tf + norm))
+        vocab[term] = len(offsets) - 1
+        offsets.append(len(doc_ids))
+
+    return BM25Index(
+        vocab,
+        np.array(offsets, dtype=np.int64),
+        np.array(doc_ids, dtype=np.int32),
+        np.array(weights, dtype=np.float32),
+        doc_keys,
+    )
+
+
+def retrieve_product_descriptions(index, img_to_desc, query, k=3, max_words=12):
+    """Retourne les descriptions IKEA les plus proches de la requête (dédoublonnées, tronquées)"""
+    if index is None or img_to_desc is None or not query:
+        return []
+
+    descriptions = []
+    for doc_key, _ in index.search(query, k=k * 2):
+        text = " ".join(description_text(img_to_desc[doc_key]).split()[:max_words])
+        if text and text not in descriptions:
+            descriptions.append(text)
+        if len(descriptions) >= k:
+            break
+    return descriptions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Construction de l'index BM25 des descriptions IKEA")
+    parser.add_argument("--metadata", default=IKEA_METADATA_DIR, help="Dossier des tables de métadonnées")
+    parser.add_argument("--output", default=IKEA_RETRIEVAL_DIR, help="Dossier de sortie de l'index")
+    parser.add_argument("--benchmark", default=None, help="Requête à chronométrer après construction")
+    args = parser.parse_args(argv)
+
+    from models.ikea_store import open_metadata_tables
+    _, img_to_desc = open_metadata_tables(args.metadata)
+
+    start = time.perf_counter()
+    index = build_bm25_index(img_to_desc)
+    index.save(args.output)
+    print(f"Indexed {len(index.doc_keys)} descriptions ({len(index.vocab)} terms) in {time.perf_counter() - start:.1f}s")
+
+    if args.benchmark:
+        index = BM25Index.load(args.output)
+        runs = 200
+        start = time.perf_counter()
+        for _ in range(runs):
+            results = retrieve_product_descriptions(index, img_to_desc, args.benchmark)
+        print(f"Average retrieval latency: {(time.perf_counter() - start) / runs * 1000:.2f} ms")
+        for text in results:
+            print(f"  - {text}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,141 @@
+import os
+import sys
+import json
+import mmap
+import pickle
+import struct
+import argparse
+from collections.abc import Mapping
+
+from config.constants import IKEA_DATA_PATH, IKEA_METADATA_DIR
+
+# Format du fichier: en-tête | table d'entrées triées par clé | blob (clés + valeurs JSON)
+STORE_MAGIC = b"IKMT"
+STORE_VERSION = 1
+_HEADER = struct.Struct("<4sII")    # magic, version, nombre d'entrées
+_ENTRY = struct.Struct("<QIQI")     # offset clé, taille clé, offset valeur, taille valeur
+
+METADATA_TABLES = {
+    "products_dict": "products_dict.p",
+    "img_to_desc": "img_to_desc.p",
+}
+
+
+class MetadataTable(Mapping):
+    """Table clé/valeur en lecture seule, mappée en mémoire et partagée entre processus"""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, count = _HEADER.unpack_from(self._mm, 0)
+        if magic != STORE_MAGIC or version != STORE_VERSION:
+            raise ValueError(f"Format de table invalide: {path}")
+        self._count = count
+
+    def _entry(self, index):
+        return _ENTRY.unpack_from(self._mm, _HEADER.size + index * _ENTRY.size)
+
+    def _key_bytes(self, index):
+        key_offset, key_len, _, _ = self._entry(index)
+        return self._mm[key_offset:key_offset + key_len]
+
+    def _find(self, key):
+        target = str(key).encode("utf-8")
+        lo, hi = 0, self._count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._key_bytes(mid) < target:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self._count and self._key_bytes(lo) == target:
+            return lo
+        return -1
+
+    def key_at(self, index):
+        """Retourne la clé à la position donnée (ordre trié)"""
+        return self._key_bytes(index).decode("utf-8")
+
+    def value_at(self, index):
+        """Retourne la valeur décodée à la position donnée (ordre trié)"""
+        _, _, value_offset, value_len = self._entry(index)
+        return json.loads(self._mm[value_offset:value_offset + value_len])
+
+    def __getitem__(self, key):
+        index = self._find(key)
+        if index < 0:
+            raise KeyError(key)
+        return self.value_at(index)
+
+    def __contains__(self, key):
+        return self._find(key) >= 0
+
+    def __iter__(self):
+        for index in range(self._count):
+            yield self.key_at(index)
+
+    def __len__(self):
+        return self._count
+
+
+def write_metadata_table(mapping, path):
+    """Écrit un dictionnaire sous forme de table clé/offset (écriture atomique)"""
+    items = sorted(
+        (str(key).encode("utf-8"), json.dumps(value, ensure_ascii=False, default=str).encode("utf-8"))
+        for key, value in mapping.items()
+    )
+
+    blob_offset = _HEADER.size + len(items) * _ENTRY.size
+    entries = []
+    blob = bytearray()
+    for key_bytes, value_bytes in items:
+        key_offset = blob_offset + len(blob)
+        blob += key_bytes
+        value_offset = blob_offset + len(blob)
+        blob += value_bytes
+        entries.append(_ENTRY.pack(key_offset, len(key_bytes), value_offset, len(value_bytes)))
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.tmp{os.getpid()}"
+    with open(tmp_path, "wb") as f:
+        f.write(_HEADER.pack(STORE_MAGIC, STORE_VERSION, len(items)))
+        f.write(b"".join(entries))
+        f.write(blob)
+    os.replace(tmp_path, path)
+    return len(items)
+
+
+def table_path(name, metadata_dir=IKEA_METADATA_DIR):
+    """Chemin du fichier de table pour un jeu de métadonnées"""
+    return os.path.join(metadata_dir, f"{name}.tbl")
+
+
+def open_metadata_tables(metadata_dir=IKEA_METADATA_DIR):
+    """Ouvre les tables de métadonnées IKEA (products_dict, img_to_desc)"""
+    return tuple(MetadataTable(table_path(name, metadata_dir)) for name in METADATA_TABLES)
+
+
+def convert_ikea_pickles(source_dir=IKEA_DATA_PATH, metadata_dir=IKEA_METADATA_DIR):
+    """Convertit une fois pour toutes les pickles IKEA en tables mappées en mémoire"""
+    counts = {}
+    for name, pickle_name in METADATA_TABLES.items():
+        with open(os.path.join(source_dir, pickle_name), "rb") as f:
+            data = pickle.load(f)
+        counts[name] = write_metadata_table(data, table_path(name, metadata_dir))
+        print(f"Wrote {counts[name]} entries to {table_path(name, metadata_dir)}")
+    return counts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Conversion des métadonnées IKEA en tables mmap")
+    parser.add_argument("--source", default=IKEA_DATA_PATH, help="Dossier text_data contenant les pickles")
+    parser.add_argument("--output", default=IKEA_METADATA_DIR, help="Dossier de sortie des tables")
+    args = parser.parse_args(argv)
+
+    convert_ikea_pickles(args.source, args.output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,82 @@
+import hashlib
+import threading
+from collections import OrderedDict
+import torch
+
+from config.constants import LATENT_CACHE_SIZE
+from utils.metrics import inc, set_gauge
+
+
+class LatentCache:
+    """Cache LRU des sorties de vae.encode, clé (empreinte des pixels, résolution, dtype, révision du VAE)"""
+
+    def __init__(self, max_entries=LATENT_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._entries:
+                return None
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                inc("latent_cache_evictions_total")
+            set_gauge("latent_cache_entries", len(self._entries))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            set_gauge("latent_cache_entries", 0)
+
+
+# Partagé par tous les pipelines du processus: la révision du VAE fait partie de la clé
+LATENT_CACHE = LatentCache()
+
+
+def vae_revision(vae):
+    """Identifiant du VAE: dépôt d'origine et empreinte de sa configuration"""
+    config = dict(vae.config)
+    name = config.pop("_name_or_path", "vae")
+    return f"{name}@{hashlib.sha1(repr(sorted(config.items())).encode()).hexdigest()[:12]}"
+
+
+def tensor_digest(tensor):
+    """Empreinte du contenu d'un tenseur (quelques ms pour une image 1024x1024, face à un encodage VAE)"""
+    data = tensor.detach().contiguous().cpu()
+    return hashlib.blake2b(data.view(-1).view(torch.uint8).numpy().tobytes(), digest_size=16).hexdigest()
+
+
+def enable_latent_cache(pipe, cache=LATENT_CACHE):
+    """Remplace vae.encode sur l'instance: la pièce et la pièce masquée ne sont encodées qu'une fois
+
+    La distribution latente est mise en cache (pas un échantillon): le pipeline continue de tirer
+    ses latents avec son propre générateur, le résultat est identique à un encodage réel.
+    """
+    if cache.max_entries <= 0 or getattr(pipe.vae, "_latent_cache", None) is not None:
+        return pipe
+    vae = pipe.vae
+    encode = vae.encode
+    revision = vae_revision(vae)
+
+    def cached_encode(x, return_dict=True):
+        key = (tensor_digest(x), tuple(x.shape), str(x.dtype), str(x.device), revision)
+        output = cache.get(key)
+        if output is None:
+            inc("cache_misses_total", cache="room_latents")
+            output = encode(x, return_dict=True)
+            cache.put(key, output)
+        else:
+            inc("cache_hits_total", cache="room_latents")
+        return output if return_dict else (output.latent_dist,)
+
+    vae.encode = cached_encode
+    vae._latent_cache = cache
+    return pipe
@@ -0,0 +1,107 @@
+import torch
+
+from config.constants import MEMORY_BUDGET_MB
+from utils.metrics import resident_memory_bytes, log_event
+
+# Mesures d'économie de mémoire, de la moins coûteuse en latence à la plus coûteuse
+MEMORY_MEASURES = ("attention_slicing", "vae_slicing", "vae_tiling", "sequential_cpu_offload")
+
+# Tuiles VAE plus petites que la valeur par défaut SDXL (1024 px) pour borner le pic à haute résolution
+VAE_TILE_SIZE = 512
+
+# Le décodeur VAE garde environ 6 cartes de 128 canaux à pleine résolution en vie simultanément
+_VAE_LIVE_MAPS = 6
+_VAE_CHANNELS = 128
+
+
+def render_size(pipe, call_kwargs):
+    """Résolution effective du rendu (les pipelines ControlNet suivent l'image, l'inpainting SDXL son défaut)"""
+    height, width = call_kwargs.get("height"), call_kwargs.get("width")
+    if height and width:
+        return width, height
+    image = call_kwargs.get("image")
+    if "controlnet" in pipe.components and hasattr(image, "size"):
+        return image.size[0] // 8 * 8, image.size[1] // 8 * 8
+    default = pipe.unet.config.sample_size * pipe.vae_scale_factor
+    return width or default, height or default
+
+
+def _activation_bytes(pipe, width, height, batch, measures):
+    """Estimation du pic d'activations: auto-attention de l'UNet ou décodage VAE, le plus gros des deux"""
+    bytes_per_value = 2 if pipe.unet.dtype in (torch.float16, torch.bfloat16) else 4
+    latent_w, latent_h = width // pipe.vae_scale_factor, height // pipe.vae_scale_factor
+
+    # SDXL: premier niveau d'attention à 1/2 de la résolution latente, 10 têtes, CFG double le lot
+    heads = 10
+    tokens = (latent_w // 2) * (latent_h // 2)
+    attention = 2 * batch * heads * tokens ** 2 * bytes_per_value
+    if "attention_slicing" in measures:
+        attention //= heads
+
+    vae_batch = 1 if "vae_slicing" in measures else batch
+    pixels = min(width, VAE_TILE_SIZE) * min(height, VAE_TILE_SIZE) if "vae_tiling" in measures else width * height
+    vae = vae_batch * _VAE_LIVE_MAPS * _VAE_CHANNELS * pixels * 4
+    return max(attention, vae)
+
+
+def _baseline_bytes():
+    if torch.cuda.is_available():
+        return torch.cuda.memory_allocated()
+    return resident_memory_bytes()
+
+
+def plan_memory(pipe, width, height, batch=1, budget_mb=MEMORY_BUDGET_MB):
+    """Plus petit ensemble de mesures dont le pic estimé tient dans le budget"""
+    if not budget_mb:
+        return (), 0
+    candidates = [m for m in MEMORY_MEASURES if m != "sequential_cpu_offload" or torch.cuda.is_available()]
+    if batch == 1:
+        candidates.remove("vae_slicing")
+    baseline = _baseline_bytes()
+    budget = budget_mb * 2**20
+    for count in range(len(candidates) + 1):
+        measures = tuple(candidates[:count])
+        estimate = baseline + _activation_bytes(pipe, width, height, batch, measures)
+        if estimate <= budget:
+            return measures, estimate
+    return measures, estimate
+
+
+def apply_memory_plan(pipe, mode, call_kwargs):
+    """Active ou désactive slicing/tiling/offload selon le budget et la résolution demandée"""
+    if not MEMORY_BUDGET_MB:
+        return ()
+    width, height = render_size(pipe, call_kwargs)
+    prompt = call_kwargs.get("prompt")
+    batch = call_kwargs.get("num_images_per_prompt", 1) * (len(prompt) if isinstance(prompt, list) else 1)
+    measures, estimate = plan_memory(pipe, width, height, batch)
+
+    # Ne touche aux processeurs d'attention qu'au changement d'état (disable réinstalle ceux par défaut)
+    slicing = "attention_slicing" in measures
+    if slicing != getattr(pipe, "_attention_slicing", False):
+        if slicing:
+            pipe.enable_attention_slicing("max")
+        else:
+            pipe.disable_attention_slicing()
+        pipe._attention_slicing = slicing
+    if "vae_slicing" in measures:
+        pipe.enable_vae_slicing()
+    else:
+        pipe.disable_vae_slicing()
+    if "vae_tiling" in measures:
+        pipe.vae.tile_sample_min_size = VAE_TILE_SIZE
+        pipe.vae.tile_latent_min_size = VAE_TILE_SIZE // pipe.vae_scale_factor
+        pipe.enable_vae_tiling()
+    else:
+        pipe.disable_vae_tiling()
+    if "sequential_cpu_offload" in measures and not getattr(pipe, "_sequential_offload", False):
+        # Irréversible: les hooks d'accelerate restent en place pour les générations suivantes
+        pipe.enable_sequential_cpu_offload()
+        pipe._sequential_offload = True
+
+    log_event("memory_plan", mode=mode, width=width, height=height, batch=batch, budget_mb=MEMORY_BUDGET_MB,
+              estimate_mb=round(estimate / 2**20), measures=list(measures))
+    if estimate > MEMORY_BUDGET_MB * 2**20:
+        print(f"Memory budget of {MEMORY_BUDGET_MB} MB likely exceeded at {width}x{height} "
+              f"(estimated {estimate / 2**20:.0f} MB with {', '.join(measures) or 'no measures'})")
+    return measures
@@ -8,14 +8,35 @@ from diffusers import (
     ControlNetModel,
     UniPCMultistepScheduler
 )
-from transformers import DPTFeatureExtractor, DPTForDepthEstimation
-from config.constants import DEVICE
+from transformers import DPTFeatureExtractor, DPTForDepthEstimation, AutoImageProcessor, AutoModelForDepthEstimation
+from config.constants import DEVICE, DEPTH_MODEL_ID, DEPTH_MODEL_IDS
+from models.quantization import quantization_enabled, load_quantized_component, quantized_sdxl_components
+from models.onnx_backend import onnx_enabled, enable_onnx_pipeline, enable_onnx_depth_model
+from models.cpu_fast_path import apply_cpu_fast_path
+from models.latent_cache import enable_latent_cache
+from models.controlnet_budget import enable_controlnet_budget
+from models.guidance import enable_guidance_schedule
+from models.deep_cache import enable_deep_cache
 from utils.ui_components import show_loading_spinner
+from utils.metrics import inc
+
+SDXL_INPAINT_MODEL_ID = "diffusers/stable-diffusion-xl-1.0-inpainting-0.1"
+SDXL_BASE_MODEL_ID = "stabilityai/stable-diffusion-xl-base-1.0"
+CONTROLNET_DEPTH_MODEL_ID = "diffusers/controlnet-depth-sdxl-1.0"
+
+def sdxl_quantized_components(model_id, pipeline):
+    """Composants SDXL pré-quantifiés à injecter dans from_pretrained (l'UNet reste float32 s'il passe par ONNX)"""
+    if not quantization_enabled():
+        return {}
+    if onnx_enabled(pipeline):
+        return quantized_sdxl_components(model_id, ("text_encoder", "text_encoder_2"))
+    return quantized_sdxl_components(model_id)
 
 @st.cache_resource(show_spinner=True)
 def load_inpainting_model():
     """Charge le modèle d'inpainting pour le mode simple"""
-    model_id = "diffusers/stable-diffusion-xl-1.0-inpainting-0.1"
+    inc("cache_misses_total", cache="inpainting_model")
+    model_id = SDXL_INPAINT_MODEL_ID
     pipe = None
     print(f"Attempting to load model {model_id} on {DEVICE}...")
 
@@ -25,6 +46,7 @@ def load_inpainting_model():
         load_kwargs["variant"] = "fp16"
     else: # CPU
         load_kwargs["torch_dtype"] = torch.float32
+        load_kwargs.update(sdxl_quantized_components(model_id, "simple"))
 
     try:
         pipe = StableDiffusionXLInpaintPipeline.from_pretrained(model_id, **load_kwargs)
@@ -51,24 +73,69 @@ def load_inpainting_model():
                 print(f"Successfully loaded {model_id} on CPU after CUDA failure.")
             except Exception as e_cpu:
                 print(f"Error loading model {model_id} on CPU as well: {e_cpu}")
+
+    # Accélérations communes au chargement nominal et au repli CPU
+    if pipe is not None:
+        if onnx_enabled("simple"):
+            enable_onnx_pipeline(pipe, model_id)
+        enable_deep_cache(pipe)
+        apply_cpu_fast_path(pipe)
+        enable_latent_cache(pipe)
+        enable_guidance_schedule(pipe)
     return pipe
 
+def load_depth_controlnet(pipeline):
+    """Charge le ControlNet de profondeur SDXL (int8 sur CPU si la quantification est activée)"""
+    if quantization_enabled() and not onnx_enabled(pipeline):
+        return load_quantized_component(CONTROLNET_DEPTH_MODEL_ID, "controlnet", ControlNetModel)
+    return ControlNetModel.from_pretrained(
+        CONTROLNET_DEPTH_MODEL_ID,
+        torch_dtype=torch.float16 if torch.cuda.is_available() else torch.float32
+    )
+
+@st.cache_resource(show_spinner=False)
+def load_depth_model(estimator="hybrid"):
+    """Charge un modèle de profondeur ("hybrid": DPT, "small": Depth Anything) une seule fois par processus"""
+    inc("cache_misses_total", cache="depth_model")
+    if estimator == "small":
+        model_id = DEPTH_MODEL_IDS["small"]
+        processor = AutoImageProcessor.from_pretrained(model_id)
+        if quantization_enabled():
+            model = load_quantized_component(model_id, "depth", AutoModelForDepthEstimation)
+        else:
+            model = AutoModelForDepthEstimation.from_pretrained(model_id)
+        return processor, model.eval()
+
+    processor = DPTFeatureExtractor.from_pretrained(DEPTH_MODEL_ID)
+    if onnx_enabled("depth"):
+        model = enable_onnx_depth_model(DPTForDepthEstimation.from_pretrained(DEPTH_MODEL_ID).eval(), DEPTH_MODEL_ID)
+    elif quantization_enabled():
+        model = load_quantized_component(DEPTH_MODEL_ID, "dpt", DPTForDepthEstimation)
+    else:
+        model = DPTForDepthEstimation.from_pretrained(DEPTH_MODEL_ID)
+    return processor, model.eval()
+
 @st.cache_resource(show_spinner=True)
 def load_controlnet_pipeline():
     """Charge le pipeline ControlNet pour la génération de meubles"""
+    inc("cache_misses_total", cache="controlnet_pipeline")
     try:
         with st.spinner("Chargement du pipeline ControlNet..."):
             show_loading_spinner("Préparation du modèle ControlNet...")
 
-            controlnet = ControlNetModel.from_pretrained(
-                "diffusers/controlnet-depth-sdxl-1.0",
-                torch_dtype=torch.float16 if torch.cuda.is_available() else torch.float32
-            )
+            controlnet = load_depth_controlnet("controlnet")
             pipe = StableDiffusionXLControlNetPipeline.from_pretrained(
-                "stabilityai/stable-diffusion-xl-base-1.0",
+                SDXL_BASE_MODEL_ID,
                 controlnet=controlnet,
-                torch_dtype=torch.float16 if torch.cuda.is_available() else torch.float32
+                torch_dtype=torch.float16 if torch.cuda.is_available() else torch.float32,
+                **sdxl_quantized_components(SDXL_BASE_MODEL_ID, "controlnet")
             )
+            if onnx_enabled("controlnet"):
+                enable_onnx_pipeline(pipe, SDXL_BASE_MODEL_ID, CONTROLNET_DEPTH_MODEL_ID)
+            enable_deep_cache(pipe)
+            apply_cpu_fast_path(pipe)
+            enable_controlnet_budget(pipe)
+            enable_guidance_schedule(pipe)
 
             if torch.cuda.is_available():
                 pipe.to("cuda")
@@ -85,19 +152,25 @@ def load_controlnet_pipeline():
 @st.cache_resource(show_spinner=True)
 def load_controlnet_inpaint_pipeline():
     """Charge le pipeline ControlNet Inpaint pour le mode IKEA"""
+    inc("cache_misses_total", cache="controlnet_inpaint_pipeline")
     try:
         with st.spinner("Chargement des modèles d'IA..."):
             show_loading_spinner("Chargement du modèle SDXL ControlNet...")
 
-            controlnet = ControlNetModel.from_pretrained(
-                "diffusers/controlnet-depth-sdxl-1.0",
-                torch_dtype=torch.float16 if torch.cuda.is_available() else torch.float32
-            )
+            controlnet = load_depth_controlnet("ikea")
             pipe = StableDiffusionXLControlNetInpaintPipeline.from_pretrained(
-                "stabilityai/stable-diffusion-xl-base-1.0",
+                SDXL_BASE_MODEL_ID,
                 controlnet=controlnet,
-                torch_dtype=torch.float16 if torch.cuda.is_available() else torch.float32
+                torch_dtype=torch.float16 if torch.cuda.is_available() else torch.float32,
+                **sdxl_quantized_components(SDXL_BASE_MODEL_ID, "ikea")
             )
+            if onnx_enabled("ikea"):
+                enable_onnx_pipeline(pipe, SDXL_BASE_MODEL_ID, CONTROLNET_DEPTH_MODEL_ID)
+            enable_deep_cache(pipe)
+            apply_cpu_fast_path(pipe)
+            enable_latent_cache(pipe)
+            enable_controlnet_budget(pipe)
+            enable_guidance_schedule(pipe)
 
             if torch.cuda.is_available():
                 pipe = pipe.to("cuda")
@@ -0,0 +1,460 @@
+import os
+import sys
+import time
+import shutil
+import argparse
+import numpy as np
+import torch
+
+from config.constants import DEVICE, ONNX_MODELS_DIR, INFERENCE_BACKENDS
+from utils.cpu_tuning import tuned_thread_count
+from utils.metrics import write_results
+
+ONNX_OPSET = 17
+
+# Tolérances de vérification ONNX Runtime vs PyTorch (float32, optimisations de graphe actives)
+VERIFY_ATOL = 1e-3
+VERIFY_RTOL = 1e-2
+
+_NUMPY_DTYPES = {torch.float32: np.float32, torch.float16: np.float16, torch.int64: np.int64}
+
+
+def onnx_enabled(pipeline):
+    """ONNX Runtime n'est utilisé que sur CPU et pour les pipelines qui le demandent"""
+    return INFERENCE_BACKENDS.get(pipeline) == "onnx" and DEVICE.type == "cpu"
+
+
+def onnx_model_path(model_id, component):
+    safe_id = model_id.replace("/", "--")
+    return os.path.join(ONNX_MODELS_DIR, safe_id, component, "model.onnx")
+
+
+class OnnxModel:
+    """Session ONNX Runtime CPU (optimisations de graphe complètes) appelée via IO binding"""
+
+    def __init__(self, path, threads):
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        options.intra_op_num_threads = threads
+        options.inter_op_num_threads = 1
+        start = time.perf_counter()
+        self.session = ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+        self.input_names = [i.name for i in self.session.get_inputs()]
+        self.output_names = [o.name for o in self.session.get_outputs()]
+        # Formes et types des sorties par formes d'entrée: les appels suivants écrivent dans des tampons torch
+        self._output_specs = {}
+        print(f"Loaded ONNX model {path} with {threads} threads in {time.perf_counter() - start:.1f}s")
+
+    def run(self, inputs, preallocated=None):
+        """Exécute la session sur des tenseurs torch CPU sans copie des entrées ni des sorties
+
+        Les sorties sont écrites directement dans des tenseurs torch liés à la session (fournis dans
+        preallocated, ou alloués d'après les formes vues au premier appel pour ces formes d'entrée).
+        Seul ce premier appel laisse ONNX Runtime allouer, puis copie ses sorties.
+        """
+        binding = self.session.io_binding()
+        keep_alive = []
+        for name in self.input_names:
+            tensor = inputs[name].detach().to("cpu").contiguous()
+            keep_alive.append(tensor)
+            binding.bind_input(name, "cpu", 0, _NUMPY_DTYPES[tensor.dtype], list(tensor.shape), tensor.data_ptr())
+
+        signature = tuple(tuple(tensor.shape) for tensor in keep_alive)
+        outputs = dict(preallocated or {})
+        for name, (shape, dtype) in self._output_specs.get(signature, {}).items():
+            if name not in outputs:
+                outputs[name] = torch.empty(shape, dtype=dtype)
+        for name in self.output_names:
+            if name in outputs:
+                out = outputs[name]
+                binding.bind_output(name, "cpu", 0, _NUMPY_DTYPES[out.dtype], list(out.shape), out.data_ptr())
+            else:
+                binding.bind_output(name, "cpu")
+
+        self.session.run_with_iobinding(binding)
+        if len(outputs) < len(self.output_names):
+            for name, value in zip(self.output_names, binding.get_outputs()):
+                if name not in outputs:
+                    outputs[name] = torch.from_numpy(value.numpy())
+            self._output_specs[signature] = {name: (tuple(out.shape), out.dtype) for name, out in outputs.items()}
+        return outputs
+
+
+# --- Graphes exportés: signatures à entrées tensorielles uniquement ---
+
+class _UNetGraph(torch.nn.Module):
+    def __init__(self, unet, num_residuals=0):
+        super().__init__()
+        self.unet = unet
+        self.num_residuals = num_residuals
+
+    def forward(self, sample, timestep, encoder_hidden_states, text_embeds, time_ids, *residuals):
+        down, mid = (list(residuals[:-1]), residuals[-1]) if residuals else (None, None)
+        return self.unet(sample, timestep, encoder_hidden_states,
+                         added_cond_kwargs={"text_embeds": text_embeds, "time_ids": time_ids},
+                         down_block_additional_residuals=down, mid_block_additional_residual=mid,
+                         return_dict=False)[0]
+
+
+class _ControlNetGraph(torch.nn.Module):
+    def __init__(self, controlnet):
+        super().__init__()
+        self.controlnet = controlnet
+
+    def forward(self, sample, timestep, encoder_hidden_states, controlnet_cond, text_embeds, time_ids):
+        down, mid = self.controlnet(sample, timestep, encoder_hidden_states, controlnet_cond, conditioning_scale=1.0,
+                                    added_cond_kwargs={"text_embeds": text_embeds, "time_ids": time_ids},
+                                    return_dict=False)
+        return (*down, mid)
+
+
+class _VaeDecoderGraph(torch.nn.Module):
+    def __init__(self, vae):
+        super().__init__()
+        self.vae = vae
+
+    def forward(self, latent):
+        return self.vae.decode(latent, return_dict=False)[0]
+
+
+class _DepthGraph(torch.nn.Module):
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, pixel_values):
+        return self.model(pixel_values=pixel_values).predicted_depth
+
+
+def _unet_dummy_inputs(unet, latent_size=64):
+    text_embeds_dim = unet.add_embedding.linear_1.in_features - 6 * unet.config.addition_time_embed_dim
+    return (
+        torch.randn(2, unet.config.in_channels, latent_size, latent_size),
+        torch.tensor([999.0]),
+        torch.randn(2, 77, unet.config.cross_attention_dim),
+        torch.randn(2, text_embeds_dim),
+        torch.randn(2, 6),
+    )
+
+
+def _controlnet_dummy_inputs(controlnet, latent_size=64):
+    sample, timestep, hidden, text_embeds, time_ids = _unet_dummy_inputs(controlnet, latent_size)
+    control = torch.rand(2, 3, latent_size * 8, latent_size * 8)
+    return sample, timestep, hidden, control, text_embeds, time_ids
+
+
+def _example_residuals(controlnet):
+    """Résidus ControlNet d'exemple servant d'entrées factices à l'export de l'UNet"""
+    with torch.no_grad():
+        return _ControlNetGraph(controlnet)(*_controlnet_dummy_inputs(controlnet))
+
+
+def _export(graph, args, path, input_names, output_names, dynamic_axes):
+    """Exporte un graphe dans un répertoire temporaire puis le met en place d'un bloc"""
+    final_dir = os.path.dirname(path)
+    tmp_dir = f"{final_dir}.tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    start = time.perf_counter()
+    with torch.no_grad():
+        torch.onnx.export(graph.eval(), args, os.path.join(tmp_dir, os.path.basename(path)),
+                          input_names=input_names, output_names=output_names, dynamic_axes=dynamic_axes,
+                          opset_version=ONNX_OPSET, do_constant_folding=True)
+    shutil.rmtree(final_dir, ignore_errors=True)
+    os.replace(tmp_dir, final_dir)
+    print(f"Exported {path} in {time.perf_counter() - start:.1f}s")
+    return path
+
+
+_LATENT_AXES = {0: "batch", 2: "height", 3: "width"}
+_UNET_INPUTS = ["sample", "timestep", "encoder_hidden_states", "text_embeds", "time_ids"]
+_UNET_AXES = {"sample": _LATENT_AXES, "timestep": {0: "timestep_batch"}, "encoder_hidden_states": {0: "batch", 1: "tokens"},
+              "text_embeds": {0: "batch"}, "time_ids": {0: "batch"}, "noise_pred": _LATENT_AXES}
+
+
+def _residual_names(count):
+    return [f"down_residual_{i}" for i in range(count - 1)] + ["mid_residual"]
+
+
+def export_unet(unet, model_id, residuals=None):
+    """Exporte l'UNet, avec entrées de résidus ControlNet si des résidus d'exemple sont fournis"""
+    component = "unet_controlnet" if residuals else "unet"
+    residuals = list(residuals or [])
+    names = _residual_names(len(residuals)) if residuals else []
+    axes = dict(_UNET_AXES, **{name: {0: "batch", 2: f"{name}_h", 3: f"{name}_w"} for name in names})
+    return _export(_UNetGraph(unet, len(residuals)), (*_unet_dummy_inputs(unet), *residuals),
+                   onnx_model_path(model_id, component), _UNET_INPUTS + names, ["noise_pred"], axes)
+
+
+def export_controlnet(controlnet, model_id):
+    args = _controlnet_dummy_inputs(controlnet)
+    with torch.no_grad():
+        num_outputs = len(_ControlNetGraph(controlnet)(*args))
+    names = _residual_names(num_outputs)
+    axes = {"sample": _LATENT_AXES, "timestep": {0: "timestep_batch"}, "encoder_hidden_states": {0: "batch", 1: "tokens"},
+            "controlnet_cond": {0: "batch", 2: "image_height", 3: "image_width"},
+            "text_embeds": {0: "batch"}, "time_ids": {0: "batch"},
+            **{name: {0: "batch", 2: f"{name}_h", 3: f"{name}_w"} for name in names}}
+    return _export(_ControlNetGraph(controlnet), args, onnx_model_path(model_id, "controlnet"),
+                   ["sample", "timestep", "encoder_hidden_states", "controlnet_cond", "text_embeds", "time_ids"], names, axes)
+
+
+def export_vae_decoder(vae, model_id):
+    latent = torch.randn(1, vae.config.latent_channels, 64, 64)
+    return _export(_VaeDecoderGraph(vae), (latent,), onnx_model_path(model_id, "vae_decoder"), ["latent"], ["image"],
+                   {"latent": _LATENT_AXES, "image": {0: "batch", 2: "image_height", 3: "image_width"}})
+
+
+def export_depth_model(model, model_id):
+    # DPT hybride: le processeur redimensionne toujours en 384x384, seule la taille de lot varie
+    pixel_values = torch.randn(1, 3, 384, 384)
+    return _export(_DepthGraph(model), (pixel_values,), onnx_model_path(model_id, "dpt"), ["pixel_values"],
+                   ["predicted_depth"], {"pixel_values": {0: "batch"}, "predicted_depth": {0: "batch"}})
+
+
+# --- Exécution: remplace forward sur l'instance (config, dtype et isinstance restent ceux du module torch) ---
+
+def _release_weights(module):
+    """Libère les poids torch devenus inutiles une fois la session ONNX prête"""
+    for tensor in list(module.parameters()) + list(module.buffers()):
+        tensor.data = torch.empty(0, dtype=tensor.dtype, device=tensor.device)
+
+
+def _check_unsupported(component, **kwargs):
+    used = [name for name, value in kwargs.items() if value not in (None, {}, False)]
+    if used:
+        raise NotImplementedError(f"ONNX {component} does not support: {', '.join(used)}")
+
+
+def _timestep_tensor(timestep):
+    return torch.as_tensor(timestep, dtype=torch.float32).reshape(-1)
+
+
+def _attach_unet(unet, plain, with_residuals):
+    from diffusers.models.unet_2d_condition import UNet2DConditionOutput
+
+    out_channels = unet.config.out_channels
+
+    def forward(sample, timestep, encoder_hidden_states, class_labels=None, timestep_cond=None, attention_mask=None,
+                cross_attention_kwargs=None, added_cond_kwargs=None, down_block_additional_residuals=None,
+                mid_block_additional_residual=None, down_intrablock_additional_residuals=None,
+                encoder_attention_mask=None, return_dict=True):
+        _check_unsupported("UNet", class_labels=class_labels, timestep_cond=timestep_cond, attention_mask=attention_mask,
+                           cross_attention_kwargs=cross_attention_kwargs,
+                           down_intrablock_additional_residuals=down_intrablock_additional_residuals,
+                           encoder_attention_mask=encoder_attention_mask)
+        inputs = {"sample": sample.float(), "timestep": _timestep_tensor(timestep),
+                  "encoder_hidden_states": encoder_hidden_states.float(),
+                  "text_embeds": added_cond_kwargs["text_embeds"].float(), "time_ids": added_cond_kwargs["time_ids"].float()}
+        model = plain
+        if down_block_additional_residuals is not None:
+            if with_residuals is None:
+                raise NotImplementedError("ONNX UNet was exported without ControlNet residual inputs")
+            residuals = list(down_block_additional_residuals) + [mid_block_additional_residual]
+            inputs.update({name: r.float() for name, r in zip(_residual_names(len(residuals)), residuals)})
+            model = with_residuals
+        elif plain is None:
+            raise NotImplementedError("ONNX UNet was exported only with ControlNet residual inputs")
+
+        noise_pred = torch.empty(sample.shape[0], out_channels, *sample.shape[2:], dtype=torch.float32)
+        noise_pred = model.run(inputs, preallocated={"noise_pred": noise_pred})["noise_pred"]
+        return UNet2DConditionOutput(sample=noise_pred) if return_dict else (noise_pred,)
+
+    unet.forward = forward
+
+
+def _attach_controlnet(controlnet, model):
+    from diffusers.models.controlnet import ControlNetOutput
+
+    def forward(sample, timestep, encoder_hidden_states, controlnet_cond, conditioning_scale=1.0, class_labels=None,
+                timestep_cond=None, attention_mask=None, added_cond_kwargs=None, cross_attention_kwargs=None,
+                guess_mode=False, return_dict=True):
+        _check_unsupported("ControlNet", class_labels=class_labels, timestep_cond=timestep_cond,
+                           attention_mask=attention_mask, cross_attention_kwargs=cross_attention_kwargs,
+                           guess_mode=guess_mode)
+        outputs = model.run({"sample": sample.float(), "timestep": _timestep_tensor(timestep),
+                             "encoder_hidden_states": encoder_hidden_states.float(),
+                             "controlnet_cond": controlnet_cond.float(),
+                             "text_embeds": added_cond_kwargs["text_embeds"].float(),
+                             "time_ids": added_cond_kwargs["time_ids"].float()})
+        # Graphe exporté avec une échelle de 1: l'échelle de conditionnement est appliquée ici
+        residuals = [outputs[name] * conditioning_scale for name in model.output_names]
+        down, mid = residuals[:-1], residuals[-1]
+        return ControlNetOutput(down_block_res_samples=down, mid_block_res_sample=mid) if return_dict else (down, mid)
+
+    controlnet.forward = forward
+
+
+def _attach_vae_decoder(vae, model):
+    from diffusers.models.autoencoders.vae import DecoderOutput
+
+    def decode(z, return_dict=True, generator=None):
+        image = model.run({"latent": z.float()})["image"]
+        return DecoderOutput(sample=image) if return_dict else (image,)
+
+    vae.decode = decode
+
+
+def _attach_depth_model(depth_model, model):
+    from transformers.modeling_outputs import DepthEstimatorOutput
+
+    def forward(pixel_values, head_mask=None, labels=None, output_attentions=None, output_hidden_states=None,
+                return_dict=None):
+        _check_unsupported("DPT", head_mask=head_mask, labels=labels, output_attentions=output_attentions,
+                           output_hidden_states=output_hidden_states)
+        return DepthEstimatorOutput(predicted_depth=model.run({"pixel_values": pixel_values.float()})["predicted_depth"])
+
+    depth_model.forward = forward
+
+
+def _ensure_exported(path, export):
+    if not os.path.exists(path):
+        print(f"ONNX model {path} not found, exporting it (one-time)...")
+        export()
+    return path
+
+
+def enable_onnx_pipeline(pipe, model_id, controlnet_id=None):
+    """Exécute l'UNet, le décodeur VAE et l'éventuel ControlNet d'un pipeline SDXL via ONNX Runtime"""
+    threads = tuned_thread_count("unet")
+    controlnet = getattr(pipe, "controlnet", None)
+    unet_paths = {}
+
+    if controlnet is not None:
+        cn_path = _ensure_exported(onnx_model_path(controlnet_id, "controlnet"),
+                                   lambda: export_controlnet(controlnet, controlnet_id))
+        unet_paths["with_residuals"] = _ensure_exported(onnx_model_path(model_id, "unet_controlnet"),
+                                                        lambda: export_unet(pipe.unet, model_id, _example_residuals(controlnet)))
+    else:
+        unet_paths["plain"] = _ensure_exported(onnx_model_path(model_id, "unet"), lambda: export_unet(pipe.unet, model_id))
+    # Variante sans résidus chargée si elle a été exportée (pas de ControlNet sur certains pas)
+    plain_path = onnx_model_path(model_id, "unet")
+    if "plain" not in unet_paths and os.path.exists(plain_path):
+        unet_paths["plain"] = plain_path
+    vae_path = _ensure_exported(onnx_model_path(model_id, "vae_decoder"), lambda: export_vae_decoder(pipe.vae, model_id))
+
+    sessions = {key: OnnxModel(path, threads) for key, path in unet_paths.items()}
+    _attach_unet(pipe.unet, sessions.get("plain"), sessions.get("with_residuals"))
+    _release_weights(pipe.unet)
+    if controlnet is not None:
+        _attach_controlnet(controlnet, OnnxModel(cn_path, threads))
+        _release_weights(controlnet)
+    # L'encodeur VAE reste en PyTorch (latents de l'image masquée)
+    _attach_vae_decoder(pipe.vae, OnnxModel(vae_path, threads))
+    _release_weights(pipe.vae.decoder)
+    _release_weights(pipe.vae.post_quant_conv)
+    print(f"ONNX Runtime backend enabled for {model_id} ({', '.join(unet_paths)} UNet)")
+    return pipe
+
+
+def enable_onnx_depth_model(model, model_id):
+    """Exécute DPT via ONNX Runtime"""
+    path = _ensure_exported(onnx_model_path(model_id, "dpt"), lambda: export_depth_model(model, model_id))
+    _attach_depth_model(model, OnnxModel(path, tuned_thread_count("dpt")))
+    _release_weights(model)
+    return model
+
+
+# --- Export hors ligne et vérification de l'équivalence avec PyTorch ---
+
+def _load_torch_components(pipeline):
+    """Modules torch float32 d'un pipeline, chargés sans pipeline complet"""
+    from diffusers import UNet2DConditionModel, AutoencoderKL, ControlNetModel
+    from transformers import DPTForDepthEstimation
+    from config.constants import DEPTH_MODEL_ID
+    from models.model_loader import SDXL_BASE_MODEL_ID, SDXL_INPAINT_MODEL_ID, CONTROLNET_DEPTH_MODEL_ID
+
+    if pipeline == "depth":
+        return DEPTH_MODEL_ID, None, {"dpt": DPTForDepthEstimation.from_pretrained(DEPTH_MODEL_ID).eval()}
+    model_id = SDXL_INPAINT_MODEL_ID if pipeline == "simple" else SDXL_BASE_MODEL_ID
+    components = {
+        "unet": UNet2DConditionModel.from_pretrained(model_id, subfolder="unet", torch_dtype=torch.float32).eval(),
+        "vae": AutoencoderKL.from_pretrained(model_id, subfolder="vae", torch_dtype=torch.float32).eval(),
+    }
+    controlnet_id = None
+    if pipeline in ("ikea", "controlnet"):
+        controlnet_id = CONTROLNET_DEPTH_MODEL_ID
+        components["controlnet"] = ControlNetModel.from_pretrained(controlnet_id, torch_dtype=torch.float32).eval()
+    return model_id, controlnet_id, components
+
+
+def export_pipeline(pipeline):
+    model_id, controlnet_id, components = _load_torch_components(pipeline)
+    if pipeline == "depth":
+        return [export_depth_model(components["dpt"], model_id)]
+    paths = [export_unet(components["unet"], model_id), export_vae_decoder(components["vae"], model_id)]
+    if "controlnet" in components:
+        controlnet = components["controlnet"]
+        paths.append(export_controlnet(controlnet, controlnet_id))
+        paths.append(export_unet(components["unet"], model_id, _example_residuals(controlnet)))
+    return paths
+
+
+def _compare(name, reference, candidate):
+    reference, candidate = reference.float(), candidate.float()
+    max_abs = float((reference - candidate).abs().max())
+    within = bool(torch.allclose(reference, candidate, atol=VERIFY_ATOL, rtol=VERIFY_RTOL))
+    print(f"{name}: max |torch - onnx| = {max_abs:.2e} ({'ok' if within else 'OUT OF TOLERANCE'})")
+    return {"max_abs_diff": max_abs, "within_tolerance": within}
+
+
+def verify_pipeline(pipeline, seed=0):
+    """Compare les sorties ONNX Runtime et PyTorch sur des entrées aléatoires"""
+    torch.manual_seed(seed)
+    model_id, controlnet_id, components = _load_torch_components(pipeline)
+    threads = tuned_thread_count("dpt" if pipeline == "depth" else "unet")
+    report = {}
+
+    with torch.no_grad():
+        if pipeline == "depth":
+            pixel_values = torch.randn(1, 3, 384, 384)
+            model = OnnxModel(onnx_model_path(model_id, "dpt"), threads)
+            report["dpt"] = _compare("dpt", _DepthGraph(components["dpt"])(pixel_values),
+                                     model.run({"pixel_values": pixel_values})["predicted_depth"])
+        else:
+            unet, vae = components["unet"], components["vae"]
+            args = _unet_dummy_inputs(unet)
+            if "controlnet" in components:
+                controlnet = components["controlnet"]
+                cn_args = _controlnet_dummy_inputs(controlnet)
+                args = (*cn_args[:3], *cn_args[4:])
+                residuals = _ControlNetGraph(controlnet)(*cn_args)
+                cn_model = OnnxModel(onnx_model_path(controlnet_id, "controlnet"), threads)
+                cn_inputs = dict(zip(["sample", "timestep", "encoder_hidden_states", "controlnet_cond", "text_embeds",
+                                      "time_ids"], cn_args))
+                cn_outputs = cn_model.run(cn_inputs)
+                report["controlnet"] = _compare("controlnet", torch.cat([r.flatten() for r in residuals]),
+                                                torch.cat([cn_outputs[n].flatten() for n in cn_model.output_names]))
+                unet_model = OnnxModel(onnx_model_path(model_id, "unet_controlnet"), threads)
+                unet_inputs = dict(zip(_UNET_INPUTS + _residual_names(len(residuals)), (*args, *residuals)))
+                report["unet_controlnet"] = _compare("unet_controlnet", _UNetGraph(unet)(*args, *residuals),
+                                                     unet_model.run(unet_inputs)["noise_pred"])
+            unet_model = OnnxModel(onnx_model_path(model_id, "unet"), threads)
+            report["unet"] = _compare("unet", _UNetGraph(unet)(*args), unet_model.run(dict(zip(_UNET_INPUTS, args)))["noise_pred"])
+
+            latent = torch.randn(1, vae.config.latent_channels, 64, 64)
+            vae_model = OnnxModel(onnx_model_path(model_id, "vae_decoder"), threads)
+            report["vae_decoder"] = _compare("vae_decoder", _VaeDecoderGraph(vae)(latent), vae_model.run({"latent": latent})["image"])
+
+    write_results(f"onnx_verify_{pipeline}.json", report, echo=False)
+    return all(entry["within_tolerance"] for entry in report.values())
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export et vérification des modèles ONNX Runtime (CPU)")
+    parser.add_argument("command", choices=["export", "verify"])
+    parser.add_argument("--pipeline", choices=sorted(INFERENCE_BACKENDS), required=True)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    if args.command == "export":
+        export_pipeline(args.pipeline)
+        return 0
+    return 0 if verify_pipeline(args.pipeline, args.seed) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,97 @@
+import time
+import numpy as np
+import torch
+import streamlit as st
+from PIL import Image
+
+from config.constants import DEVICE, PREVIEW_DECODER_ID, PREVIEW_EVERY_N_STEPS, PREVIEW_METHOD
+from utils.metrics import inc, observe, log_event
+
+# Projection linéaire latents SDXL -> RGB (coefficients ajustés par régression sur des décodages VAE)
+SDXL_LATENT_RGB_FACTORS = torch.tensor([
+    [0.3651, 0.4232, 0.4341],
+    [-0.2533, -0.0042, 0.1068],
+    [0.1076, 0.1111, -0.0362],
+    [-0.3165, -0.2492, -0.2188],
+])
+SDXL_LATENT_RGB_BIAS = torch.tensor([0.1084, -0.0175, -0.0011])
+
+PREVIEW_MAX_SIZE = 256
+
+
+@st.cache_resource(show_spinner=False)
+def load_preview_decoder():
+    """Charge le décodeur léger TAESD-XL (quelques Mo) utilisé pour les brouillons et aperçus"""
+    from diffusers import AutoencoderTiny
+
+    inc("cache_misses_total", cache="preview_decoder")
+    dtype = torch.float16 if DEVICE.type == "cuda" else torch.float32
+    decoder = AutoencoderTiny.from_pretrained(PREVIEW_DECODER_ID, torch_dtype=dtype).to(DEVICE)
+    return decoder.eval()
+
+
+def _to_pil(images):
+    """Tenseurs [-1, 1] (N, 3, H, W) -> images PIL"""
+    images = ((images.float().clamp(-1, 1) + 1) * 127.5).round().to(torch.uint8)
+    return [Image.fromarray(np.ascontiguousarray(image.permute(1, 2, 0).cpu().numpy())) for image in images]
+
+
+def decode_preview(latents):
+    """Décode des latents SDXL (espace de diffusion, déjà mis à l'échelle) en images PIL via TAESD"""
+    decoder = load_preview_decoder()
+    with torch.no_grad():
+        images = decoder.decode(latents.to(device=decoder.device, dtype=decoder.dtype)).sample
+    return _to_pil(images)
+
+
+def linear_preview(latents):
+    """Aperçu quasi gratuit: projection linéaire des 4 canaux latents vers RGB (1/8 de la résolution)"""
+    latents = latents.detach().float().cpu()
+    rgb = torch.einsum("nchw,cr->nrhw", latents, SDXL_LATENT_RGB_FACTORS) + SDXL_LATENT_RGB_BIAS[None, :, None, None]
+    return _to_pil(rgb)
+
+
+class LivePreview:
+    """Callback de pas: progression réelle et aperçu basse résolution toutes les N étapes"""
+
+    def __init__(self, mode, image_slot, total_steps, progress_bar=None, status_text=None,
+                 every=PREVIEW_EVERY_N_STEPS, method=PREVIEW_METHOD):
+        self.mode = mode
+        self.image_slot = image_slot
+        self.total_steps = total_steps
+        self.progress_bar = progress_bar
+        self.status_text = status_text
+        self.every = max(1, every)
+        self.method = method
+        self.previews = 0
+        self.overhead = 0.0
+        self.start = time.perf_counter()
+
+    def __call__(self, pipeline, step, timestep, callback_kwargs):
+        start = time.perf_counter()
+        # Les pipelines d'inpainting font moins de pas que demandé quand strength < 1
+        self.total_steps = getattr(pipeline, "_num_timesteps", None) or self.total_steps
+        done = step + 1
+        if self.progress_bar is not None:
+            self.progress_bar.progress(min(done / self.total_steps, 1.0))
+        if self.status_text is not None:
+            self.status_text.markdown(f"<h4>Débruitage: étape {done}/{self.total_steps}</h4>", unsafe_allow_html=True)
+
+        if self.method != "off" and (done % self.every == 0 or done == self.total_steps):
+            latents = callback_kwargs["latents"][:1]
+            preview = decode_preview(latents)[0] if self.method == "taesd" else linear_preview(latents)[0]
+            preview.thumbnail((PREVIEW_MAX_SIZE, PREVIEW_MAX_SIZE), Image.BILINEAR)
+            self.image_slot.image(preview, caption=f"Aperçu en cours ({done}/{self.total_steps})")
+            self.previews += 1
+
+        elapsed = time.perf_counter() - start
+        self.overhead += elapsed
+        observe("preview_seconds", elapsed, mode=self.mode, method=self.method)
+        return callback_kwargs
+
+    def finish(self):
+        """Journalise le surcoût des aperçus par rapport à la durée de la génération"""
+        total = time.perf_counter() - self.start
+        log_event("live_preview", mode=self.mode, method=self.method, every=self.every, previews=self.previews,
+                  overhead_s=round(self.overhead, 4), overhead_share=round(self.overhead / total, 4) if total else 0.0)
+        self.image_slot.empty()
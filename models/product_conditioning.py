@@ -0,0 +1,220 @@
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import numpy as np
+import torch
+
+from config.constants import (IKEA_CATALOG_FILE, IKEA_IMAGE_EMBEDS_DIR, IP_ADAPTER_MODEL_ID, IP_ADAPTER_SUBFOLDER,
+                              IP_ADAPTER_WEIGHTS, PRODUCT_CONDITIONING_SCALE)
+from utils.metrics import inc, log_event
+
+# Encodeur d'image de l'IP-Adapter: les embeddings en cache ne valent que pour lui
+IMAGE_ENCODER = f"{IP_ADAPTER_MODEL_ID}/{IP_ADAPTER_SUBFOLDER}/image_encoder"
+
+
+def product_key(category, catalog_id):
+    """Clé d'un produit du catalogue dans le cache d'embeddings"""
+    return f"{category}/{catalog_id}"
+
+
+class ProductEmbeddings:
+    """Embeddings d'image des produits du catalogue, précalculés hors ligne (tableau .npy mappé en mémoire)"""
+
+    def __init__(self, keys, embeds, encoder=IMAGE_ENCODER):
+        self.keys = keys
+        self.embeds = embeds
+        self.encoder = encoder
+        self._rows = {key: row for row, key in enumerate(keys)}
+
+    def lookup(self, items):
+        """Embedding moyen des meubles sélectionnés issus du catalogue (None si aucun n'est en cache)
+
+        Les meubles téléversés n'ont pas d'identifiant catalogue: ils sont ignorés.
+        """
+        rows = []
+        for item in items:
+            if item.get("catalog_id") is None:
+                continue
+            row = self._rows.get(product_key(item.get("category"), item["catalog_id"]))
+            inc("cache_hits_total" if row is not None else "cache_misses_total", cache="product_embeds")
+            if row is not None:
+                rows.append(row)
+        if not rows:
+            return None
+        return np.asarray(self.embeds[sorted(rows)], dtype=np.float32).mean(axis=0, keepdims=True)
+
+    def save(self, embeds_dir=IKEA_IMAGE_EMBEDS_DIR):
+        """Sauvegarde les embeddings (float16) et leurs clés"""
+        os.makedirs(embeds_dir, exist_ok=True)
+        np.save(os.path.join(embeds_dir, "embeds.npy"), np.asarray(self.embeds, dtype=np.float16))
+        with open(os.path.join(embeds_dir, "keys.json"), "w") as f:
+            json.dump({"encoder": self.encoder, "keys": self.keys}, f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, embeds_dir=IKEA_IMAGE_EMBEDS_DIR):
+        """Charge les embeddings calculés hors ligne (tableau mappé en mémoire)"""
+        with open(os.path.join(embeds_dir, "keys.json")) as f:
+            info = json.load(f)
+        return cls(info["keys"], np.load(os.path.join(embeds_dir, "embeds.npy"), mmap_mode="r"), info["encoder"])
+
+
+def _cutout(image, remove):
+    """Détourage du produit (rembg, comme à la sélection) sur fond blanc pour l'encodeur CLIP"""
+    from PIL import Image
+
+    cutout = remove(image).convert("RGBA")
+    background = Image.new("RGB", cutout.size, (255, 255, 255))
+    background.paste(cutout, mask=cutout.split()[-1])
+    return background
+
+
+def build_product_embeddings(catalog, embeds_dir=IKEA_IMAGE_EMBEDS_DIR, batch_size=32):
+    """Encode une fois le détourage de chaque produit du catalogue avec l'encodeur d'image de l'IP-Adapter"""
+    from PIL import Image
+    from rembg import remove
+    from transformers import CLIPImageProcessor, CLIPVisionModelWithProjection
+
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    encoder = CLIPVisionModelWithProjection.from_pretrained(
+        IP_ADAPTER_MODEL_ID, subfolder=f"{IP_ADAPTER_SUBFOLDER}/image_encoder").to(device).eval()
+    processor = CLIPImageProcessor()
+
+    items = [item for category_items in catalog.values() for item in category_items
+             if os.path.exists(item.get("image_path", ""))]
+    keys, chunks = [], []
+    start = time.perf_counter()
+    for offset in range(0, len(items), batch_size):
+        batch = items[offset:offset + batch_size]
+        pixels = processor(images=[_cutout(Image.open(item["image_path"]), remove) for item in batch],
+                           return_tensors="pt").pixel_values.to(device)
+        with torch.no_grad():
+            chunks.append(encoder(pixels).image_embeds.float().cpu().numpy())
+        keys.extend(product_key(item["category"], item["id"]) for item in batch)
+
+    dim = encoder.config.projection_dim
+    embeddings = ProductEmbeddings(keys, np.concatenate(chunks) if chunks else np.zeros((0, dim), dtype=np.float32))
+    embeddings.save(embeds_dir)
+    print(f"Encoded {len(keys)} product images in {time.perf_counter() - start:.1f}s into {embeds_dir}")
+    return embeddings
+
+
+def conditioning_supported(pipe):
+    """L'IP-Adapter se greffe sur un UNet torch (pas ONNX Runtime) sans projection d'encodeur existante"""
+    unet = pipe.unet
+    return any(p.numel() for p in unet.parameters()) and getattr(unet, "encoder_hid_proj", None) is None
+
+
+def enable_product_conditioning(pipe):
+    """Charge les poids IP-Adapter dans l'UNet et remplace unet.forward pour y injecter l'embedding produit
+
+    Seules la projection d'image et les processeurs d'attention croisée sont chargés: l'encodeur d'image
+    n'est jamais instancié côté requête, les embeddings viennent du cache du catalogue. Le wrapper ajoute
+    image_embeds à chaque appel (zéros pour la moitié négative de la CFG, comme diffusers).
+    """
+    from diffusers.loaders import IPAdapterMixin
+    from diffusers.models.attention_processor import IPAdapterAttnProcessor, IPAdapterAttnProcessor2_0
+
+    unet = pipe.unet
+    start = time.perf_counter()
+    # Méthode du mixin appelée sur le pipeline: le ControlNet Inpaint SDXL n'hérite pas d'IPAdapterMixin
+    IPAdapterMixin.load_ip_adapter(pipe, IP_ADAPTER_MODEL_ID, subfolder=IP_ADAPTER_SUBFOLDER,
+                                   weight_name=IP_ADAPTER_WEIGHTS)
+    # diffusers 0.25 (épinglé dans requirements.txt): une seule ImageProjection, image_embeds est un tenseur
+    modules = dict(unet.named_modules())
+    state = {
+        "embeds": None,
+        "dim": unet.encoder_hid_proj.image_embeds.in_features,
+        "processors": {modules[name[:-len(".processor")]]: processor
+                       for name, processor in unet.attn_processors.items()
+                       if isinstance(processor, (IPAdapterAttnProcessor, IPAdapterAttnProcessor2_0))},
+    }
+    forward = unet.forward
+
+    def conditioned_forward(sample, timestep, encoder_hidden_states, *args, added_cond_kwargs=None, **kwargs):
+        batch = sample.shape[0]
+        image_embeds = torch.zeros(batch, state["dim"], device=sample.device, dtype=sample.dtype)
+        if state["embeds"] is not None:
+            embeds = state["embeds"].to(device=sample.device, dtype=sample.dtype)
+            negatives = batch // 2 if pipe.do_classifier_free_guidance and batch % 2 == 0 else 0
+            image_embeds[negatives:] = embeds
+        added_cond_kwargs = {**(added_cond_kwargs or {}), "image_embeds": image_embeds}
+        return forward(sample, timestep, encoder_hidden_states, *args, added_cond_kwargs=added_cond_kwargs, **kwargs)
+
+    unet.forward = conditioned_forward
+    unet._product_conditioning = state
+    log_event("product_conditioning_loaded", adapter=f"{IP_ADAPTER_MODEL_ID}/{IP_ADAPTER_SUBFOLDER}/{IP_ADAPTER_WEIGHTS}",
+              processors=len(state["processors"]), duration_s=round(time.perf_counter() - start, 3))
+    return state
+
+
+def load_product_adapter(pipe, embeds, scale=PRODUCT_CONDITIONING_SCALE):
+    """Charge l'IP-Adapter au premier rendu qui le demande (avant le plan mémoire)
+
+    load_ip_adapter remplace tous les processeurs d'attention: le slicing est marqué inactif pour que le
+    plan mémoire le réapplique, et xformers est réactivé comme au chargement du pipeline.
+    """
+    if getattr(pipe.unet, "_product_conditioning", None) is not None or embeds is None or scale <= 0:
+        return
+    if not conditioning_supported(pipe):
+        print("Product conditioning skipped: UNet weights are not plain torch parameters (ONNX)")
+        pipe.unet._product_conditioning = False
+        return
+    enable_product_conditioning(pipe)
+    pipe._attention_slicing = False
+    if torch.cuda.is_available():
+        try:
+            pipe.enable_xformers_memory_efficient_attention()
+        except Exception:
+            pass
+
+
+def apply_product_conditioning(pipe, embeds, scale=PRODUCT_CONDITIONING_SCALE):
+    """Fixe l'embedding produit et l'échelle IP-Adapter pour ce rendu (après le plan mémoire)
+
+    Le slicing d'attention et xformers remplacent les processeurs: ceux de l'IP-Adapter sont
+    réinstallés à chaque appel. Sans embedding ou avec une échelle nulle, leur contribution est nulle.
+    """
+    state = getattr(pipe.unet, "_product_conditioning", None)
+    if not state:
+        return False
+
+    active = embeds is not None and scale > 0
+    for module, processor in state["processors"].items():
+        if module.processor is not processor:
+            module.set_processor(processor)
+        processor.scale = scale if active else 0.0
+    state["embeds"] = torch.as_tensor(np.asarray(embeds, dtype=np.float32)) if active else None
+    return active
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Précalcul des embeddings d'image IP-Adapter du catalogue IKEA")
+    parser.add_argument("--catalog", default=IKEA_CATALOG_FILE, help="Catalogue JSON (chemins des images relatifs à son dossier)")
+    parser.add_argument("--output", default=IKEA_IMAGE_EMBEDS_DIR, help="Dossier de sortie des embeddings")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--benchmark", type=int, default=0, help="Nombre de sélections de 3 produits à chronométrer")
+    args = parser.parse_args(argv)
+
+    from models.ikea_bundle import resolve_catalog_paths
+
+    with open(args.catalog) as f:
+        catalog = resolve_catalog_paths(json.load(f), os.path.dirname(args.catalog))
+    build_product_embeddings(catalog, args.output, args.batch_size)
+
+    if args.benchmark:
+        embeddings = ProductEmbeddings.load(args.output)
+        selections = [[{"category": key.split("/", 1)[0], "catalog_id": key.split("/", 1)[1]}
+                       for key in random.sample(embeddings.keys, min(3, len(embeddings.keys)))]
+                      for _ in range(args.benchmark)]
+        start = time.perf_counter()
+        for selection in selections:
+            embeddings.lookup(selection)
+        print(f"Average lookup latency: {(time.perf_counter() - start) / args.benchmark * 1000:.3f} ms")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
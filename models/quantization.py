@@ -0,0 +1,140 @@
+import os
+import sys
+import time
+import argparse
+import numpy as np
+import torch
+
+from config.constants import DEVICE, QUANTIZATION_MODE, QUANTIZED_MODELS_DIR
+
+
+def quantization_enabled():
+    """Le mode int8 dynamique n'existe que pour l'inférence CPU"""
+    return QUANTIZATION_MODE == "int8" and DEVICE.type == "cpu"
+
+
+def quantize_module(module):
+    """Quantification dynamique int8 des couches linéaires (poids int8, activations quantifiées à la volée)"""
+    module.eval()
+    return torch.ao.quantization.quantize_dynamic(module, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+
+
+def quantized_cache_path(model_id, component, revision):
+    """Chemin des poids int8 en cache: invalidés par une nouvelle révision du modèle ou de torch/diffusers/transformers"""
+    import diffusers
+    import transformers
+
+    safe_id = model_id.replace("/", "--")
+    versions = f"torch{torch.__version__}-diffusers{diffusers.__version__}-transformers{transformers.__version__}"
+    return os.path.join(QUANTIZED_MODELS_DIR, f"{safe_id}--{component}--{(revision or 'local')[:12]}--int8--{versions}.pt")
+
+
+def _component_skeleton(cls, model_id, subfolder=None):
+    """Révision du modèle et constructeur de son architecture, sans lire ni initialiser les poids"""
+    from transformers import AutoConfig
+    from transformers.modeling_utils import no_init_weights
+
+    if hasattr(cls, "load_config"):
+        # Modèle diffusers
+        config, revision = cls.load_config(model_id, subfolder=subfolder, return_commit_hash=True)
+        build = lambda: cls.from_config(config)
+    else:
+        config = AutoConfig.from_pretrained(model_id, subfolder=subfolder or "")
+        revision = getattr(config, "_commit_hash", None)
+        build = lambda: cls.from_config(config) if hasattr(cls, "from_config") else cls(config)
+
+    def skeleton():
+        with no_init_weights():
+            return build()
+    return revision, skeleton
+
+
+def load_quantized_component(model_id, component, cls, subfolder=None):
+    """Charge un composant int8 depuis le cache disque, sinon le quantifie puis met ses poids en cache
+
+    Seul le state_dict int8 est enregistré (chargé avec weights_only=True, jamais de pickle arbitraire);
+    au chargement, l'architecture est reconstruite puis quantifiée avant d'y charger ces poids.
+    """
+    revision, skeleton = _component_skeleton(cls, model_id, subfolder)
+    path = quantized_cache_path(model_id, component, revision)
+    if os.path.exists(path):
+        try:
+            module = quantize_module(skeleton())
+            module.load_state_dict(torch.load(path, weights_only=True))
+            print(f"Loaded int8 {component} of {model_id} from {path}")
+            return module.eval()
+        except Exception as e:
+            print(f"Error loading cached int8 {component} from {path}: {e}. Quantizing again.")
+
+    start = time.perf_counter()
+    kwargs = {"subfolder": subfolder} if subfolder else {}
+    module = quantize_module(cls.from_pretrained(model_id, torch_dtype=torch.float32, **kwargs))
+    os.makedirs(QUANTIZED_MODELS_DIR, exist_ok=True)
+    torch.save(module.state_dict(), f"{path}.tmp")
+    os.replace(f"{path}.tmp", path)
+    print(f"Quantized {component} of {model_id} to int8 in {time.perf_counter() - start:.1f}s, cached at {path}")
+    return module
+
+
+def quantized_sdxl_components(model_id, components=("unet", "text_encoder", "text_encoder_2")):
+    """UNet et encodeurs de texte SDXL quantifiés, à passer à from_pretrained"""
+    from diffusers import UNet2DConditionModel
+    from transformers import CLIPTextModel, CLIPTextModelWithProjection
+
+    classes = {
+        "unet": UNet2DConditionModel,
+        "text_encoder": CLIPTextModel,
+        "text_encoder_2": CLIPTextModelWithProjection,
+    }
+    return {component: load_quantized_component(model_id, component, classes[component], subfolder=component)
+            for component in components}
+
+
+def benchmark(image_path, prompt, steps, seed):
+    """Compare float32 et int8: latence, mémoire résidente et écart de qualité (PSNR)"""
+    from PIL import Image
+    from diffusers import StableDiffusionXLInpaintPipeline
+    from utils.image_processing import generate_inpainting_mask
+    from utils.metrics import psnr, resident_memory_bytes, results_path, write_results
+
+    model_id = "diffusers/stable-diffusion-xl-1.0-inpainting-0.1"
+    image = Image.open(image_path).convert("RGB").resize((512, 512))
+    mask = generate_inpainting_mask(image.size, strategy="center_rect")
+
+    report = {"prompt": prompt, "steps": steps, "seed": seed}
+    outputs = {}
+    for mode in ("float32", "int8"):
+        rss_before = resident_memory_bytes()
+        components = quantized_sdxl_components(model_id) if mode == "int8" else {}
+        pipe = StableDiffusionXLInpaintPipeline.from_pretrained(model_id, torch_dtype=torch.float32, **components)
+        rss_loaded = resident_memory_bytes()
+
+        start = time.perf_counter()
+        outputs[mode] = pipe(prompt=prompt, image=image, mask_image=mask, num_inference_steps=steps,
+                             generator=torch.Generator("cpu").manual_seed(seed)).images[0]
+        report[mode] = {"latency_s": time.perf_counter() - start,
+                        "model_memory_mb": (rss_loaded - rss_before) / 2**20}
+        outputs[mode].save(results_path(f"quantization_{mode}.png"))
+        del pipe
+
+    report["psnr_db"] = psnr(outputs["float32"], outputs["int8"])
+    report["mean_abs_diff"] = float(np.mean(np.abs(np.asarray(outputs["float32"], dtype=np.float32)
+                                                   - np.asarray(outputs["int8"], dtype=np.float32))))
+    write_results("quantization_benchmark.json", report)
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Mesure de l'impact de la quantification int8 (latence, mémoire, qualité)")
+    parser.add_argument("--image", required=True, help="Image de pièce servant de référence")
+    parser.add_argument("--prompt", default="a cozy living room with a grey sofa and a wooden coffee table")
+    parser.add_argument("--steps", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    benchmark(args.image, args.prompt, args.steps, args.seed)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,136 @@
+import time
+import threading
+from collections import OrderedDict
+import torch
+
+from config.constants import STYLE_LORAS, STYLE_LORA_SCALE, STYLE_ADAPTER_CACHE_SIZE
+from utils.metrics import inc, log_event, observe
+
+
+def _lora_source(spec):
+    """"dépôt_ou_dossier[:fichier.safetensors]" -> arguments de load_lora_weights"""
+    source, _, weight_name = spec.partition(":")
+    return source, ({"weight_name": weight_name} if weight_name else {})
+
+
+def _lora_modules(unet):
+    """Modules de l'UNet porteurs d'une LoRA chargée (backend PEFT ou LoRACompatible* de diffusers)"""
+    modules = {}
+    for name, module in unet.named_modules():
+        if hasattr(module, "base_layer") and hasattr(module.base_layer, "weight"):
+            modules[name] = module.base_layer
+        elif getattr(module, "lora_layer", None) is not None:
+            modules[name] = module
+    return modules
+
+
+def compute_style_delta(pipe, style, scale=STYLE_LORA_SCALE):
+    """Charge la LoRA d'un style, la fusionne une fois et renvoie ({module: delta}, {module: poids d'origine})
+
+    Les poids d'origine des modules touchés sont recopiés après déchargement: l'UNet partagé ressort
+    identique au bit près. Seule la partie UNet de la LoRA est fusionnée: ses poids d'encodeur de texte
+    éventuels sont ignorés (l'encodeur de texte est partagé et n'est pas modifié).
+    """
+    source, kwargs = _lora_source(STYLE_LORAS[style])
+    start = time.perf_counter()
+    pipe.load_lora_weights(source, adapter_name=style.lower(), **kwargs)
+    try:
+        touched = _lora_modules(pipe.unet)
+        originals = {name: module.weight.detach().clone() for name, module in touched.items()}
+        pipe.fuse_lora(fuse_unet=True, fuse_text_encoder=False, lora_scale=scale)
+        deltas = {name: touched[name].weight.detach() - original for name, original in originals.items()}
+        pipe.unfuse_lora(unfuse_unet=True, unfuse_text_encoder=False)
+    finally:
+        pipe.unload_lora_weights()
+
+    modules = dict(pipe.unet.named_modules())
+    with torch.no_grad():
+        for name, original in originals.items():
+            modules[name].weight.copy_(original)
+    log_event("style_adapter_fused", style=style, source=source, modules=len(deltas),
+              delta_mb=round(sum(d.numel() * d.element_size() for d in deltas.values()) / 2**20, 1),
+              duration_s=round(time.perf_counter() - start, 3))
+    return deltas, originals
+
+
+class StyleAdapters:
+    """Styles LoRA interchangeables à chaud sur l'UNet partagé: écarts pré-fusionnés en cache LRU
+
+    Changer de style recopie les poids de base des modules du style actif, puis écrit base + écart pour
+    le nouveau, sans recharger le pipeline ni la LoRA. Les poids de base sont conservés à part: aucun
+    arrondi fp16 ne s'accumule au fil des changements.
+    """
+
+    def __init__(self, pipe, max_entries=STYLE_ADAPTER_CACHE_SIZE):
+        self.pipe = pipe
+        self.max_entries = max_entries
+        self.active = None
+        self._deltas = OrderedDict()
+        self._base = {}
+        self._modules = dict(pipe.unet.named_modules())
+        self._lock = threading.Lock()
+
+    def _delta(self, style):
+        if style in self._deltas:
+            inc("cache_hits_total", cache="style_adapter")
+            self._deltas.move_to_end(style)
+            return self._deltas[style]
+        inc("cache_misses_total", cache="style_adapter")
+        deltas, originals = compute_style_delta(self.pipe, style)
+        for name, original in originals.items():
+            self._base.setdefault(name, original)
+        self._deltas[style] = deltas
+        # Le style actif n'est jamais évincé: son écart est encore appliqué aux poids
+        evictable = [s for s in self._deltas if s not in (self.active, style)]
+        while len(self._deltas) > self.max_entries and evictable:
+            del self._deltas[evictable.pop(0)]
+        return deltas
+
+    def _apply(self, deltas):
+        with torch.no_grad():
+            for name, delta in deltas.items():
+                self._modules[name].weight.copy_(self._base[name] + delta)
+
+    def _restore(self, deltas):
+        with torch.no_grad():
+            for name in deltas:
+                self._modules[name].weight.copy_(self._base[name])
+
+    def activate(self, style):
+        """Active la LoRA du style (None ou style sans LoRA: UNet de base)"""
+        style = style if style in STYLE_LORAS else None
+        with self._lock:
+            if style == self.active:
+                return self.active
+            start = time.perf_counter()
+            # UNet remis à la base avant un éventuel calcul d'écart: les poids d'origine relevés sont purs
+            if self.active is not None:
+                self._restore(self._deltas[self.active])
+                self.active = None
+            if style is not None:
+                self._apply(self._delta(style))
+            self.active = style
+            observe("style_switch_seconds", time.perf_counter() - start, style=style or "base")
+            return self.active
+
+
+def adapters_supported(pipe):
+    """Les poids doivent être des paramètres torch modifiables (ni ONNX Runtime, ni int8 dynamique)"""
+    unet = pipe.unet
+    if not any(p.numel() for p in unet.parameters()):
+        return False
+    return not any(isinstance(m, torch.ao.nn.quantized.dynamic.Linear) for m in unet.modules())
+
+
+def activate_style(pipe, style):
+    """Active le style LoRA sur ce pipeline (sans effet si aucun style n'a de LoRA configurée)"""
+    if not STYLE_LORAS or pipe is None:
+        return None
+    adapters = getattr(pipe, "_style_adapters", None)
+    if adapters is None:
+        if not adapters_supported(pipe):
+            print("Style adapters skipped: UNet weights are not plain torch parameters (ONNX or int8)")
+            pipe._style_adapters = False
+            return None
+        adapters = pipe._style_adapters = StyleAdapters(pipe)
+    return adapters.activate(style) if adapters else None
@@ -0,0 +1,76 @@
+import sys
+import time
+import argparse
+import torch
+
+from config.constants import INTERIOR_STYLES
+from models.generation import run_pipeline
+from utils.metrics import log_event, results_path, write_results
+
+
+def _generators(seed, count):
+    """Un générateur par image, tous à la même graine: même bruit initial, seul le style change"""
+    return [torch.Generator("cpu").manual_seed(seed) for _ in range(count)]
+
+
+def run_style_sweep(pipe, mode, prompts, negative_prompt, seed, step_callbacks=(), decoder="full", **call_kwargs):
+    """Rend une même disposition dans plusieurs styles en un seul débruitage par lots
+
+    Le pipeline encode la pièce, la pièce masquée et l'image de contrôle une seule fois et les
+    répète sur le lot; seuls les prompts diffèrent d'une image à l'autre. Renvoie la liste d'images
+    dans l'ordre des prompts.
+    """
+    start = time.perf_counter()
+    result = run_pipeline(pipe, mode, step_callbacks=step_callbacks, decoder=decoder,
+                          prompt=list(prompts), negative_prompt=[negative_prompt] * len(prompts),
+                          generator=_generators(seed, len(prompts)), **call_kwargs)
+    duration = time.perf_counter() - start
+    log_event("style_sweep", mode=mode, styles=len(prompts), duration_s=round(duration, 3),
+              per_style_s=round(duration / len(prompts), 3))
+    return result.images
+
+
+def benchmark(image_path, steps, seed):
+    """Compare un balayage par lots aux rendus style par style (latence totale et par style)"""
+    from PIL import Image
+    from diffusers import StableDiffusionXLInpaintPipeline
+    from models.model_loader import SDXL_INPAINT_MODEL_ID
+    from utils.image_processing import generate_inpainting_mask, generate_inpainting_prompt
+
+    image = Image.open(image_path).convert("RGB").resize((512, 512))
+    mask = generate_inpainting_mask(image.size, strategy="center_rect")
+    prompts = [generate_inpainting_prompt("living room", style, [{"category": "sofa"}]) for style in INTERIOR_STYLES]
+    negative_prompt = "distorted, poor quality, blur, lowres"
+    pipe = StableDiffusionXLInpaintPipeline.from_pretrained(SDXL_INPAINT_MODEL_ID, torch_dtype=torch.float32)
+    common = {"image": image, "mask_image": mask, "width": 512, "height": 512, "num_inference_steps": steps}
+
+    start = time.perf_counter()
+    for prompt in prompts:
+        pipe(prompt=prompt, negative_prompt=negative_prompt, generator=torch.Generator("cpu").manual_seed(seed), **common)
+    sequential = time.perf_counter() - start
+
+    start = time.perf_counter()
+    images = run_style_sweep(pipe, "benchmark", prompts, negative_prompt, seed, **common)
+    batched = time.perf_counter() - start
+
+    for style, image in zip(INTERIOR_STYLES, images):
+        image.save(results_path(f"style_sweep_{style}.png"))
+    report = {"styles": len(prompts), "steps": steps, "seed": seed, "sequential_s": sequential, "batched_s": batched,
+              "speedup": sequential / batched if batched else None}
+    write_results("style_sweep_benchmark.json", report)
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Balayage des styles par lots contre rendus séparés")
+    parser.add_argument("--image", required=True, help="Image de pièce servant de référence")
+    parser.add_argument("--steps", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    benchmark(args.image, args.steps, args.seed)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,67 @@
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("torch")    # config.constants importe torch
+
+from models.guidance import GuidanceSchedule, cfg_passes
+
+
+def make_schedule(schedule, cutoff=0.5):
+    return GuidanceSchedule(SimpleNamespace(), schedule, cutoff)
+
+
+@pytest.mark.parametrize("progress", [0.0, 0.3, 0.5, 1.0])
+def test_constant_keeps_base_scale(progress):
+    assert make_schedule("constant").scale_at(7.5, progress) == 7.5
+
+
+def test_truncate_cuts_at_cutoff():
+    schedule = make_schedule("truncate", cutoff=0.4)
+    assert schedule.scale_at(7.5, 0.0) == 7.5
+    assert schedule.scale_at(7.5, 0.39) == 7.5
+    assert schedule.scale_at(7.5, 0.4) == 1.0
+    assert schedule.scale_at(7.5, 1.0) == 1.0
+
+
+def test_decay_is_linear_down_to_one():
+    schedule = make_schedule("decay", cutoff=0.5)
+    assert schedule.scale_at(7.0, 0.0) == 7.0
+    assert schedule.scale_at(7.0, 0.25) == pytest.approx(4.0)
+    assert schedule.scale_at(7.0, 0.5) == 1.0
+    scales = [schedule.scale_at(7.0, p / 10) for p in range(11)]
+    assert scales == sorted(scales, reverse=True)
+
+
+@pytest.mark.parametrize("schedule", ["truncate", "decay"])
+def test_scale_without_cfg_is_untouched(schedule):
+    assert make_schedule(schedule).scale_at(1.0, 0.9) == 1.0
+
+
+def test_unknown_schedule():
+    with pytest.raises(ValueError):
+        make_schedule("cosine")
+
+
+@pytest.mark.parametrize("schedule, steps, cutoff, expected", [
+    ("constant", 30, 0.4, 60),
+    ("truncate", 30, 0.4, 2 * 12 + 18),
+    ("decay", 25, 0.5, 2 * 13 + 12),
+    ("truncate", 10, 0.0, 2 * 1 + 9),
+    ("truncate", 10, 1.0, 20),
+])
+def test_cfg_passes(schedule, steps, cutoff, expected):
+    assert cfg_passes(schedule, steps, cutoff) == expected
+
+
+@pytest.mark.parametrize("schedule", ["constant", "truncate", "decay"])
+@pytest.mark.parametrize("steps, cutoff", [(30, 0.4), (25, 0.5), (7, 0.3), (4, 0.0), (10, 1.0)])
+def test_cfg_passes_matches_callback(schedule, steps, cutoff):
+    # Simule la boucle de débruitage: le callback du pas i fixe l'état CFG du pas i + 1
+    pipe = SimpleNamespace(_num_timesteps=steps, guidance_scale=7.5)
+    callback = GuidanceSchedule(pipe, schedule, cutoff)
+    passes = 0
+    for step in range(steps):
+        passes += 1 if pipe._cfg_state["truncated"] else 2
+        callback(pipe, step, None, {})
+    assert passes == cfg_passes(schedule, steps, cutoff)
@@ -0,0 +1,148 @@
+import os
+import io
+import json
+import tarfile
+
+import pytest
+
+pytest.importorskip("torch")    # config.constants importe torch
+
+from models import ikea_bundle
+from models.ikea_bundle import (
+    MANIFEST_NAME, build_bundle, build_delta, build_manifest, bundle_paths, install_bundle,
+    install_latest_bundle, installed_version, resolve_catalog_paths, verify_tree,
+)
+
+# Contenu du dataset par version: un fichier modifié, un retiré et un ajouté entre v1 et v2
+TREES = {
+    "v1": {"images/a.jpg": b"a1", "images/b.jpg": b"b1", "metadata/products.tbl": b"meta"},
+    "v2": {"images/a.jpg": b"a2", "images/c.jpg": b"c2", "metadata/products.tbl": b"meta"},
+}
+
+
+@pytest.fixture
+def bundle_dir(tmp_path, monkeypatch):
+    def fake_stage(source_dir, staging_dir, version, image_embeds=False):
+        for rel_path, data in TREES[version].items():
+            path = os.path.join(staging_dir, rel_path)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "wb") as f:
+                f.write(data)
+
+    monkeypatch.setattr(ikea_bundle, "stage_dataset", fake_stage)
+    output_dir = str(tmp_path / "bundles")
+    for version in TREES:
+        build_bundle("unused", version, output_dir)
+    return output_dir
+
+
+def read_tree(root):
+    tree = {}
+    for dirpath, _, filenames in os.walk(root):
+        for filename in filenames:
+            path = os.path.join(dirpath, filename)
+            rel_path = os.path.relpath(path, root).replace(os.sep, "/")
+            if rel_path != MANIFEST_NAME:
+                with open(path, "rb") as f:
+                    tree[rel_path] = f.read()
+    return tree
+
+
+def test_manifest_round_trip(tmp_path):
+    (tmp_path / "x.bin").write_bytes(b"data")
+    manifest = build_manifest(str(tmp_path), "v1")
+    assert manifest["files"]["x.bin"]["size"] == 4
+    assert verify_tree(str(tmp_path), manifest) == []
+    (tmp_path / "x.bin").write_bytes(b"dat!")
+    assert verify_tree(str(tmp_path), manifest) == ["x.bin"]
+
+
+def test_full_install(bundle_dir, tmp_path):
+    dataset_dir = str(tmp_path / "dataset")
+    assert install_bundle(bundle_paths("v1", bundle_dir)[0], dataset_dir) == "v1"
+    assert os.path.islink(dataset_dir)
+    assert installed_version(dataset_dir) == "v1"
+    assert read_tree(dataset_dir) == TREES["v1"]
+
+
+def test_delta_round_trip(bundle_dir, tmp_path):
+    dataset_dir = str(tmp_path / "dataset")
+    install_bundle(bundle_paths("v1", bundle_dir)[0], dataset_dir)
+    delta_path = build_delta(bundle_paths("v1", bundle_dir)[1], bundle_paths("v2", bundle_dir)[0], bundle_dir)
+
+    with tarfile.open(delta_path) as tar:
+        delta = json.load(tar.extractfile("delta.json"))
+    assert sorted(delta["changed"]) == ["images/a.jpg", "images/c.jpg"]
+    assert delta["removed"] == ["images/b.jpg"]
+
+    assert install_bundle(delta_path, dataset_dir) == "v2"
+    assert read_tree(dataset_dir) == TREES["v2"]
+    # Seule la version active subsiste à côté du lien
+    siblings = sorted(name for name in os.listdir(tmp_path) if name.startswith("dataset"))
+    assert siblings == ["dataset", "dataset.lock", os.path.basename(os.path.realpath(dataset_dir))]
+
+
+def test_delta_rejects_wrong_base(bundle_dir, tmp_path):
+    dataset_dir = str(tmp_path / "dataset")
+    install_bundle(bundle_paths("v2", bundle_dir)[0], dataset_dir)
+    delta_path = build_delta(bundle_paths("v1", bundle_dir)[1], bundle_paths("v2", bundle_dir)[0], bundle_dir)
+    with pytest.raises(ValueError):
+        install_bundle(delta_path, dataset_dir)
+    assert read_tree(dataset_dir) == TREES["v2"]
+
+
+def test_install_latest_prefers_delta(bundle_dir, tmp_path, monkeypatch):
+    dataset_dir = str(tmp_path / "dataset")
+    install_bundle(bundle_paths("v1", bundle_dir)[0], dataset_dir)
+    delta_path = build_delta(bundle_paths("v1", bundle_dir)[1], bundle_paths("v2", bundle_dir)[0], bundle_dir)
+
+    installed = []
+    real_install = ikea_bundle._install_bundle
+    monkeypatch.setattr(ikea_bundle, "_install_bundle",
+                        lambda path, target: installed.append(path) or real_install(path, target))
+    assert install_latest_bundle(bundle_dir, dataset_dir) == "v2"
+    assert installed == [delta_path]
+    assert read_tree(dataset_dir) == TREES["v2"]
+    # Déjà à jour: rien n'est réinstallé
+    assert install_latest_bundle(bundle_dir, dataset_dir) == "v2"
+    assert installed == [delta_path]
+
+
+def test_corrupt_bundle_keeps_installed_version(bundle_dir, tmp_path):
+    dataset_dir = str(tmp_path / "dataset")
+    install_bundle(bundle_paths("v1", bundle_dir)[0], dataset_dir)
+
+    bad_path = str(tmp_path / "bad.tar")
+    with tarfile.open(bundle_paths("v2", bundle_dir)[0]) as src, tarfile.open(bad_path, "w") as out:
+        for member in src.getmembers():
+            data = src.extractfile(member).read()
+            if member.name == "images/a.jpg":
+                data = b"xx"
+            out.addfile(member, io.BytesIO(data))
+    with pytest.raises(ValueError):
+        install_bundle(bad_path, dataset_dir)
+    assert read_tree(dataset_dir) == TREES["v1"]
+
+
+def test_replaces_legacy_directory(bundle_dir, tmp_path):
+    dataset_dir = tmp_path / "dataset"
+    dataset_dir.mkdir()
+    (dataset_dir / "old.txt").write_text("legacy")
+    install_bundle(bundle_paths("v1", bundle_dir)[0], str(dataset_dir))
+    assert os.path.islink(dataset_dir)
+    assert read_tree(str(dataset_dir)) == TREES["v1"]
+    assert not os.path.exists(f"{dataset_dir}.old")
+
+
+def test_resolve_catalog_paths(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "dataset" / "images").mkdir(parents=True)
+    (tmp_path / "dataset" / "images" / "a.jpg").write_bytes(b"")
+    (tmp_path / "legacy").mkdir()
+    (tmp_path / "legacy" / "b.jpg").write_bytes(b"")
+    catalog = {"chairs": [{"image_path": "images/a.jpg"}, {"image_path": "legacy/b.jpg"},
+                          {"image_path": "images/missing.jpg"}, {"name": "sans image"}]}
+    resolve_catalog_paths(catalog, "dataset")
+    assert [item.get("image_path") for item in catalog["chairs"]] == [
+        os.path.join("dataset", "images/a.jpg"), "legacy/b.jpg", os.path.join("dataset", "images/missing.jpg"), None,
+    ]
@@ -0,0 +1,74 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("torch")    # config.constants importe torch
+
+from models.ikea_retrieval import (
+    BM25Index, build_bm25_index, description_text, retrieve_product_descriptions, tokenize,
+)
+
+DOCUMENTS = {
+    "sofa.jpg": "Grey fabric sofa with three cushions",
+    "chair.jpg": ["Wooden chair", "oak"],
+    "lamp.jpg": {"name": "Pendant lamp", "material": "glass"},
+    "desk.jpg": "White desk with drawer, white legs",
+    "rug.jpg": "Grey rug",
+}
+
+
+@pytest.fixture(scope="module")
+def index():
+    return build_bm25_index(DOCUMENTS)
+
+
+def test_tokenize_translates_french_and_drops_stopwords():
+    assert tokenize("Un canapé gris en tissu, style IKEA") == ["sofa", "grey", "fabric"]
+
+
+def test_search_ranks_matching_document_first(index):
+    results = index.search("canapé gris")
+    assert results[0][0] == "sofa.jpg"
+    # "grey" seul rapporte aussi le tapis, moins bien classé
+    assert [key for key, _ in results] == ["sofa.jpg", "rug.jpg"]
+    assert results[0][1] > results[1][1] > 0
+
+
+def test_search_flattens_structured_descriptions(index):
+    assert index.search("lampe en verre", k=1)[0][0] == "lamp.jpg"
+    assert index.search("chaise bois", k=1)[0][0] == "chair.jpg"
+
+
+def test_search_unknown_terms_returns_nothing(index):
+    assert index.search("xylophone") == []
+    assert index.search("le la les") == []
+
+
+def test_search_k_larger_than_corpus(index):
+    assert len(index.search("grey white", k=50)) == 3
+
+
+def test_scores_match_reference_bm25(index):
+    doc_terms = {key: tokenize(description_text(value)) for key, value in DOCUMENTS.items()}
+    avg = np.mean([len(t) for t in doc_terms.values()])
+    df = sum("white" in t for t in doc_terms.values())
+    idf = np.log(1 + (len(DOCUMENTS) - df + 0.5) / (df + 0.5))
+    terms = doc_terms["desk.jpg"]
+    tf = terms.count("white")
+    expected = idf * tf * 2.2 / (tf + 1.2 * (0.25 + 0.75 * len(terms) / avg))
+    (key, score), = index.search("blanc", k=1)
+    assert key == "desk.jpg"
+    assert score == pytest.approx(expected, rel=1e-5)
+
+
+def test_save_load_round_trip(index, tmp_path):
+    index.save(str(tmp_path))
+    loaded = BM25Index.load(str(tmp_path))
+    for query in ("canapé gris", "white desk", "lamp"):
+        assert loaded.search(query) == index.search(query)
+
+
+def test_retrieve_deduplicates_and_truncates(index):
+    img_to_desc = {key: "Grey sofa" if key in ("sofa.jpg", "rug.jpg") else value for key, value in DOCUMENTS.items()}
+    assert retrieve_product_descriptions(index, img_to_desc, "gris", k=3) == ["Grey sofa"]
+    assert retrieve_product_descriptions(index, DOCUMENTS, "bureau", max_words=2) == ["White desk"]
+    assert retrieve_product_descriptions(None, DOCUMENTS, "bureau") == []
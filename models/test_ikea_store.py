@@ -0,0 +1,59 @@
+import pytest
+
+pytest.importorskip("torch")    # config.constants importe torch
+
+from models.ikea_store import MetadataTable, write_metadata_table
+
+
+@pytest.fixture
+def table(tmp_path):
+    mapping = {"b": {"name": "BILLY"}, "a": [1, 2], "é": "été", "ab": None, "10": 10, "9": 9}
+    path = str(tmp_path / "meta.tbl")
+    assert write_metadata_table(mapping, path) == len(mapping)
+    return mapping, MetadataTable(path)
+
+
+def test_lookup_matches_source_mapping(table):
+    mapping, tbl = table
+    assert len(tbl) == len(mapping)
+    for key, value in mapping.items():
+        assert key in tbl
+        assert tbl[key] == value
+
+
+def test_keys_are_sorted_by_utf8_bytes(table):
+    mapping, tbl = table
+    expected = sorted(mapping, key=lambda k: k.encode("utf-8"))
+    assert list(tbl) == expected
+    assert [tbl.key_at(i) for i in range(len(tbl))] == expected
+
+
+@pytest.mark.parametrize("missing", ["", "0", "aa", "abc", "c", "zzz", "é!"])
+def test_missing_keys_between_and_beyond_entries(table, missing):
+    _, tbl = table
+    assert missing not in tbl
+    assert tbl.get(missing) is None
+    with pytest.raises(KeyError):
+        tbl[missing]
+
+
+def test_non_string_keys_are_stringified(tmp_path):
+    path = str(tmp_path / "ints.tbl")
+    write_metadata_table({3: "c", 1: "a", 2: "b"}, path)
+    tbl = MetadataTable(path)
+    assert tbl[1] == "a" and tbl["3"] == "c"
+
+
+def test_empty_table(tmp_path):
+    path = str(tmp_path / "empty.tbl")
+    write_metadata_table({}, path)
+    tbl = MetadataTable(path)
+    assert len(tbl) == 0
+    assert "a" not in tbl
+
+
+def test_rejects_foreign_file(tmp_path):
+    path = tmp_path / "bad.tbl"
+    path.write_bytes(b"NOPE" + bytes(8))
+    with pytest.raises(ValueError):
+        MetadataTable(str(path))
@@ -0,0 +1,66 @@
+from types import SimpleNamespace
+
+import pytest
+
+torch = pytest.importorskip("torch")
+
+from models import memory_budget
+from models.memory_budget import plan_memory
+
+MB = 2**20
+
+
+def make_pipe(dtype=torch.float16):
+    return SimpleNamespace(unet=SimpleNamespace(dtype=dtype), vae_scale_factor=8)
+
+
+@pytest.fixture
+def cpu_only(monkeypatch):
+    monkeypatch.setattr(memory_budget.torch.cuda, "is_available", lambda: False)
+    monkeypatch.setattr(memory_budget, "_baseline_bytes", lambda: 0)
+
+
+def test_disabled_budget():
+    assert plan_memory(make_pipe(), 1024, 1024, budget_mb=0) == ((), 0)
+
+
+def test_no_measure_when_it_fits(cpu_only):
+    # 1024² fp16: décodage VAE 3 Go, auto-attention 640 Mo
+    assert plan_memory(make_pipe(), 1024, 1024, budget_mb=4096) == ((), 3072 * MB)
+
+
+def test_smallest_sufficient_prefix(cpu_only):
+    measures, estimate = plan_memory(make_pipe(), 1024, 1024, budget_mb=1024)
+    assert measures == ("attention_slicing", "vae_tiling")
+    assert estimate == 768 * MB
+
+
+def test_attention_bound_render(cpu_only):
+    # 2048² fp32: l'auto-attention (20 Go) domine, le découpage suffit sous 13 Go
+    measures, estimate = plan_memory(make_pipe(torch.float32), 2048, 2048, budget_mb=13000)
+    assert measures == ("attention_slicing",)
+    assert estimate == 12288 * MB
+
+
+def test_vae_slicing_only_for_batches(cpu_only):
+    measures, estimate = plan_memory(make_pipe(), 1024, 1024, batch=2, budget_mb=3500)
+    assert measures == ("attention_slicing", "vae_slicing")
+    assert estimate == 3072 * MB
+    assert "vae_slicing" not in plan_memory(make_pipe(), 1024, 1024, batch=1, budget_mb=1)[0]
+
+
+def test_baseline_counts_against_budget(cpu_only, monkeypatch):
+    monkeypatch.setattr(memory_budget, "_baseline_bytes", lambda: 2000 * MB)
+    assert plan_memory(make_pipe(), 1024, 1024, budget_mb=4096)[0] == ("attention_slicing", "vae_tiling")
+
+
+def test_unreachable_budget_returns_every_measure(cpu_only):
+    measures, estimate = plan_memory(make_pipe(), 1024, 1024, budget_mb=100)
+    assert measures == ("attention_slicing", "vae_tiling")
+    assert estimate > 100 * MB
+
+
+def test_sequential_offload_only_on_cuda(monkeypatch):
+    monkeypatch.setattr(memory_budget.torch.cuda, "is_available", lambda: True)
+    monkeypatch.setattr(memory_budget, "_baseline_bytes", lambda: 0)
+    assert plan_memory(make_pipe(), 1024, 1024, budget_mb=100)[0][-1] == "sequential_cpu_offload"
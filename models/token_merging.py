@@ -0,0 +1,191 @@
+import sys
+import math
+import time
+import argparse
+import contextlib
+import torch
+
+from config.constants import TOKEN_MERGING_RATIO, TOKEN_MERGING_FINAL, TOKEN_MERGING_MAX_DOWNSAMPLE
+from utils.metrics import write_results
+
+# Cellules de 2x2 tokens: un token destination par cellule, les trois autres sont candidats à la fusion
+_STRIDE = 2
+
+
+def bipartite_soft_matching(metric, height, width, r, generator=None):
+    """Appariement biparti de ToMe: fusionne les r tokens sources les plus proches de leur destination
+
+    Renvoie (merge, unmerge): merge (B, N, C) -> (B, N - r, C), unmerge fait l'inverse en recopiant
+    la valeur fusionnée sur chaque token d'origine.
+    """
+    batch, tokens, _ = metric.shape
+    cells_h, cells_w = height // _STRIDE, width // _STRIDE
+    device = metric.device
+
+    # Position du token destination dans chaque cellule, tirée au hasard (générateur reproductible)
+    choice = torch.randint(_STRIDE * _STRIDE, (cells_h, cells_w, 1), generator=generator).to(device)
+    buffer = torch.zeros(cells_h, cells_w, _STRIDE * _STRIDE, dtype=torch.int64, device=device)
+    buffer.scatter_(2, choice, -torch.ones_like(choice))
+    buffer = buffer.view(cells_h, cells_w, _STRIDE, _STRIDE).transpose(1, 2).reshape(cells_h * _STRIDE, cells_w * _STRIDE)
+    if cells_h * _STRIDE < height or cells_w * _STRIDE < width:
+        full = torch.zeros(height, width, dtype=torch.int64, device=device)
+        full[:cells_h * _STRIDE, :cells_w * _STRIDE] = buffer
+        buffer = full
+    order = buffer.reshape(1, -1, 1).argsort(dim=1)
+    num_dst = cells_h * cells_w
+    src_order, dst_order = order[:, num_dst:], order[:, :num_dst]
+
+    def split(x):
+        channels = x.shape[-1]
+        src = torch.gather(x, 1, src_order.expand(x.shape[0], tokens - num_dst, channels))
+        dst = torch.gather(x, 1, dst_order.expand(x.shape[0], num_dst, channels))
+        return src, dst
+
+    with torch.no_grad():
+        metric = metric / metric.norm(dim=-1, keepdim=True)
+        a, b = split(metric)
+        scores = a @ b.transpose(-1, -2)
+        r = min(a.shape[1], r)
+        node_max, node_idx = scores.max(dim=-1)
+        edge_idx = node_max.argsort(dim=-1, descending=True)[..., None]
+        unm_idx = edge_idx[..., r:, :]
+        src_idx = edge_idx[..., :r, :]
+        dst_idx = torch.gather(node_idx[..., None], -2, src_idx)
+
+    def merge(x):
+        src, dst = split(x)
+        n, t1, c = src.shape
+        unm = torch.gather(src, -2, unm_idx.expand(n, t1 - r, c))
+        src = torch.gather(src, -2, src_idx.expand(n, r, c))
+        dst = dst.scatter_reduce(-2, dst_idx.expand(n, r, c), src, reduce="mean")
+        return torch.cat([unm, dst], dim=1)
+
+    def unmerge(x):
+        unm_len = unm_idx.shape[1]
+        unm, dst = x[..., :unm_len, :], x[..., unm_len:, :]
+        n, _, c = unm.shape
+        src = torch.gather(dst, -2, dst_idx.expand(n, r, c))
+        out = torch.zeros(n, tokens, c, device=x.device, dtype=x.dtype)
+        src_positions = src_order.expand(n, src_order.shape[1], 1)
+        out.scatter_(-2, dst_order.expand(n, num_dst, c), dst)
+        out.scatter_(-2, torch.gather(src_positions, 1, unm_idx).expand(n, unm_len, c), unm)
+        out.scatter_(-2, torch.gather(src_positions, 1, src_idx).expand(n, r, c), src)
+        return out
+
+    return merge, unmerge
+
+
+class TokenMergingProcessor:
+    """Processeur d'auto-attention: fusionne les tokens redondants avant l'attention, les restitue après"""
+
+    def __init__(self, processor, state):
+        self.processor = processor
+        self.state = state
+
+    def __call__(self, attn, hidden_states, encoder_hidden_states=None, attention_mask=None, temb=None, **kwargs):
+        ratio = self.state["ratio"]
+        latent_size = self.state["latent_size"]
+        if ratio <= 0 or latent_size is None or encoder_hidden_states is not None or hidden_states.ndim != 3:
+            return self.processor(attn, hidden_states, encoder_hidden_states, attention_mask, temb, **kwargs)
+
+        tokens = hidden_states.shape[1]
+        latent_h, latent_w = latent_size
+        downsample = round(math.sqrt(latent_h * latent_w / tokens))
+        height, width = math.ceil(latent_h / downsample), math.ceil(latent_w / downsample)
+        if downsample > TOKEN_MERGING_MAX_DOWNSAMPLE or height * width != tokens:
+            return self.processor(attn, hidden_states, encoder_hidden_states, attention_mask, temb, **kwargs)
+
+        merge, unmerge = bipartite_soft_matching(hidden_states, height, width, int(tokens * ratio), self.state["generator"])
+        return unmerge(self.processor(attn, merge(hidden_states), None, attention_mask, temb, **kwargs))
+
+
+def _record_latent_size(state):
+    def hook(module, args, kwargs):
+        sample = args[0] if args else kwargs.get("sample")
+        if sample is not None:
+            state["latent_size"] = tuple(sample.shape[-2:])
+    return hook
+
+
+def token_merging_ratio(decoder, ratio=TOKEN_MERGING_RATIO):
+    """Ratio effectif: la fusion est coupée pour les rendus finaux (VAE complet) sauf AI_FURNISHER_TOKEN_MERGING_FINAL=1"""
+    return ratio if decoder != "full" or TOKEN_MERGING_FINAL else 0.0
+
+
+@contextlib.contextmanager
+def apply_token_merging(pipe, ratio, seed=0):
+    """Fusion de tokens sur les auto-attentions de l'UNet le temps d'un rendu (à tenir pendant pipe(...))
+
+    Ratio, taille latente et générateur (graine du rendu) sont propres à l'appel: rien n'est laissé sur
+    l'UNet partagé. Les processeurs en place (slicing du budget mémoire compris) sont enveloppés à
+    l'entrée et restitués à la sortie. Un ratio nul laisse les processeurs intacts.
+    """
+    if ratio <= 0:
+        yield 0
+        return
+    state = {"ratio": ratio, "latent_size": None, "generator": torch.Generator("cpu").manual_seed(seed)}
+    handle = pipe.unet.register_forward_pre_hook(_record_latent_size(state), with_kwargs=True)
+    wrapped = []
+    for name, module in pipe.unet.named_modules():
+        if name.endswith("attn1") and hasattr(module, "processor"):
+            wrapped.append((module, module.processor))
+            module.set_processor(TokenMergingProcessor(module.processor, state))
+    try:
+        yield len(wrapped)
+    finally:
+        handle.remove()
+        for module, processor in wrapped:
+            module.set_processor(processor)
+
+
+def benchmark(resolutions, ratios, repeats):
+    """Durée d'un pas d'UNet SDXL par résolution et ratio de fusion, écart relatif à l'UNet sans fusion"""
+    from types import SimpleNamespace
+    from diffusers import UNet2DConditionModel
+    from models.model_loader import SDXL_BASE_MODEL_ID
+
+    unet = UNet2DConditionModel.from_pretrained(SDXL_BASE_MODEL_ID, subfolder="unet", torch_dtype=torch.float32).eval()
+    pipe = SimpleNamespace(unet=unet)
+    report = {"repeats": repeats}
+    for resolution in resolutions:
+        latent = resolution // 8
+        generator = torch.Generator("cpu").manual_seed(0)
+        inputs = {"sample": torch.randn(2, 4, latent, latent, generator=generator),
+                  "timestep": torch.tensor(500),
+                  "encoder_hidden_states": torch.randn(2, 77, 2048, generator=generator),
+                  "added_cond_kwargs": {"text_embeds": torch.randn(2, 1280, generator=generator),
+                                        "time_ids": torch.tensor([[resolution, resolution, 0, 0, resolution, resolution]] * 2,
+                                                                 dtype=torch.float32)}}
+        reference = None
+        report[resolution] = {}
+        for ratio in ratios:
+            with apply_token_merging(pipe, ratio), torch.no_grad():
+                unet(**inputs)  # échauffement
+                start = time.perf_counter()
+                for _ in range(repeats):
+                    output = unet(**inputs).sample
+            latency = (time.perf_counter() - start) / repeats
+            if reference is None:
+                reference = output
+            error = float((output - reference).norm() / reference.norm())
+            report[resolution][ratio] = {"step_s": latency, "relative_error": error,
+                                         "speedup": report[resolution].get(ratios[0], {}).get("step_s", latency) / latency}
+            print(f"{resolution}px ratio={ratio:.2f}: {latency:.2f} s/step  error={error:.4f}")
+
+    write_results("token_merging_benchmark.json", {str(k): v for k, v in report.items()}, echo=False)
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Gain de la fusion de tokens sur un pas d'UNet SDXL, par résolution")
+    parser.add_argument("--resolutions", default="768,1024")
+    parser.add_argument("--ratios", default="0,0.3,0.5,0.6", help="Le premier ratio sert de référence")
+    parser.add_argument("--repeats", type=int, default=2)
+    args = parser.parse_args(argv)
+
+    benchmark([int(r) for r in args.resolutions.split(",")], [float(r) for r in args.ratios.split(",")], args.repeats)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
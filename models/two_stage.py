@@ -0,0 +1,53 @@
+import math
+import random
+import torch
+import torch.nn.functional as F
+from PIL import Image
+
+from config.constants import DRAFT_LONG_SIDE, DRAFT_STEPS, REFINE_STRENGTH, REFINE_STEPS
+from models.generation import run_pipeline
+from models.preview_decoder import decode_preview
+
+
+def new_seed():
+    return random.randint(0, 2**31 - 1)
+
+
+def _generator(seed):
+    return torch.Generator("cpu").manual_seed(seed)
+
+
+def draft_size(width, height, long_side=DRAFT_LONG_SIDE):
+    """Résolution du brouillon: plus grand côté ramené à long_side, multiple de 8"""
+    scale = min(1.0, long_side / max(width, height))
+    return max(8, round(width * scale / 8) * 8), max(8, round(height * scale / 8) * 8)
+
+
+def run_draft(pipe, mode, seed, width, height, step_callbacks=(), steps=DRAFT_STEPS, **call_kwargs):
+    """Brouillon rapide: basse résolution, peu de pas, décodage TAESD. Renvoie (image, latents)"""
+    draft_width, draft_height = draft_size(width, height)
+    result = run_pipeline(pipe, mode, step_callbacks=step_callbacks, decoder="latent",
+                          width=draft_width, height=draft_height, num_inference_steps=steps,
+                          generator=_generator(seed), **call_kwargs)
+    latents = result.images.detach().cpu()
+    return decode_preview(latents)[0], latents
+
+
+def refine_draft(pipe, mode, latents, seed, image, mask_image, width, height, step_callbacks=(),
+                 strength=REFINE_STRENGTH, steps=REFINE_STEPS, decoder="full", **call_kwargs):
+    """Affine un brouillon approuvé: latents suréchantillonnés puis passe d'inpainting courte, même graine
+
+    Les latents agrandis sont décodés (TAESD) et collés dans le masque de l'image d'origine: hors
+    masque, la passe d'affinage repart des vrais pixels de la pièce et non du brouillon.
+    """
+    scale = pipe.vae_scale_factor
+    upscaled = F.interpolate(latents.float(), size=(height // scale, width // scale), mode="bicubic", align_corners=False)
+    draft_full = decode_preview(upscaled)[0].resize((width, height), Image.BICUBIC)
+    image = image.convert("RGB").resize((width, height), Image.LANCZOS)
+    mask_image = mask_image.convert("L").resize((width, height), Image.NEAREST)
+    init_image = Image.composite(draft_full, image, mask_image)
+
+    # Le pipeline ne fait que strength * num_inference_steps pas: environ `steps` pas effectifs
+    return run_pipeline(pipe, mode, step_callbacks=step_callbacks, decoder=decoder, image=init_image,
+                        mask_image=mask_image, strength=strength, num_inference_steps=math.ceil(steps / strength),
+                        width=width, height=height, generator=_generator(seed), **call_kwargs)
@@ -4,11 +4,18 @@ import uuid
 import os
 import traceback
 import tempfile
+import torch
 from PIL import Image
 from io import BytesIO
 
-from models.ikea_data import scan_ikea_dataset, ensure_ikea_dataset
+from models.ikea_data import scan_ikea_dataset, ensure_ikea_dataset, load_product_embeddings
 from models.model_loader import load_controlnet_inpaint_pipeline, clear_gpu_memory
+from models.generation import run_pipeline
+from models.preview_decoder import LivePreview
+from models.two_stage import new_seed, run_draft, refine_draft
+from models.style_sweep import run_style_sweep
+from utils.metrics import cached_call, timed, track_generation
+from utils.profiling import profile_request
 from utils.ui_components import (
     show_notification, 
     show_progress_steps, 
@@ -20,13 +27,35 @@ from utils.image_processing import (
     maintain_aspect_ratio,
     get_depth_map,
     generate_smart_mask,
+    furniture_item_masks,
+    layout_signature,
+    changed_region_mask,
+    regenerate_changed_regions,
     generate_inpainting_prompt,
     load_furniture_image,
     composite_multiple_furniture,
     suggest_furniture_position
 )
 from utils.helpers import create_draggable_canvas_alt, display_ikea_furniture, interactive_furniture_control
-from config.constants import IKEA_DATASET_DIR
+from config.constants import IKEA_DATASET_DIR, DEPTH_ESTIMATOR, INTERIOR_STYLES, CONTROLNET_TIER, GUIDANCE_SCHEDULE, TOKEN_MERGING_RATIO, PRODUCT_CONDITIONING_SCALE, DRAFT_STEPS, REFINE_STEPS
+
+def stop_generation():
+    """Interrompt la génération: le rerun Streamlit coupe le script au prochain aperçu"""
+    st.session_state.generate_button_clicked = False
+    st.session_state.active_step = 3
+
+def request_refine():
+    """Relance l'étape 4 pour affiner le brouillon affiché"""
+    st.session_state.refine_requested = True
+    st.session_state.generate_button_clicked = True
+    st.session_state.active_step = 4
+
+def request_new_draft():
+    """Relance l'étape 4 pour un nouveau brouillon (nouvelle graine)"""
+    st.session_state.refine_requested = False
+    st.session_state.ikea_draft = None
+    st.session_state.generate_button_clicked = True
+    st.session_state.active_step = 4
 
 def run_ikea_mode():
     """Exécute le mode IKEA avec sélection de meubles"""
@@ -84,13 +113,29 @@ def run_ikea_mode():
         st.header("3. Style d'intérieur")
         style = st.select_slider(
             "Style",
-            options=["Scandinave", "Moderne", "Industriel", "Classique", "Minimaliste"],
+            options=INTERIOR_STYLES,
             value="Scandinave"
         )
+        st.session_state.style_sweep = st.checkbox(
+            "Comparer les 5 styles", value=st.session_state.style_sweep,
+            help="Rend la même disposition dans les cinq styles en un seul passage par lots (galerie de résultats)."
+        )
 
         st.markdown("### Options de génération")
         # Force l'utilisation de la carte de profondeur
         st.session_state.use_depth_map = st.checkbox("Utiliser la carte de profondeur", value=True)
+        st.session_state.two_stage = st.checkbox(
+            "Aperçu puis affinage", value=st.session_state.two_stage,
+            help="Génère d'abord un brouillon basse résolution en quelques pas; seul le brouillon approuvé est affiné à pleine résolution."
+        )
+        st.session_state.incremental_regen = st.checkbox(
+            "Régénération incrémentale", value=st.session_state.incremental_regen,
+            help="Après un rendu, déplacer un meuble ne re-génère que les zones modifiées sur le rendu précédent (même graine)."
+        )
+        st.session_state.draft_render = st.checkbox(
+            "Brouillon rapide", value=st.session_state.draft_render,
+            help="Décode le résultat avec un décodeur léger pour un aperçu rapide; le rendu HD téléchargeable utilise le décodeur complet."
+        )
 
         # Options avancées dans un expander
         with st.expander("Paramètres Avancés"):
@@ -98,6 +143,25 @@ def run_ikea_mode():
             structure_preservation = st.slider("Préservation de structure", 0.3, 0.9, 0.7, 0.1)
             mask_dilation = st.slider("Protection du meuble (taille)", 10, 50, 25, 5)
             mask_threshold = st.slider("Sensibilité de détection", 10, 50, 30, 5)
+            depth_estimators = {"DPT hybride (précis)": "hybrid", "Depth Anything small (rapide)": "small",
+                                "Classique (sans réseau)": "classical"}
+            default_estimator = list(depth_estimators.values()).index(DEPTH_ESTIMATOR)
+            depth_estimator = depth_estimators[st.selectbox("Estimation de profondeur", list(depth_estimators),
+                                                            index=default_estimator)]
+            controlnet_tiers = {"Qualité (tous les pas)": "quality", "Équilibré (80 % des pas)": "balanced",
+                                "Rapide (50 % des pas)": "fast"}
+            default_tier = list(controlnet_tiers.values()).index(CONTROLNET_TIER)
+            controlnet_tier = controlnet_tiers[st.selectbox("Budget ControlNet", list(controlnet_tiers), index=default_tier,
+                                                            help="Fenêtre de pas où la profondeur guide le rendu; hors qualité, les résidus sont réutilisés un pas sur deux.")]
+            guidance_schedules = {"Constante": "constant", "Coupée en fin de génération": "truncate",
+                                  "Décroissante": "decay"}
+            default_schedule = list(guidance_schedules.values()).index(GUIDANCE_SCHEDULE)
+            guidance_schedule = guidance_schedules[st.selectbox("Guidance", list(guidance_schedules), index=default_schedule,
+                                                                help="Coupe ou fait décroître la guidance sur les derniers pas: ces pas ne calculent plus qu'une passe de l'UNet.")]
+            token_merging = st.slider("Fusion de tokens (brouillons)", 0.0, 0.6, TOKEN_MERGING_RATIO, 0.1,
+                                      help="Part des tokens fusionnés avant l'auto-attention de l'UNet; le rendu final HD n'est pas concerné.")
+            product_scale = st.slider("Fidélité aux produits IKEA", 0.0, 1.0, PRODUCT_CONDITIONING_SCALE, 0.1,
+                                      help="Conditionne le rendu sur l'image des produits du catalogue sélectionnés (IP-Adapter); 0 désactive.")
 
         # Liste des meubles sélectionnés
         if st.session_state.selected_furniture_items:
@@ -175,6 +239,8 @@ def run_ikea_mode():
                 # Bouton pour continuer
                 if st.button("Continuer vers la sélection de meubles ➡️", use_container_width=True):
                     st.session_state.room_img = room_img
+                    # Nouvelle pièce: le rendu précédent ne peut plus servir de base incrémentale
+                    st.session_state.last_render = None
                     st.session_state.active_step = 2
                     show_notification("Image téléchargée avec succès! Passons à la sélection des meubles.", "success")
                     st.rerun()
@@ -348,199 +414,376 @@ def run_ikea_mode():
     elif st.session_state.active_step == 4 and st.session_state.generate_button_clicked:
         st.header("4. Votre design d'intérieur généré par IA")
 
-        # Préparation des masques et cartes de profondeur
-        with st.spinner("Préparation des masques et analyse de la profondeur..."):
-            try:
-                # Utilisation de l'image composite stockée dans session state
-                source_img = st.session_state.composited_img
-
-                # Vérifier que source_img est disponible
-                if source_img is None:
-                    st.error("Image composite non disponible. Veuillez réessayer.")
-                    st.session_state.generate_button_clicked = False
-                    st.session_state.active_step = 3
-                    st.rerun()
-
-                # Génération du masque intelligent
-                mask_img = generate_smart_mask(
-                    st.session_state.room_img,
-                    source_img,
-                    dilation_factor=mask_dilation,
-                    threshold=mask_threshold,
-                    structure_preservation=structure_preservation
-                )
-
-                # Génération de la carte de profondeur
-                if st.session_state.use_depth_map:
-                    depth_map = get_depth_map(source_img)
-                else:
-                    depth_map = None
-
-                # Affichage des images techniques
-                st.subheader("Analyse technique de l'image")
-
-                col1, col2, col3 = st.columns(3)
-
-                with col1:
-                    st.markdown("<h5>Image originale</h5>", unsafe_allow_html=True)
-                    st.image(st.session_state.room_img, use_column_width=True)
+        # Profilage à la demande (variable d'environnement ou paramètre d'URL admin)
+        with profile_request("ikea"):
+            # Préparation des masques et cartes de profondeur
+            with st.spinner("Préparation des masques et analyse de la profondeur..."):
+                try:
+                    # Utilisation de l'image composite stockée dans session state
+                    source_img = st.session_state.composited_img
+
+                    # Vérifier que source_img est disponible
+                    if source_img is None:
+                        st.error("Image composite non disponible. Veuillez réessayer.")
+                        st.session_state.generate_button_clicked = False
+                        st.session_state.active_step = 3
+                        st.rerun()
 
-                with col2:
-                    st.markdown("<h5>Masque d'inpainting</h5>", unsafe_allow_html=True)
-                    st.image(mask_img, use_column_width=True)
+                    # Génération du masque intelligent
+                    with timed("smart_mask", mode="ikea"):
+                        # Masques exacts par meuble depuis l'alpha des sprites (conservés pour la suite)
+                        st.session_state.item_masks = furniture_item_masks(
+                            st.session_state.room_img.size,
+                            st.session_state.selected_furniture_items,
+                            dilation_factor=mask_dilation,
+                            threshold=mask_threshold
+                        )
+                        mask_img = generate_smart_mask(
+                            st.session_state.room_img,
+                            source_img,
+                            dilation_factor=mask_dilation,
+                            threshold=mask_threshold,
+                            structure_preservation=structure_preservation,
+                            item_masks=st.session_state.item_masks
+                        )
 
-                with col3:
-                    if depth_map:
-                        st.markdown("<h5>Carte de profondeur</h5>", unsafe_allow_html=True)
-                        st.image(depth_map, use_column_width=True)
+                    # Génération de la carte de profondeur
+                    if st.session_state.use_depth_map:
+                        with timed("depth_map", mode="ikea"):
+                            depth_map = cached_call("depth_map", get_depth_map, source_img, depth_estimator)
                     else:
-                        st.markdown("<h5>Carte de profondeur</h5>", unsafe_allow_html=True)
-                        st.info("Carte de profondeur désactivée")
-
-                # Génération du prompt avancé pour l'IA
-                prompt = generate_inpainting_prompt(
-                    st.session_state.room_type,
-                    style,
-                    st.session_state.selected_furniture_items
-                )
-
-                with st.expander("Voir le prompt de génération"):
-                    st.code(prompt, language="text")
-
-            except Exception as e:
-                st.error(f"Erreur lors de la préparation des masques: {e}")
-                st.session_state.generate_button_clicked = False
-                st.session_state.active_step = 3
-                st.rerun()
-
-        # Phase de génération avec l'IA
-        with st.spinner("Génération en cours avec IA..."):
-            try:
-                # Charger le modèle
-                pipe = load_controlnet_inpaint_pipeline()
-
-                if pipe is None:
-                    st.error("Impossible de charger les modèles d'IA.")
-                    st.session_state.generate_button_clicked = False
-                    st.session_state.active_step = 3
-                    st.rerun()
-
-                # Animation de progression
-                st.subheader("Génération en cours...")
-
-                progress_bar = st.progress(0)
-                status_text = st.empty()
-
-                steps = ["Analyse de la pièce", "Préparation des textures", "Génération du design", "Ajustement de l'éclairage", "Finalisation"]
-
-                for i, step in enumerate(steps):
-                    status_text.markdown(f"<h4>{step}</h4>", unsafe_allow_html=True)
-                    for j in range(20):
-                        time.sleep(0.05)
-                        progress_bar.progress((i * 20 + j + 1) / 100)
+                        depth_map = None
+
+                    # Affichage des images techniques
+                    st.subheader("Analyse technique de l'image")
+
+                    col1, col2, col3 = st.columns(3)
+
+                    with col1:
+                        st.markdown("<h5>Image originale</h5>", unsafe_allow_html=True)
+                        st.image(st.session_state.room_img, use_column_width=True)
+
+                    with col2:
+                        st.markdown("<h5>Masque d'inpainting</h5>", unsafe_allow_html=True)
+                        st.image(mask_img, use_column_width=True)
+
+                    with col3:
+                        if depth_map:
+                            st.markdown("<h5>Carte de profondeur</h5>", unsafe_allow_html=True)
+                            st.image(depth_map, use_column_width=True)
+                        else:
+                            st.markdown("<h5>Carte de profondeur</h5>", unsafe_allow_html=True)
+                            st.info("Carte de profondeur désactivée")
+
+                    # Génération du prompt avancé pour l'IA
+                    with timed("prompt", mode="ikea"):
+                        prompt = generate_inpainting_prompt(
+                            st.session_state.room_type,
+                            style,
+                            st.session_state.selected_furniture_items
+                        )
+                        # Balayage des styles: un prompt par style, entrées partagées calculées une fois
+                        sweep_prompts = [
+                            generate_inpainting_prompt(st.session_state.room_type, sweep_style, st.session_state.selected_furniture_items)
+                            for sweep_style in INTERIOR_STYLES
+                        ] if st.session_state.style_sweep else None
+
+                    # Embeddings d'image des produits sélectionnés: simple lecture du cache du catalogue
+                    product_embeds = None
+                    if product_scale > 0:
+                        with timed("product_embeds", mode="ikea"):
+                            embeddings = load_product_embeddings()
+                            if embeddings is not None:
+                                product_embeds = embeddings.lookup(st.session_state.selected_furniture_items)
+
+                    with st.expander("Voir le prompt de génération"):
+                        st.code(prompt, language="text")
+
+                    # Régénération incrémentale: zones modifiées depuis le dernier rendu, même prompt
+                    previous = st.session_state.last_render
+                    incremental_mask = None
+                    if (st.session_state.incremental_regen and previous is not None and previous["prompt"] == prompt
+                            and previous["result"].size == source_img.size and not st.session_state.refine_requested
+                            and not st.session_state.style_sweep and not st.session_state.two_stage):
+                        with timed("incremental_mask", mode="ikea"):
+                            incremental_mask = changed_region_mask(
+                                source_img.size,
+                                previous,
+                                st.session_state.selected_furniture_items,
+                                st.session_state.item_masks,
+                                threshold=mask_threshold
+                            )
 
-                # Vérifier que source_img n'est pas None avant de l'utiliser
-                if source_img is None:
-                    st.error("Image source non disponible. Veuillez réessayer.")
+                except Exception as e:
+                    st.error(f"Erreur lors de la préparation des masques: {e}")
                     st.session_state.generate_button_clicked = False
                     st.session_state.active_step = 3
                     st.rerun()
 
-                # Génération avec le modèle IA
-                negative_prompt = "distorted, poor quality, blur, lowres, bad anatomy, bad proportions, floating furniture, unrealistic layout"
-
-                result = pipe(
-                    prompt=prompt,
-                    negative_prompt=negative_prompt,
-                    image=source_img,
-                    mask_image=mask_img,
-                    control_image=depth_map if st.session_state.use_depth_map else None,
-                    num_inference_steps=40,
-                    guidance_scale=7.5,
-                )
-
-                # Libération de la mémoire GPU
-                clear_gpu_memory()
-
-                result_img = result.images[0]
-
-                # Affichage des résultats
-                st.subheader("🎉 Votre nouvel intérieur")
-
-                # Comparaison avant/après
-                st.markdown("<h3>Avant / Après</h3>", unsafe_allow_html=True)
-                show_before_after_comparison(st.session_state.room_img, result_img)
-
-                # Image finale haute résolution
-                st.markdown("<h3>Résultat final</h3>", unsafe_allow_html=True)
-                st.image(result_img, use_column_width=True)
-
-                # Options de téléchargement
-                with tempfile.NamedTemporaryFile(delete=False, suffix=".png") as tmpfile:
-                    result_img.save(tmpfile.name)
-
-                    dl_col1, dl_col2 = st.columns(2)
-                    with dl_col1:
-                        st.download_button(
-                            "📥 Télécharger le résultat HD",
-                            data=open(tmpfile.name, "rb"),
-                            file_name=f"ikea_design_{int(time.time())}.png",
-                            mime="image/png",
-                            use_container_width=True
-                        )
-                    with dl_col2:
-                        if st.button("🔄 Créer un nouveau design", use_container_width=True):
-                            st.session_state.generate_button_clicked = False
-                            st.session_state.active_step = 1
-                            show_notification("Commençons un nouveau projet!", "success")
-                            st.rerun()
-
-                # Suggestions et feedback
-                st.markdown("""
-                <div class="info-card">
-                    <h4>💡 Qu'en pensez-vous?</h4>
-                    <p>Votre avis nous aide à améliorer notre IA. Comment évaluez-vous le résultat?</p>
-                </div>
-                """, unsafe_allow_html=True)
-
-                feedback_col1, feedback_col2, feedback_col3, feedback_col4 = st.columns(4)
+            # Phase de génération avec l'IA
+            with st.spinner("Génération en cours avec IA..."):
+                try:
+                    # Charger le modèle
+                    with timed("pipeline_load", mode="ikea"):
+                        pipe = cached_call("controlnet_inpaint_pipeline", load_controlnet_inpaint_pipeline)
+
+                    if pipe is None:
+                        st.error("Impossible de charger les modèles d'IA.")
+                        st.session_state.generate_button_clicked = False
+                        st.session_state.active_step = 3
+                        st.rerun()
 
-                with feedback_col1:
-                    if st.button("😍 Parfait!", use_container_width=True):
-                        show_notification("Merci pour votre feedback positif!", "success")
+                    # Progression réelle et aperçus intermédiaires pendant le débruitage
+                    st.subheader("Génération en cours...")
 
-                with feedback_col2:
-                    if st.button("👍 Pas mal", use_container_width=True):
-                        show_notification("Merci pour votre feedback!", "success")
+                    progress_bar = st.progress(0)
+                    status_text = st.empty()
+                    preview_slot = st.empty()
+                    st.button("⏹️ Arrêter la génération", on_click=stop_generation, key="stop_ikea_generation")
 
-                with feedback_col3:
-                    if st.button("😐 Moyen", use_container_width=True):
-                        show_notification("Merci pour votre retour. Nous nous améliorons constamment!", "info")
+                    # Vérifier que source_img n'est pas None avant de l'utiliser
+                    if source_img is None:
+                        st.error("Image source non disponible. Veuillez réessayer.")
+                        st.session_state.generate_button_clicked = False
+                        st.session_state.active_step = 3
+                        st.rerun()
 
-                with feedback_col4:
-                    if st.button("👎 À améliorer", use_container_width=True):
-                        show_notification("Merci pour votre honnêteté! Nous travaillons à améliorer notre IA.", "info")
+                    # Génération avec le modèle IA
+                    negative_prompt = "distorted, poor quality, blur, lowres, bad anatomy, bad proportions, floating furniture, unrealistic layout"
+
+                    # Brouillon approuvé à affiner, le cas échéant (même graine et même prompt)
+                    draft = st.session_state.ikea_draft if st.session_state.refine_requested else None
+                    sweep_images = None
+                    is_sweep = sweep_prompts is not None and draft is None
+                    is_draft = st.session_state.two_stage and draft is None and not is_sweep
+                    is_incremental = incremental_mask is not None and draft is None and not is_sweep and not is_draft
+                    width, height = source_img.size[0] // 8 * 8, source_img.size[1] // 8 * 8
+                    control_image = depth_map if st.session_state.use_depth_map else None
+
+                    # LoRA du style choisi, activée par run_pipeline sous le verrou du pipeline (un lot de balayage
+                    # mélange les styles: UNet de base); affinage et régénération incrémentale reprennent le style
+                    # du rendu dont ils partent, cohérent avec son prompt
+                    if is_sweep:
+                        render_style = None
+                    elif draft is not None:
+                        render_style = draft.get("style", style)
+                    elif is_incremental:
+                        render_style = previous.get("style", style)
+                    else:
+                        render_style = style
+
+                    live_preview = LivePreview("ikea", preview_slot, DRAFT_STEPS if is_draft else REFINE_STEPS if draft is not None else 40,
+                                               progress_bar, status_text)
+                    with track_generation("ikea"):
+                        if draft is not None:
+                            result_img = refine_draft(
+                                pipe, "ikea", draft["latents"], draft["seed"], source_img, mask_img, width, height,
+                                step_callbacks=[live_preview],
+                                style=render_style,
+                                decoder="preview" if st.session_state.draft_render else "full",
+                                prompt=draft["prompt"],
+                                negative_prompt=negative_prompt,
+                                control_image=control_image,
+                                guidance_scale=7.5,
+                                controlnet_tier=controlnet_tier,
+                                guidance_schedule=guidance_schedule,
+                                token_merging=token_merging,
+                                product_embeds=product_embeds,
+                                product_scale=product_scale,
+                            ).images[0]
+                        elif is_sweep:
+                            sweep_images = run_style_sweep(
+                                pipe, "ikea", sweep_prompts, negative_prompt, new_seed(),
+                                step_callbacks=[live_preview],
+                                style=render_style,
+                                decoder="preview" if st.session_state.draft_render else "full",
+                                image=source_img,
+                                mask_image=mask_img,
+                                control_image=control_image,
+                                num_inference_steps=40,
+                                guidance_scale=7.5,
+                                controlnet_tier=controlnet_tier,
+                                guidance_schedule=guidance_schedule,
+                                token_merging=token_merging,
+                                product_embeds=product_embeds,
+                                product_scale=product_scale,
+                            )
+                            result_img = sweep_images[INTERIOR_STYLES.index(style)]
+                        elif is_draft:
+                            seed = new_seed()
+                            result_img, latents = run_draft(
+                                pipe, "ikea", seed, width, height,
+                                step_callbacks=[live_preview],
+                                style=render_style,
+                                prompt=prompt,
+                                negative_prompt=negative_prompt,
+                                image=source_img,
+                                mask_image=mask_img,
+                                control_image=control_image,
+                                guidance_scale=7.5,
+                                controlnet_tier=controlnet_tier,
+                                guidance_schedule=guidance_schedule,
+                                token_merging=token_merging,
+                                product_embeds=product_embeds,
+                                product_scale=product_scale,
+                            )
+                            st.session_state.ikea_draft = {"seed": seed, "latents": latents, "prompt": prompt, "style": style}
+                        elif is_incremental:
+                            seed, prompt = previous["seed"], previous["prompt"]
+                            result_img = regenerate_changed_regions(
+                                pipe, previous, st.session_state.selected_furniture_items, incremental_mask,
+                                control_image=control_image,
+                                step_callbacks=[live_preview],
+                                style=render_style,
+                                decoder="preview" if st.session_state.draft_render else "full",
+                                negative_prompt=negative_prompt,
+                                num_inference_steps=40,
+                                guidance_scale=7.5,
+                                controlnet_tier=controlnet_tier,
+                                guidance_schedule=guidance_schedule,
+                                token_merging=token_merging,
+                                product_embeds=product_embeds,
+                                product_scale=product_scale,
+                            )
+                        else:
+                            seed = new_seed()
+                            result_img = run_pipeline(
+                                pipe,
+                                "ikea",
+                                step_callbacks=[live_preview],
+                                style=render_style,
+                                prompt=prompt,
+                                negative_prompt=negative_prompt,
+                                image=source_img,
+                                mask_image=mask_img,
+                                control_image=control_image,
+                                num_inference_steps=40,
+                                guidance_scale=7.5,
+                                generator=torch.Generator("cpu").manual_seed(seed),
+                                controlnet_tier=controlnet_tier,
+                                guidance_schedule=guidance_schedule,
+                                token_merging=token_merging,
+                                product_embeds=product_embeds,
+                                product_scale=product_scale,
+                                decoder="preview" if st.session_state.draft_render else "full",
+                            ).images[0]
+                    live_preview.finish()
+                    st.session_state.refine_requested = False
+
+                    # Base des régénérations incrémentales: seuls les rendus complets HD en servent
+                    if not is_sweep and not is_draft and not st.session_state.draft_render:
+                        st.session_state.last_render = {
+                            "seed": draft["seed"] if draft is not None else seed,
+                            "prompt": draft["prompt"] if draft is not None else prompt,
+                            "style": render_style,
+                            "layout": layout_signature(st.session_state.selected_furniture_items),
+                            "item_masks": st.session_state.item_masks,
+                            "result": result_img.resize(source_img.size, Image.LANCZOS) if result_img.size != source_img.size else result_img,
+                        }
 
-                # Suggestions pour aller plus loin
-                st.markdown("""
-                <div class="info-card">
-                    <h4>✨ Et maintenant?</h4>
-                    <ul>
-                        <li><strong>Partagez votre design</strong> avec vos amis ou votre designer d'intérieur</li>
-                        <li><strong>Visitez un magasin IKEA</strong> avec cette image pour trouver des meubles similaires</li>
-                        <li><strong>Essayez différents styles</strong> pour voir d'autres possibilités d'aménagement</li>
-                        <li><strong>Créez un nouveau design</strong> pour une autre pièce de votre maison</li>
-                    </ul>
-                </div>
-                """, unsafe_allow_html=True)
+                    # Libération de la mémoire GPU
+                    clear_gpu_memory()
+
+                    # Affichage des résultats
+                    st.subheader("🎉 Votre nouvel intérieur")
+
+                    # Comparaison avant/après
+                    st.markdown("<h3>Avant / Après</h3>", unsafe_allow_html=True)
+                    show_before_after_comparison(st.session_state.room_img, result_img)
+
+                    # Image finale haute résolution
+                    st.markdown("<h3>Résultat final</h3>", unsafe_allow_html=True)
+                    st.image(result_img, use_column_width=True)
+                    if is_incremental:
+                        st.caption("Régénération incrémentale: seules les zones modifiées depuis le rendu précédent ont été recalculées.")
+
+                    # Galerie du balayage: même disposition, un rendu par style
+                    if sweep_images is not None:
+                        st.markdown("<h3>Comparaison des styles</h3>", unsafe_allow_html=True)
+                        for sweep_col, sweep_style, sweep_img in zip(st.columns(len(sweep_images)), INTERIOR_STYLES, sweep_images):
+                            with sweep_col:
+                                st.image(sweep_img, caption=sweep_style, use_column_width=True)
+
+                    # Options de téléchargement
+                    with tempfile.NamedTemporaryFile(delete=False, suffix=".png") as tmpfile:
+                        dl_col1, dl_col2 = st.columns(2)
+                        with dl_col1:
+                            if is_draft:
+                                # Seul le brouillon approuvé paie le rendu pleine résolution
+                                st.info("Brouillon basse résolution: affinez-le ou générez-en un autre.")
+                                st.button("✅ Affiner ce brouillon", on_click=request_refine, use_container_width=True)
+                                st.button("🎲 Autre brouillon", on_click=request_new_draft, use_container_width=True)
+                            elif st.session_state.draft_render:
+                                # Le décodeur complet n'est utilisé que pour l'image téléchargeable
+                                st.info("Brouillon rapide: décochez « Brouillon rapide » pour générer le rendu HD téléchargeable.")
+                            else:
+                                with timed("encode", mode="ikea"):
+                                    result_img.save(tmpfile.name)
+                                st.download_button(
+                                    "📥 Télécharger le résultat HD",
+                                    data=open(tmpfile.name, "rb"),
+                                    file_name=f"ikea_design_{int(time.time())}.png",
+                                    mime="image/png",
+                                    use_container_width=True
+                                )
+                        with dl_col2:
+                            if st.button("↩️ Ajuster la disposition", use_container_width=True):
+                                st.session_state.generate_button_clicked = False
+                                st.session_state.active_step = 3
+                                st.rerun()
+                            if st.button("🔄 Créer un nouveau design", use_container_width=True):
+                                st.session_state.generate_button_clicked = False
+                                st.session_state.last_render = None
+                                st.session_state.active_step = 1
+                                show_notification("Commençons un nouveau projet!", "success")
+                                st.rerun()
+
+                    # Suggestions et feedback
+                    st.markdown("""
+                    <div class="info-card">
+                        <h4>💡 Qu'en pensez-vous?</h4>
+                        <p>Votre avis nous aide à améliorer notre IA. Comment évaluez-vous le résultat?</p>
+                    </div>
+                    """, unsafe_allow_html=True)
+
+                    feedback_col1, feedback_col2, feedback_col3, feedback_col4 = st.columns(4)
+
+                    with feedback_col1:
+                        if st.button("😍 Parfait!", use_container_width=True):
+                            show_notification("Merci pour votre feedback positif!", "success")
+
+                    with feedback_col2:
+                        if st.button("👍 Pas mal", use_container_width=True):
+                            show_notification("Merci pour votre feedback!", "success")
+
+                    with feedback_col3:
+                        if st.button("😐 Moyen", use_container_width=True):
+                            show_notification("Merci pour votre retour. Nous nous améliorons constamment!", "info")
+
+                    with feedback_col4:
+                        if st.button("👎 À améliorer", use_container_width=True):
+                            show_notification("Merci pour votre honnêteté! Nous travaillons à améliorer notre IA.", "info")
+
+                    # Suggestions pour aller plus loin
+                    st.markdown("""
+                    <div class="info-card">
+                        <h4>✨ Et maintenant?</h4>
+                        <ul>
+                            <li><strong>Partagez votre design</strong> avec vos amis ou votre designer d'intérieur</li>
+                            <li><strong>Visitez un magasin IKEA</strong> avec cette image pour trouver des meubles similaires</li>
+                            <li><strong>Essayez différents styles</strong> pour voir d'autres possibilités d'aménagement</li>
+                            <li><strong>Créez un nouveau design</strong> pour une autre pièce de votre maison</li>
+                        </ul>
+                    </div>
+                    """, unsafe_allow_html=True)
 
-            except Exception as e:
-                st.error(f"Erreur pendant la génération: {str(e)}")
-                st.error(traceback.format_exc())
-                show_notification("Une erreur est survenue pendant la génération", "error")
+                except Exception as e:
+                    st.error(f"Erreur pendant la génération: {str(e)}")
+                    st.error(traceback.format_exc())
+                    show_notification("Une erreur est survenue pendant la génération", "error")
 
-            # Réinitialiser l'état pour éviter des générations répétées
-            st.session_state.generate_button_clicked = False
+                # Réinitialiser l'état pour éviter des générations répétées
+                st.session_state.generate_button_clicked = False
 
     # Cas où aucune étape n'est active ou manque d'éléments nécessaires
     elif not st.session_state.room_img:
@@ -6,9 +6,14 @@ from PIL import Image
 from io import BytesIO
 
 from models.model_loader import load_inpainting_model
-from models.ikea_data import load_ikea_metadata
-from utils.image_processing import generate_inpainting_mask, add_furniture_ai
+from models.ikea_data import load_ikea_metadata, load_retrieval_index
+from models.preview_decoder import LivePreview
+from models.two_stage import new_seed
+from utils.image_processing import generate_inpainting_mask, add_furniture_ai, draft_furniture_ai, refine_furniture_ai
 from utils.ui_components import create_styled_upload_area, show_loading_spinner, show_notification
+from utils.metrics import cached_call, timed, track_generation
+from utils.profiling import profile_request
+from config.constants import GUIDANCE_SCHEDULE, DRAFT_STEPS, REFINE_STEPS
 
 def run_simple_mode():
     """Exécute le mode simple (inpainting direct)"""
@@ -83,18 +88,45 @@ def run_simple_mode():
         if st.session_state.result_image is not None:
             st.image(st.session_state.result_image, caption="Pièce meublée par l'IA", use_column_width=True)
 
-            # Bouton de téléchargement
-            img_byte_arr = io.BytesIO()
-            st.session_state.result_image.save(img_byte_arr, format='PNG')
-            img_byte_arr = img_byte_arr.getvalue()
-
-            st.download_button(
-                label="💾 Télécharger l'image meublée",
-                data=img_byte_arr,
-                file_name=f"piece_meublee_{int(time.time())}.png",
-                mime="image/png",
-                use_container_width=True
-            )
+            if st.session_state.result_is_draft and st.session_state.simple_draft is not None:
+                st.info("Brouillon: relancez « Générer » pour un autre brouillon, ou affinez celui-ci à pleine résolution.")
+                if st.button("✅ Affiner ce brouillon", use_container_width=True, key="refine_simple"):
+                    with st.spinner("Affinage à pleine résolution..."):
+                        progress_bar = st.progress(0)
+                        status_text = st.empty()
+                        preview_slot = st.empty()
+                        live_preview = LivePreview("simple", preview_slot, REFINE_STEPS, progress_bar, status_text)
+                        try:
+                            with profile_request("simple"), track_generation("simple"):
+                                st.session_state.result_image = refine_furniture_ai(
+                                    st.session_state.original_image,
+                                    st.session_state.model_pipeline,
+                                    st.session_state.simple_draft,
+                                    step_callbacks=[live_preview]
+                                )
+                            live_preview.finish()
+                            st.session_state.simple_draft = None
+                            st.session_state.result_is_draft = False
+                            st.rerun()
+                        except Exception as e:
+                            st.error(f"Erreur pendant l'affinage: {e}")
+            elif st.session_state.result_is_draft:
+                # Le décodeur complet n'est utilisé que pour l'image téléchargeable
+                st.info("Brouillon rapide: décochez « Brouillon rapide » et relancez pour obtenir l'image finale téléchargeable.")
+            else:
+                # Bouton de téléchargement
+                with timed("encode", mode="simple"):
+                    img_byte_arr = io.BytesIO()
+                    st.session_state.result_image.save(img_byte_arr, format='PNG')
+                    img_byte_arr = img_byte_arr.getvalue()
+
+                st.download_button(
+                    label="💾 Télécharger l'image meublée",
+                    data=img_byte_arr,
+                    file_name=f"piece_meublee_{int(time.time())}.png",
+                    mime="image/png",
+                    use_container_width=True
+                )
 
             # Feedback rapide
             st.markdown("<h4>Qu'en pensez-vous?</h4>", unsafe_allow_html=True)
@@ -125,12 +157,12 @@ def run_simple_mode():
     if 'model_pipeline' not in st.session_state:
         with st.spinner("Chargement du modèle d'IA..."):
             show_loading_spinner("Préparation du modèle d'IA...")
-            st.session_state.model_pipeline = load_inpainting_model()
+            with timed("pipeline_load", mode="simple"):
+                st.session_state.model_pipeline = cached_call("inpainting_model", load_inpainting_model)
 
-    if 'ikea_products' not in st.session_state or 'ikea_img_desc' not in st.session_state:
-        with st.spinner("Chargement des données IKEA..."):
-            show_loading_spinner("Préparation du catalogue IKEA...")
-            st.session_state.ikea_products, st.session_state.ikea_img_desc = load_ikea_metadata()
+    # Tables partagées par tous les processus: l'ouverture est quasi instantanée
+    if st.session_state.ikea_products is None or st.session_state.ikea_img_desc is None:
+        st.session_state.ikea_products, st.session_state.ikea_img_desc = load_ikea_metadata()
 
     # Section de description des meubles
     st.header("3. Décrivez les meubles souhaités")
@@ -184,6 +216,18 @@ def run_simple_mode():
         include_ikea = st.checkbox("Mentionner explicitement IKEA dans le prompt", value=True,
                                 help="Ajoute 'IKEA style' à votre description pour des résultats plus proches du style IKEA")
 
+        draft_render = st.checkbox("Brouillon rapide", value=False,
+                                help="Décode le résultat avec un décodeur léger: beaucoup plus rapide, un peu moins fin. Décochez pour l'image finale téléchargeable.")
+
+        two_stage = st.checkbox("Aperçu puis affinage", value=False,
+                                help="Génère d'abord un brouillon basse résolution en quelques pas; seul le brouillon approuvé est affiné à pleine résolution.")
+
+        guidance_schedules = {"Constante": "constant", "Coupée en fin de génération": "truncate",
+                              "Décroissante": "decay"}
+        default_schedule = list(guidance_schedules.values()).index(GUIDANCE_SCHEDULE)
+        guidance_schedule = guidance_schedules[st.selectbox("Guidance", list(guidance_schedules), index=default_schedule,
+                                help="Coupe ou fait décroître la guidance sur les derniers pas: ces pas ne calculent plus qu'une passe de l'UNet.")]
+
     # Bouton de génération
     submit_button = st.button("✨ Générer l'aménagement", use_container_width=True, key="submit_simple",
                             disabled=st.session_state.original_image is None)
@@ -204,31 +248,51 @@ def run_simple_mode():
                     st.code(enhanced_prompt)
 
                 try:
-                    # Animation de progression
+                    # Progression réelle et aperçus intermédiaires pendant le débruitage
                     progress_bar = st.progress(0)
                     status_text = st.empty()
-
-                    steps = ["Analyse de la pièce", "Préparation du design", "Création des meubles", "Intégration", "Finalisation"]
-
-                    for i, step in enumerate(steps):
-                        status_text.markdown(f"<h4>{step}</h4>", unsafe_allow_html=True)
-                        for j in range(20):
-                            time.sleep(0.05)  # Simuler le traitement
-                            progress_bar.progress((i * 20 + j + 1) / 100)
+                    preview_slot = st.empty()
+                    # Un clic relance le script, ce qui interrompt la génération au prochain aperçu
+                    st.button("⏹️ Arrêter la génération", key="stop_simple_generation")
+                    live_preview = LivePreview("simple", preview_slot, DRAFT_STEPS if two_stage else 50, progress_bar, status_text)
 
                     # Récupération du modèle et des données
                     model_pipeline = st.session_state.model_pipeline
                     ikea_products = st.session_state.ikea_products
                     ikea_img_desc = st.session_state.ikea_img_desc
 
-                    # Génération avec le modèle
-                    st.session_state.result_image = add_furniture_ai(
-                        st.session_state.original_image,
-                        enhanced_prompt,
-                        model_pipeline,
-                        ikea_products,
-                        ikea_img_desc
-                    )
+                    # Génération avec le modèle (LoRA du style activée par run_pipeline, sous le verrou du pipeline)
+                    with profile_request("simple"), track_generation("simple"):
+                        if two_stage:
+                            st.session_state.result_image, st.session_state.simple_draft = draft_furniture_ai(
+                                st.session_state.original_image,
+                                enhanced_prompt,
+                                model_pipeline,
+                                new_seed(),
+                                ikea_img_desc,
+                                retrieval_index=load_retrieval_index(),
+                                retrieval_query=f"{furniture_prompt} {room_type}",
+                                step_callbacks=[live_preview],
+                                guidance_schedule=guidance_schedule,
+                                style=selected_style
+                            )
+                        else:
+                            st.session_state.result_image = add_furniture_ai(
+                                st.session_state.original_image,
+                                enhanced_prompt,
+                                model_pipeline,
+                                ikea_products,
+                                ikea_img_desc,
+                                retrieval_index=load_retrieval_index(),
+                                retrieval_query=f"{furniture_prompt} {room_type}",
+                                decoder="preview" if draft_render else "full",
+                                step_callbacks=[live_preview],
+                                guidance_schedule=guidance_schedule,
+                                style=selected_style
+                            )
+                            st.session_state.simple_draft = None
+                    live_preview.finish()
+                    st.session_state.result_is_draft = two_stage or draft_render
 
                     show_notification("Pièce meublée avec succès!", "success")
                     st.rerun()
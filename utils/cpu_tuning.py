@@ -0,0 +1,208 @@
+import os
+import sys
+import glob
+import json
+import time
+import platform
+import argparse
+import statistics
+import torch
+
+from config.constants import DEVICE, CPU_TUNING_FILE, WORKER_INDEX, NUM_WORKERS, DEPTH_MODEL_ID
+
+TUNED_COMPONENTS = ("unet", "dpt", "rembg")
+
+
+def _parse_cpulist(text):
+    cpus = []
+    for part in text.strip().split(","):
+        if "-" in part:
+            start, end = part.split("-")
+            cpus.extend(range(int(start), int(end) + 1))
+        elif part:
+            cpus.append(int(part))
+    return cpus
+
+
+def numa_nodes():
+    """Liste des cœurs disponibles regroupés par nœud NUMA"""
+    available = set(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else set(range(os.cpu_count() or 1))
+    nodes = []
+    for path in sorted(glob.glob("/sys/devices/system/node/node[0-9]*/cpulist")):
+        with open(path) as f:
+            cpus = [cpu for cpu in _parse_cpulist(f.read()) if cpu in available]
+        if cpus:
+            nodes.append(cpus)
+    return nodes or [sorted(available)]
+
+
+def worker_core_set(worker_index=WORKER_INDEX, num_workers=NUM_WORKERS):
+    """Cœurs réservés à un worker: nœuds NUMA répartis entre workers, découpés en parts disjointes si besoin"""
+    nodes = numa_nodes()
+    if num_workers < 1 or not 0 <= worker_index < num_workers:
+        print(f"CPU tuning: invalid worker index {worker_index} for {num_workers} workers, using all cores")
+        return sorted(cpu for node in nodes for cpu in node)
+    if num_workers <= len(nodes):
+        return sorted(cpu for node in nodes[worker_index::num_workers] for cpu in node)
+    node = nodes[worker_index % len(nodes)]
+    workers_on_node = [w for w in range(num_workers) if w % len(nodes) == worker_index % len(nodes)]
+    share = max(1, len(node) // len(workers_on_node))
+    slot = workers_on_node.index(worker_index)
+    return node[slot * share:(slot + 1) * share] or node
+
+
+def machine_fingerprint(num_cores):
+    """Identifie la machine (modèle de CPU, cœurs alloués, version de torch) pour les réglages"""
+    model = platform.processor() or platform.machine()
+    try:
+        with open("/proc/cpuinfo") as f:
+            for line in f:
+                if line.startswith("model name"):
+                    model = line.split(":", 1)[1].strip()
+                    break
+    except OSError:
+        pass
+    return f"{model}|cores={num_cores}|torch={torch.__version__}"
+
+
+def load_tuning(fingerprint):
+    if not os.path.exists(CPU_TUNING_FILE):
+        return None
+    with open(CPU_TUNING_FILE) as f:
+        return json.load(f).get(fingerprint)
+
+
+def save_tuning(fingerprint, settings):
+    data = {}
+    if os.path.exists(CPU_TUNING_FILE):
+        with open(CPU_TUNING_FILE) as f:
+            data = json.load(f)
+    data[fingerprint] = settings
+    os.makedirs(os.path.dirname(CPU_TUNING_FILE) or ".", exist_ok=True)
+    with open(f"{CPU_TUNING_FILE}.tmp", "w") as f:
+        json.dump(data, f, indent=2)
+    os.replace(f"{CPU_TUNING_FILE}.tmp", CPU_TUNING_FILE)
+
+
+_applied = {}
+
+
+def apply_cpu_tuning(worker_index=WORKER_INDEX, num_workers=NUM_WORKERS):
+    """Épingle le processus sur ses cœurs et applique les nombres de threads mesurés
+
+    Le nombre de threads torch est global au processus et partagé par les sessions concurrentes: il
+    n'est fixé qu'ici, au démarrage, avec la valeur de l'UNet (l'essentiel du temps de calcul). Les
+    valeurs DPT et rembg servent à leurs sessions ONNX Runtime, qui ont leur propre pool de threads.
+    """
+    if _applied or DEVICE.type != "cpu":
+        return _applied
+
+    cores = worker_core_set(worker_index, num_workers)
+    if hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cores)
+
+    settings = load_tuning(machine_fingerprint(len(cores))) or {}
+    threads = {component: settings.get(component, len(cores)) for component in TUNED_COMPONENTS}
+
+    torch.set_num_threads(threads["unet"])
+    try:
+        # Doit précéder tout travail parallèle inter-opérateurs
+        torch.set_num_interop_threads(settings.get("interop", 1))
+    except RuntimeError:
+        pass
+    # rembg lit OMP_NUM_THREADS à la création de sa session ONNX Runtime
+    os.environ["OMP_NUM_THREADS"] = str(threads["rembg"])
+
+    _applied.update(threads, cores=cores, tuned=bool(settings))
+    print(f"CPU tuning: worker {worker_index}/{num_workers} pinned to cores {cores}, threads {threads}")
+    return _applied
+
+
+def tuned_thread_count(component):
+    """Nombre de threads retenu pour un composant (sessions ONNX Runtime notamment)"""
+    return _applied.get(component) or torch.get_num_threads()
+
+
+def _time_call(fn, repeats):
+    fn()  # échauffement
+    durations = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        durations.append(time.perf_counter() - start)
+    return statistics.median(durations)
+
+
+def _unet_benchmark():
+    from diffusers import UNet2DConditionModel
+    unet = UNet2DConditionModel.from_pretrained("stabilityai/stable-diffusion-xl-base-1.0", subfolder="unet")
+    unet.eval()
+    sample = torch.randn(2, unet.config.in_channels, 64, 64)
+    encoder_hidden_states = torch.randn(2, 77, unet.config.cross_attention_dim)
+    added_cond_kwargs = {"text_embeds": torch.randn(2, 1280), "time_ids": torch.randn(2, 6)}
+
+    def run():
+        with torch.no_grad():
+            unet(sample, 500, encoder_hidden_states=encoder_hidden_states, added_cond_kwargs=added_cond_kwargs)
+    return run
+
+
+def _dpt_benchmark():
+    from transformers import DPTForDepthEstimation
+    model = DPTForDepthEstimation.from_pretrained(DEPTH_MODEL_ID).eval()
+    pixel_values = torch.randn(1, 3, 384, 384)
+
+    def run():
+        with torch.no_grad():
+            model(pixel_values=pixel_values)
+    return run
+
+
+def _rembg_benchmark(threads):
+    from PIL import Image
+    from rembg import new_session, remove
+    os.environ["OMP_NUM_THREADS"] = str(threads)
+    session = new_session("u2net")
+    image = Image.new("RGB", (256, 256), (200, 180, 160))
+    return lambda: remove(image, session=session)
+
+
+def autotune(thread_counts, repeats=3, worker_index=WORKER_INDEX, num_workers=NUM_WORKERS):
+    """Mesure UNet, DPT et rembg pour chaque nombre de threads et enregistre les meilleurs"""
+    cores = worker_core_set(worker_index, num_workers)
+    if hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cores)
+    thread_counts = [n for n in thread_counts if n <= len(cores)] or [len(cores)]
+
+    measurements = {component: {} for component in TUNED_COMPONENTS}
+    torch_benchmarks = {"unet": _unet_benchmark(), "dpt": _dpt_benchmark()}
+    for threads in thread_counts:
+        torch.set_num_threads(threads)
+        for component, run in torch_benchmarks.items():
+            measurements[component][threads] = _time_call(run, repeats)
+        measurements["rembg"][threads] = _time_call(_rembg_benchmark(threads), repeats)
+        print(f"threads={threads}: " + ", ".join(f"{c}={measurements[c][threads]:.3f}s" for c in TUNED_COMPONENTS))
+
+    settings = {component: min(results, key=results.get) for component, results in measurements.items()}
+    settings["interop"] = 1
+    settings["measurements"] = {c: {str(n): t for n, t in r.items()} for c, r in measurements.items()}
+    fingerprint = machine_fingerprint(len(cores))
+    save_tuning(fingerprint, settings)
+    print(f"Saved CPU tuning for {fingerprint}: " + ", ".join(f"{c}={settings[c]}" for c in TUNED_COMPONENTS))
+    return settings
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Autotuning des threads CPU pour l'inférence")
+    parser.add_argument("--threads", default="1,2,4,8,16,32", help="Nombres de threads à tester")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--worker-index", type=int, default=WORKER_INDEX)
+    parser.add_argument("--num-workers", type=int, default=NUM_WORKERS)
+    args = parser.parse_args(argv)
+
+    autotune([int(n) for n in args.threads.split(",")], args.repeats, args.worker_index, args.num_workers)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,167 @@
+import os
+import sys
+import glob
+import time
+import argparse
+import numpy as np
+import cv2
+from PIL import Image
+
+from config.constants import DEPTH_ESTIMATOR, DEPTH_ESTIMATORS, DEPTH_INFERENCE_SIZE
+from utils.metrics import write_results
+
+
+# Multiple imposé par la taille de patch de chaque réseau
+_SIZE_MULTIPLE = {"hybrid": 32, "small": 14, "classical": 1}
+
+GUIDED_FILTER_RADIUS = 4
+GUIDED_FILTER_EPS = 1e-3
+
+
+def inference_size(image_size, estimator, max_side=DEPTH_INFERENCE_SIZE):
+    """Taille d'inférence basse résolution: plus grand côté borné, proportions conservées"""
+    width, height = image_size
+    scale = min(1.0, max_side / max(width, height))
+    multiple = _SIZE_MULTIPLE[estimator]
+    return (max(multiple, round(width * scale / multiple) * multiple),
+            max(multiple, round(height * scale / multiple) * multiple))
+
+
+def _normalize(depth):
+    depth = depth.astype(np.float32)
+    low, high = float(depth.min()), float(depth.max())
+    return (depth - low) / (high - low) if high > low else np.zeros_like(depth)
+
+
+def guided_upsample(depth, guide_image, radius=GUIDED_FILTER_RADIUS, eps=GUIDED_FILTER_EPS):
+    """Suréchantillonnage guidé par l'image (fast guided filter): les bords de profondeur suivent ceux de la pièce
+
+    Les coefficients linéaires a, b sont calculés à basse résolution puis interpolés; seule la
+    combinaison finale q = a * I + b est faite à la résolution de la pièce.
+    """
+    guide_full = np.asarray(guide_image.convert("L"), dtype=np.float32) / 255.0
+    low_h, low_w = depth.shape
+    guide = cv2.resize(guide_full, (low_w, low_h), interpolation=cv2.INTER_AREA)
+    depth = _normalize(depth)
+
+    ksize = (2 * radius + 1, 2 * radius + 1)
+    mean_i = cv2.boxFilter(guide, -1, ksize)
+    mean_p = cv2.boxFilter(depth, -1, ksize)
+    cov_ip = cv2.boxFilter(guide * depth, -1, ksize) - mean_i * mean_p
+    var_i = cv2.boxFilter(guide * guide, -1, ksize) - mean_i * mean_i
+    a = cov_ip / (var_i + eps)
+    b = mean_p - a * mean_i
+    mean_a = cv2.boxFilter(a, -1, ksize)
+    mean_b = cv2.boxFilter(b, -1, ksize)
+
+    full_h, full_w = guide_full.shape
+    mean_a = cv2.resize(mean_a, (full_w, full_h), interpolation=cv2.INTER_LINEAR)
+    mean_b = cv2.resize(mean_b, (full_w, full_h), interpolation=cv2.INTER_LINEAR)
+    return mean_a * guide_full + mean_b
+
+
+def classical_depth(image):
+    """Profondeur approchée sans réseau: le sol (bas de l'image) est proche, les zones texturées avancent"""
+    gray = np.asarray(image.convert("L"), dtype=np.float32) / 255.0
+    height, width = gray.shape
+    ramp = np.linspace(0.0, 1.0, height, dtype=np.float32)[:, None].repeat(width, axis=1)
+    edges = np.abs(cv2.Laplacian(cv2.GaussianBlur(gray, (5, 5), 0), cv2.CV_32F))
+    detail = cv2.GaussianBlur(edges, (0, 0), sigmaX=max(width, height) / 40)
+    return 0.8 * ramp + 0.2 * _normalize(detail)
+
+
+def _network_depth(image, estimator):
+    import torch
+    from models.model_loader import load_depth_model
+    from models.onnx_backend import onnx_enabled
+
+    processor, model = load_depth_model(estimator)
+    if estimator == "hybrid" and onnx_enabled("depth"):
+        # Le graphe ONNX de DPT est exporté en 384x384: le processeur garde sa résolution native
+        inputs = processor(images=image, return_tensors="pt")
+    else:
+        inputs = processor(images=image.resize(inference_size(image.size, estimator), Image.BICUBIC),
+                           do_resize=False, return_tensors="pt")
+    with torch.no_grad():
+        return model(**inputs).predicted_depth[0].float().numpy()
+
+
+def estimate_depth(image, estimator=DEPTH_ESTIMATOR):
+    """Carte de profondeur uint8 à la résolution de l'image (proche = clair)"""
+    if estimator not in DEPTH_ESTIMATORS:
+        raise ValueError(f"Unknown depth estimator {estimator!r}, expected one of {DEPTH_ESTIMATORS}")
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+
+    if estimator == "classical":
+        depth = classical_depth(image.resize(inference_size(image.size, estimator), Image.BILINEAR))
+    else:
+        depth = _network_depth(image, estimator)
+    depth = guided_upsample(depth, image)
+    return Image.fromarray((np.clip(_normalize(depth), 0, 1) * 255).round().astype(np.uint8))
+
+
+def _reference_depth(image):
+    """Référence de qualité: DPT hybride à sa résolution native, redimensionné en LANCZOS (ancien chemin)"""
+    import torch
+    from models.model_loader import load_depth_model
+
+    processor, model = load_depth_model("hybrid")
+    with torch.no_grad():
+        depth = model(**processor(images=image, return_tensors="pt")).predicted_depth[0].float().numpy()
+    depth = Image.fromarray((_normalize(depth) * 255).astype(np.uint8)).resize(image.size, Image.LANCZOS)
+    return np.asarray(depth, dtype=np.float32) / 255.0
+
+
+def benchmark(image_paths, estimators, repeats=3):
+    """Latence par estimateur et accord avec la référence hybride native (corrélation, RMSE, bords)"""
+    report = {estimator: {"latency_s": [], "correlation": [], "rmse": [], "edge_f1": []} for estimator in estimators}
+    for path in image_paths:
+        image = Image.open(path).convert("RGB")
+        reference = _reference_depth(image)
+        reference_edges = cv2.Canny((reference * 255).astype(np.uint8), 50, 150) > 0
+        for estimator in estimators:
+            estimate_depth(image, estimator)  # échauffement (chargement du modèle)
+            start = time.perf_counter()
+            for _ in range(repeats):
+                depth = estimate_depth(image, estimator)
+            report[estimator]["latency_s"].append((time.perf_counter() - start) / repeats)
+
+            depth = np.asarray(depth, dtype=np.float32) / 255.0
+            report[estimator]["correlation"].append(float(np.corrcoef(depth.ravel(), reference.ravel())[0, 1]))
+            report[estimator]["rmse"].append(float(np.sqrt(np.mean((depth - reference) ** 2))))
+            edges = cv2.Canny((depth * 255).astype(np.uint8), 50, 150) > 0
+            matched = np.logical_and(cv2.dilate(edges.astype(np.uint8), np.ones((5, 5), np.uint8)) > 0, reference_edges)
+            precision = matched.sum() / max(1, edges.sum())
+            recall = matched.sum() / max(1, reference_edges.sum())
+            report[estimator]["edge_f1"].append(float(2 * precision * recall / max(1e-9, precision + recall)))
+
+    summary = {estimator: {metric: float(np.mean(values)) for metric, values in metrics.items()}
+               for estimator, metrics in report.items()}
+    summary["inference_size"] = DEPTH_INFERENCE_SIZE
+    summary["images"] = len(image_paths)
+    write_results("depth_benchmark.json", summary, echo=False)
+    for estimator in estimators:
+        metrics = summary[estimator]
+        print(f"{estimator:10s} {metrics['latency_s'] * 1000:8.1f} ms  corr={metrics['correlation']:.3f}  "
+              f"rmse={metrics['rmse']:.3f}  edge_f1={metrics['edge_f1']:.3f}")
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark des estimateurs de profondeur (latence et qualité)")
+    parser.add_argument("--images", required=True, help="Répertoire d'images de pièces")
+    parser.add_argument("--estimators", default=",".join(DEPTH_ESTIMATORS))
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    paths = sorted(p for ext in ("jpg", "jpeg", "png") for p in glob.glob(os.path.join(args.images, f"*.{ext}")))
+    if not paths:
+        print(f"No images found in {args.images}")
+        return 1
+    benchmark(paths, args.estimators.split(","), args.repeats)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
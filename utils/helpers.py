@@ -155,6 +155,7 @@ def display_ikea_furniture(catalog, style_filter="Tous"):
                     import uuid
                     furniture_item = {
                         "id": str(uuid.uuid4()),
+                        "catalog_id": item['id'],
                         "name": item.get('name', 'Meuble IKEA'),
                         "category": category,
                         "image": furniture_img,
@@ -2,9 +2,17 @@ import numpy as np
 import cv2
 from PIL import Image, ImageDraw, ImageFilter
 import torch
-from transformers import DPTFeatureExtractor, DPTForDepthEstimation
 import streamlit as st
 import uuid
+from config.constants import (
+    IKEA_RETRIEVAL_TOP_K, DEPTH_ESTIMATOR, INPAINT_CROP_TO_MASK, INPAINT_CROP_PADDING,
+    INPAINT_CROP_MIN_SIDE, INPAINT_CROP_MAX_SIDE, INPAINT_FEATHER, GUIDANCE_SCHEDULE, INCREMENTAL_MAX_AREA
+)
+from models.ikea_retrieval import retrieve_product_descriptions
+from models.generation import run_pipeline
+from models.two_stage import run_draft, refine_draft
+from utils.depth_estimation import estimate_depth
+from utils.metrics import inc, log_event, timed
 
 def maintain_aspect_ratio(image, target_size):
     """Redimensionne une image en conservant son ratio d'aspect"""
@@ -56,6 +64,41 @@ def generate_inpainting_mask(image_size, strategy="center_rect", prompt_details=
         draw.rectangle([0, 0, width, height], fill=255)
     return mask
 
+def mask_crop_box(mask, padding=INPAINT_CROP_PADDING):
+    """Boîte englobante du masque élargie d'une marge de contexte, bornée à l'image"""
+    box = mask.getbbox()
+    if box is None:
+        return None
+    x0, y0, x1, y1 = box
+    pad_x = max(32, int((x1 - x0) * padding))
+    pad_y = max(32, int((y1 - y0) * padding))
+    width, height = mask.size
+    return max(0, x0 - pad_x), max(0, y0 - pad_y), min(width, x1 + pad_x), min(height, y1 + pad_y)
+
+def crop_model_size(crop_width, crop_height, min_side=INPAINT_CROP_MIN_SIDE, max_side=INPAINT_CROP_MAX_SIDE):
+    """Résolution de rendu d'une découpe: sa taille native bornée, proportions gardées, multiple de 8"""
+    long_side = max(crop_width, crop_height)
+    scale = min(max(long_side, min_side), max_side) / long_side
+    return max(8, round(crop_width * scale / 8) * 8), max(8, round(crop_height * scale / 8) * 8)
+
+def paste_back(original, generated_crop, mask, box, feather=INPAINT_FEATHER):
+    """Recolle la découpe générée avec un fondu intérieur au masque: hors masque, pixels identiques à l'original"""
+    original_np = np.asarray(original.convert("RGB"))
+    crop_w, crop_h = box[2] - box[0], box[3] - box[1]
+    generated_np = np.asarray(generated_crop.convert("RGB").resize((crop_w, crop_h), Image.LANCZOS))
+
+    mask_np = np.asarray(mask.crop(box), dtype=np.uint8) > 127
+    # Érosion puis flou de même rayon: l'alpha reste strictement nul hors du masque
+    inner = cv2.erode(mask_np.astype(np.uint8), np.ones((2 * feather + 1, 2 * feather + 1), np.uint8)) if feather else mask_np.astype(np.uint8)
+    alpha = cv2.blur(inner.astype(np.float32), (2 * feather + 1, 2 * feather + 1)) if feather else inner.astype(np.float32)
+    alpha = np.where(mask_np, alpha, 0.0)[..., None]
+
+    region = original_np[box[1]:box[3], box[0]:box[2]]
+    blended = (alpha * generated_np + (1 - alpha) * region).round().astype(np.uint8)
+    result = original_np.copy()
+    result[box[1]:box[3], box[0]:box[2]] = np.where(alpha > 0, blended, region)
+    return Image.fromarray(result)
+
 def generate_rectangle_mask(image, center_ratio=0.7):
     """Génère un masque rectangulaire au centre de l'image"""
     if image is None:
@@ -80,20 +123,83 @@ def generate_rectangle_mask(image, center_ratio=0.7):
 
     return mask
 
-def generate_smart_mask(original, edited, dilation_factor=25, threshold=30, structure_preservation=0.7):
-    """Génère un masque intelligent pour l'inpainting basé sur les différences entre images"""
+def place_furniture(item):
+    """Sprite transformé (rotation, échelle) d'un meuble et coin haut-gauche de son collage sur la pièce"""
+    furniture_img = item.get("image")
+    if furniture_img is None:
+        return None, None
+
+    rotated = furniture_img.rotate(item.get("rotation", 0), expand=True)
+    scaled_width = int(rotated.width * item.get("scale", 0.6))
+    scaled_height = int(rotated.height * item.get("scale", 0.6))
+    resized = rotated.resize((scaled_width, scaled_height), Image.LANCZOS)
+
+    # Calcul position avec perspective
+    x = item.get("position_x", 0) - scaled_width // 2
+    y = item.get("position_y", 0) - scaled_height // 2
+    return resized, (max(0, x), max(0, y))
+
+def furniture_item_masks(size, furniture_items, dilation_factor=25, threshold=30):
+    """Masques par meuble rastérisés depuis l'alpha des sprites: [{"id", "box", "mask"}]
+
+    "box" est la boîte (x0, y0, x1, y1) dans la pièce, "mask" le masque uint8 dilaté de cette boîte.
+    La dilatation (noyau carré dilation_factor) ne porte que sur la boîte opaque du meuble élargie du rayon.
+    """
+    width, height = size
+    radius = dilation_factor // 2
+    item_masks = []
+    for item in furniture_items:
+        sprite, dest = place_furniture(item)
+        if sprite is None:
+            continue
+        x, y = dest
+        # Partie visible du sprite: le collage est rogné aux bords droit et bas de la pièce
+        opaque = np.asarray(sprite.convert("RGBA").getchannel("A"))[:max(0, height - y), :max(0, width - x)] > threshold
+        rows, cols = np.flatnonzero(opaque.any(axis=1)), np.flatnonzero(opaque.any(axis=0))
+        if not len(rows):
+            continue
+        opaque = opaque[rows[0]:rows[-1] + 1, cols[0]:cols[-1] + 1]
+        top, left = y + int(rows[0]), x + int(cols[0])
+
+        box = (max(0, left - radius), max(0, top - radius),
+               min(width, left + opaque.shape[1] + radius), min(height, top + opaque.shape[0] + radius))
+        mask = np.zeros((box[3] - box[1], box[2] - box[0]), np.uint8)
+        mask[top - box[1]:top - box[1] + opaque.shape[0], left - box[0]:left - box[0] + opaque.shape[1]] = opaque * 255
+        if dilation_factor > 1:
+            mask = cv2.dilate(mask, np.ones((dilation_factor, dilation_factor), np.uint8), iterations=1)
+        item_masks.append({"id": item.get("id"), "box": box, "mask": mask})
+    return item_masks
+
+def combine_item_masks(size, item_masks):
+    """Union des masques par meuble à la taille de la pièce"""
+    width, height = size
+    combined = np.zeros((height, width), np.uint8)
+    for item_mask in item_masks:
+        x0, y0, x1, y1 = item_mask["box"]
+        np.maximum(combined[y0:y1, x0:x1], item_mask["mask"], out=combined[y0:y1, x0:x1])
+    return combined
+
+def generate_smart_mask(original, edited, dilation_factor=25, threshold=30, structure_preservation=0.7, item_masks=None):
+    """Génère un masque intelligent pour l'inpainting
+
+    Avec item_masks (furniture_item_masks), les meubles viennent directement de l'alpha des sprites;
+    sinon ils sont détectés par différence de pixels entre les deux images.
+    """
     try:
-        if original.size != edited.size:
-            edited = edited.resize(original.size, Image.LANCZOS)
-
         original_np = np.array(original.convert("RGB"))
-        edited_np = np.array(edited.convert("RGB"))
 
-        diff = np.abs(original_np.astype(np.int16) - edited_np.astype(np.int16)).sum(axis=-1)
-        furniture_mask = (diff > threshold).astype(np.uint8) * 255
+        if item_masks is not None:
+            dilated_furniture = combine_item_masks(original.size, item_masks)
+        else:
+            if original.size != edited.size:
+                edited = edited.resize(original.size, Image.LANCZOS)
+            edited_np = np.array(edited.convert("RGB"))
 
-        kernel = np.ones((dilation_factor, dilation_factor), np.uint8)
-        dilated_furniture = cv2.dilate(furniture_mask, kernel, iterations=1)
+            diff = np.abs(original_np.astype(np.int16) - edited_np.astype(np.int16)).sum(axis=-1)
+            furniture_mask = (diff > threshold).astype(np.uint8) * 255
+
+            kernel = np.ones((dilation_factor, dilation_factor), np.uint8)
+            dilated_furniture = cv2.dilate(furniture_mask, kernel, iterations=1)
 
         gray_original = cv2.cvtColor(original_np, cv2.COLOR_RGB2GRAY)
         edges = cv2.Canny(gray_original, 50, 150)
@@ -135,26 +241,10 @@ def generate_smart_mask(original, edited, dilation_factor=25, threshold=30, stru
         return Image.new("L", original.size, 255)
 
 @st.cache_resource(show_spinner=False)
-def get_depth_map(image):
+def get_depth_map(image, estimator=DEPTH_ESTIMATOR):
     """Génère une carte de profondeur à partir d'une image"""
-    processor = DPTFeatureExtractor.from_pretrained("Intel/dpt-hybrid-midas")
-    model = DPTForDepthEstimation.from_pretrained("Intel/dpt-hybrid-midas")
-
-    if image.mode != "RGB":
-        image = image.convert("RGB")
-
-    inputs = processor(images=image, return_tensors="pt")
-
-    with torch.no_grad():
-        outputs = model(**inputs)
-        depth = outputs.predicted_depth[0].numpy()
-        depth = cv2.normalize(depth, None, 0, 255, norm_type=cv2.NORM_MINMAX).astype(np.uint8)
-        depth_map = Image.fromarray(depth)
-
-        if depth_map.size != image.size:
-            depth_map = depth_map.resize(image.size, Image.LANCZOS)
-
-        return depth_map
+    inc("cache_misses_total", cache="depth_map")
+    return estimate_depth(image, estimator)
 
 def load_furniture_image(item, target_size=(256, 256)):
     """Charge une image de meuble avec transparence en utilisant rembg"""
@@ -190,24 +280,12 @@ def composite_multiple_furniture(room_img, furniture_items):
         composite = composite.convert("RGBA")
 
         for item in furniture_items:
-            furniture_img = item.get("image")
-            if furniture_img is None:
+            resized, dest = place_furniture(item)
+            if resized is None:
                 continue
 
-            # Appliquer la transformation
-            rotated = furniture_img.rotate(item.get("rotation", 0), expand=True)
-            scaled_width = int(rotated.width * item.get("scale", 0.6))
-            scaled_height = int(rotated.height * item.get("scale", 0.6))
-            resized = rotated.resize((scaled_width, scaled_height), Image.LANCZOS)
-
-            # Calcul position avec perspective
-            x = item.get("position_x", 0) - scaled_width // 2
-            y = item.get("position_y", 0) - scaled_height // 2
-
             # Coller le meuble
-            composite.alpha_composite(
-                resized,
-                dest=(max(0, x), max(0, y)))
+            composite.alpha_composite(resized, dest=dest)
 
         return composite.convert("RGB")
 
@@ -307,8 +385,45 @@ def generate_inpainting_prompt(room_type, style, furniture_items):
 
     return prompt
 
-def add_furniture_ai(empty_room_image_pil, prompt_text, model_pipeline, ikea_products=None, ikea_img_desc=None):
-    """Ajoute des meubles à une pièce vide en utilisant l'IA"""
+def prepare_simple_inpainting(empty_room_image_pil, crop_to_mask=INPAINT_CROP_TO_MASK):
+    """Entrées du modèle pour le mode simple et fonction de retour à la taille d'origine"""
+    original_size = empty_room_image_pil.size
+    if crop_to_mask:
+        # Seule la boîte englobante du masque (plus une marge de contexte) passe dans le modèle
+        full_image = empty_room_image_pil.convert("RGB")
+        full_mask = generate_inpainting_mask(original_size, strategy="center_rect")
+        crop_box = mask_crop_box(full_mask)
+        if crop_box is not None:
+            width, height = crop_model_size(crop_box[2] - crop_box[0], crop_box[3] - crop_box[1])
+            return {
+                "image": full_image.crop(crop_box).resize((width, height), Image.LANCZOS),
+                "mask_image": full_mask.crop(crop_box).resize((width, height), Image.NEAREST),
+                "width": width, "height": height, "crop_box": crop_box,
+                "finalize": lambda result: paste_back(full_image, result, full_mask, crop_box),
+            }
+
+    # Standard SD input size
+    width, height = 512, 512
+    return {
+        "image": empty_room_image_pil.convert("RGB").resize((width, height)),
+        "mask_image": generate_inpainting_mask((width, height), strategy="center_rect"),
+        "width": width, "height": height, "crop_box": None,
+        "finalize": lambda result: result.resize(original_size),
+    }
+
+def grounded_prompt(prompt_text, ikea_img_desc, retrieval_index, retrieval_query, top_k=IKEA_RETRIEVAL_TOP_K):
+    """Ancrage du prompt sur les descriptions IKEA les plus proches de la demande"""
+    with timed("retrieval", mode="simple"):
+        product_descriptions = retrieve_product_descriptions(retrieval_index, ikea_img_desc, retrieval_query, k=top_k)
+    if product_descriptions:
+        prompt_text = f"{prompt_text} Inspired by IKEA products: {'; '.join(product_descriptions)}."
+    return prompt_text
+
+def add_furniture_ai(empty_room_image_pil, prompt_text, model_pipeline, ikea_products=None, ikea_img_desc=None,
+                     retrieval_index=None, retrieval_query=None, top_k=IKEA_RETRIEVAL_TOP_K, decoder="full",
+                     step_callbacks=(), crop_to_mask=INPAINT_CROP_TO_MASK, guidance_schedule=GUIDANCE_SCHEDULE,
+                     style=None):
+    """Ajoute des meubles à une pièce vide en utilisant l'IA (style: LoRA de style éventuelle)"""
     if model_pipeline is None:
         print("AI model pipeline is not loaded. Cannot process image.")
         img_copy = empty_room_image_pil.copy()
@@ -316,18 +431,19 @@ def add_furniture_ai(empty_room_image_pil, prompt_text, model_pipeline, ikea_pro
         draw.text((10,10), "Error: AI Model Not Loaded in Notebook", fill=(255,0,0))
         return img_copy
 
-    original_size = empty_room_image_pil.size
-    # Standard SD input size
-    model_input_width, model_input_height = 512, 512
-    init_image = empty_room_image_pil.convert("RGB").resize((model_input_width, model_input_height))
-    mask_image = generate_inpainting_mask((model_input_width, model_input_height), strategy="center_rect")
+    inputs = prepare_simple_inpainting(empty_room_image_pil, crop_to_mask)
+    prompt_text = grounded_prompt(prompt_text, ikea_img_desc, retrieval_index, retrieval_query, top_k)
 
     print(f"Running inpainting with prompt: {prompt_text}")
     try:
         # Prépare l'image et génère un masque.
-        result_image = model_pipeline(prompt=prompt_text, image=init_image, mask_image=mask_image,
-                                      num_inference_steps=50, guidance_scale=7.5).images[0]
-        result_image = result_image.resize(original_size)
+        size_kwargs = {"width": inputs["width"], "height": inputs["height"]} if inputs["crop_box"] is not None else {}
+        result_image = run_pipeline(model_pipeline, "simple", step_callbacks=step_callbacks, prompt=prompt_text,
+                                    image=inputs["image"], mask_image=inputs["mask_image"],
+                                    num_inference_steps=50, guidance_scale=7.5, guidance_schedule=guidance_schedule,
+                                    decoder=decoder, style=style, **size_kwargs).images[0]
+        with timed("postprocess", mode="simple"):
+            result_image = inputs["finalize"](result_image)
         print("Inpainting successful.")
     except Exception as e:
         print(f"Error during AI inpainting: {e}")
@@ -336,6 +452,88 @@ def add_furniture_ai(empty_room_image_pil, prompt_text, model_pipeline, ikea_pro
         draw.text((10, 10), f"AI Error: {str(e)[:100]}...", fill=(255,0,0))
     return result_image
 
+def draft_furniture_ai(empty_room_image_pil, prompt_text, model_pipeline, seed, ikea_img_desc=None,
+                       retrieval_index=None, retrieval_query=None, top_k=IKEA_RETRIEVAL_TOP_K,
+                       step_callbacks=(), crop_to_mask=INPAINT_CROP_TO_MASK, guidance_schedule=GUIDANCE_SCHEDULE,
+                       style=None):
+    """Brouillon rapide du mode simple: renvoie l'aperçu pleine taille et le brouillon à affiner
+
+    Le style (LoRA) du brouillon est conservé pour que l'affinage réactive le même.
+    """
+    inputs = prepare_simple_inpainting(empty_room_image_pil, crop_to_mask)
+    prompt_text = grounded_prompt(prompt_text, ikea_img_desc, retrieval_index, retrieval_query, top_k)
+    preview, latents = run_draft(model_pipeline, "simple", seed, inputs["width"], inputs["height"],
+                                 step_callbacks=step_callbacks, prompt=prompt_text, image=inputs["image"],
+                                 mask_image=inputs["mask_image"], guidance_scale=7.5, guidance_schedule=guidance_schedule,
+                                 style=style)
+    with timed("postprocess", mode="simple"):
+        preview = inputs["finalize"](preview)
+    return preview, {"seed": seed, "latents": latents, "prompt": prompt_text, "guidance_schedule": guidance_schedule,
+                     "style": style}
+
+def refine_furniture_ai(empty_room_image_pil, model_pipeline, draft, step_callbacks=(), crop_to_mask=INPAINT_CROP_TO_MASK):
+    """Affine un brouillon approuvé du mode simple à pleine résolution (même graine, même prompt)"""
+    inputs = prepare_simple_inpainting(empty_room_image_pil, crop_to_mask)
+    result_image = refine_draft(model_pipeline, "simple", draft["latents"], draft["seed"], inputs["image"],
+                                inputs["mask_image"], inputs["width"], inputs["height"], step_callbacks=step_callbacks,
+                                prompt=draft["prompt"], guidance_scale=7.5,
+                                guidance_schedule=draft.get("guidance_schedule", GUIDANCE_SCHEDULE),
+                                style=draft.get("style")).images[0]
+    with timed("postprocess", mode="simple"):
+        return inputs["finalize"](result_image)
+
+def layout_signature(furniture_items):
+    """Disposition des meubles: {id: (x, y, échelle, rotation)}"""
+    return {item.get("id"): (item.get("position_x", 0), item.get("position_y", 0), item.get("scale", 0.6),
+                             item.get("rotation", 0))
+            for item in furniture_items}
+
+def changed_region_mask(size, previous, furniture_items, item_masks, threshold=30, max_area=INCREMENTAL_MAX_AREA):
+    """Masque des seules zones modifiées depuis le rendu précédent (None si rien n'a bougé ou trop a bougé)
+
+    Couvre l'ancienne et la nouvelle emprise dilatée des meubles déplacés, ajoutés ou retirés; les pixels
+    opaques des meubles restent hors masque, comme dans le masque complet. Au-delà de max_area (part de
+    l'image couverte par la découpe à rendre), un rendu complet n'est pas plus cher.
+    """
+    layout = layout_signature(furniture_items)
+    changed = {item_id for item_id in set(layout) | set(previous["layout"])
+               if layout.get(item_id) != previous["layout"].get(item_id)}
+    if not changed:
+        return None
+
+    regions = [m for m in previous["item_masks"] + item_masks if m["id"] in changed]
+    mask = combine_item_masks(size, regions)
+    cores = combine_item_masks(size, furniture_item_masks(size, furniture_items, dilation_factor=1, threshold=threshold))
+    mask[cores > 0] = 0
+    mask = Image.fromarray(mask)
+
+    box = mask_crop_box(mask)
+    if box is None or (box[2] - box[0]) * (box[3] - box[1]) > max_area * size[0] * size[1]:
+        return None
+    return mask
+
+def regenerate_changed_regions(pipe, previous, furniture_items, mask, control_image=None, step_callbacks=(), **call_kwargs):
+    """Régénération incrémentale: inpainting des seules zones modifiées sur le rendu précédent, même graine
+
+    Les meubles sont recollés sur le rendu précédent; seule la découpe englobant le masque passe dans le
+    modèle, puis elle est recollée avec fondu: hors masque, le rendu précédent est conservé au bit près.
+    """
+    init_image = composite_multiple_furniture(previous["result"], furniture_items)
+    box = mask_crop_box(mask)
+    width, height = crop_model_size(box[2] - box[0], box[3] - box[1])
+    if control_image is not None:
+        call_kwargs["control_image"] = control_image.crop(box).resize((width, height), Image.BICUBIC)
+
+    result = run_pipeline(pipe, "ikea", step_callbacks=step_callbacks, prompt=previous["prompt"],
+                          image=init_image.crop(box).resize((width, height), Image.LANCZOS),
+                          mask_image=mask.crop(box).resize((width, height), Image.NEAREST),
+                          width=width, height=height, generator=torch.Generator("cpu").manual_seed(previous["seed"]),
+                          **call_kwargs).images[0]
+    log_event("incremental_regen", box=list(box), render_size=[width, height],
+              area_ratio=round((box[2] - box[0]) * (box[3] - box[1]) / (init_image.width * init_image.height), 3))
+    with timed("postprocess", mode="ikea"):
+        return paste_back(init_image, result, mask, box)
+
 # Dépendances nécessaires
 import os
 from PIL import Image
@@ -0,0 +1,319 @@
+import os
+import re
+import glob
+import json
+import time
+import tempfile
+import threading
+import contextlib
+import numpy as np
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from config.constants import METRICS_DIR, METRICS_PORT, MEMORY_BUDGET_MB, RESULTS_DIR
+
+# Bornes des histogrammes de latence (secondes): de l'étape de masque au rendu CPU complet
+LATENCY_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+_HELP = {
+    "generation_stage_seconds": "Durée de chaque étape du pipeline de génération",
+    "denoising_step_seconds": "Durée d'un pas de débruitage",
+    "generation_stage_cpu_seconds": "Temps CPU consommé par étape",
+    "process_resident_memory_bytes": "Mémoire résidente du processus à la fin de la dernière étape",
+    "cache_hits_total": "Appels servis par un cache de ressources",
+    "cache_misses_total": "Appels ayant rempli un cache de ressources",
+    "generation_queue_depth": "Générations en cours ou en attente dans ce processus",
+    "generations_total": "Générations terminées, par mode et statut",
+    "preview_seconds": "Durée de production d'un aperçu intermédiaire (progression incluse)",
+    "generation_peak_resident_memory_bytes": "Pic de mémoire résidente du processus échantillonné pendant la dernière génération",
+    "latent_cache_entries": "Encodages VAE de pièces conservés dans le cache de latents",
+    "latent_cache_evictions_total": "Encodages VAE évincés du cache de latents (LRU)",
+    "unet_passes_total": "Évaluations de l'UNet limitées à la branche conditionnelle (CFG tronquée)",
+    "deep_cache_steps_total": "Pas de débruitage par évaluation de l'UNet (complète ou superficielle, DeepCache)",
+    "style_switch_seconds": "Durée d'un changement de style LoRA sur l'UNet partagé (fusion incluse au premier usage)",
+    "controlnet_steps_total": "Pas de débruitage par traitement ControlNet (calculé, réutilisé, sauté)",
+}
+
+_lock = threading.Lock()
+_flush_lock = threading.Lock()
+_counters = {}
+_gauges = {}
+_histograms = {}
+_server = None
+# État propre au thread de la session: pic mémoire de sa génération, misses de cache qu'elle a causés
+_local = threading.local()
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+def inc(name, amount=1, **labels):
+    """Incrémente un compteur"""
+    with _lock:
+        key = _key(name, labels)
+        _counters[key] = _counters.get(key, 0) + amount
+    if name == "cache_misses_total":
+        misses = _local.__dict__.setdefault("cache_misses", {})
+        misses[labels.get("cache")] = misses.get(labels.get("cache"), 0) + amount
+
+
+def set_gauge(name, value, **labels):
+    """Fixe la valeur d'une jauge"""
+    with _lock:
+        _gauges[_key(name, labels)] = value
+
+
+def add_gauge(name, amount, **labels):
+    """Ajoute une valeur (positive ou négative) à une jauge"""
+    with _lock:
+        key = _key(name, labels)
+        _gauges[key] = _gauges.get(key, 0) + amount
+
+
+def observe(name, value, **labels):
+    """Enregistre une observation dans un histogramme"""
+    with _lock:
+        key = _key(name, labels)
+        histogram = _histograms.setdefault(key, {"buckets": [0] * len(LATENCY_BUCKETS), "sum": 0.0, "count": 0})
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if value <= bound:
+                histogram["buckets"][i] += 1
+        histogram["sum"] += value
+        histogram["count"] += 1
+
+
+def counter_value(name, **labels):
+    with _lock:
+        return _counters.get(_key(name, labels), 0)
+
+
+def resident_memory_bytes():
+    """Mémoire résidente actuelle du processus (Linux), 0 si indisponible"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+def sample_memory():
+    """Échantillonne la mémoire résidente et met à jour le pic de la génération en cours de ce thread
+
+    Le pic VmHWM du noyau est global au processus: le remettre à zéro par requête effacerait celui des
+    sessions concurrentes. Chaque génération relève donc son propre maximum, à chaque pas et étape.
+    """
+    rss = resident_memory_bytes()
+    peak = getattr(_local, "peak_rss", None)
+    if peak is not None and rss > peak:
+        _local.peak_rss = rss
+    return rss
+
+
+def log_event(event, **fields):
+    """Écrit un événement de log structuré (une ligne JSON)"""
+    record = {"ts": round(time.time(), 3), "pid": os.getpid(), "event": event, **fields}
+    line = json.dumps(record, ensure_ascii=False, default=str)
+    # Une panne d'écriture des logs ne doit jamais interrompre un rendu
+    try:
+        with _lock:
+            os.makedirs(METRICS_DIR, exist_ok=True)
+            with open(os.path.join(METRICS_DIR, "events.jsonl"), "a") as f:
+                f.write(line + "\n")
+    except OSError as e:
+        print(f"Event log write failed: {e}")
+
+
+def record_stage(stage, duration, **labels):
+    """Enregistre la durée d'une étape mesurée hors d'un bloc timed()"""
+    observe("generation_stage_seconds", duration, stage=stage, **labels)
+    log_event("stage", stage=stage, status="ok", duration_s=round(duration, 4), **labels)
+
+
+@contextlib.contextmanager
+def timed(stage, **labels):
+    """Chronomètre une étape: histogramme, temps CPU, mémoire et log JSON"""
+    start = time.perf_counter()
+    cpu_start = time.process_time()
+    status = "ok"
+    try:
+        yield
+    except BaseException:
+        status = "error"
+        raise
+    finally:
+        duration = time.perf_counter() - start
+        cpu_time = time.process_time() - cpu_start
+        rss = sample_memory()
+        observe("generation_stage_seconds", duration, stage=stage, **labels)
+        observe("generation_stage_cpu_seconds", cpu_time, stage=stage, **labels)
+        set_gauge("process_resident_memory_bytes", rss)
+        log_event("stage", stage=stage, status=status, duration_s=round(duration, 4),
+                  cpu_s=round(cpu_time, 4), rss_mb=round(rss / 2**20, 1), **labels)
+
+
+@contextlib.contextmanager
+def track_generation(mode):
+    """Suit la profondeur de file, le statut et le pic mémoire d'une génération complète
+
+    Les métriques sont écrites sur disque une fois par génération, à la fin.
+    """
+    add_gauge("generation_queue_depth", 1, mode=mode)
+    previous_peak = getattr(_local, "peak_rss", None)
+    _local.peak_rss = resident_memory_bytes()
+    status = "ok"
+    try:
+        yield
+    except BaseException:
+        status = "error"
+        raise
+    finally:
+        add_gauge("generation_queue_depth", -1, mode=mode)
+        inc("generations_total", mode=mode, status=status)
+        sample_memory()
+        peak = _local.peak_rss
+        _local.peak_rss = previous_peak if previous_peak is None else max(previous_peak, peak)
+        set_gauge("generation_peak_resident_memory_bytes", peak, mode=mode)
+        log_event("generation", mode=mode, status=status, peak_rss_mb=round(peak / 2**20, 1),
+                  budget_mb=MEMORY_BUDGET_MB or None,
+                  over_budget=bool(MEMORY_BUDGET_MB) and peak > MEMORY_BUDGET_MB * 2**20)
+        flush_metrics()
+
+
+def cached_call(cache, fn, *args, **kwargs):
+    """Appelle une ressource mise en cache et compte hit ou miss (le loader compte ses misses)
+
+    Seuls les misses comptés par ce thread sont pris en compte: un miss d'une autre session pendant
+    l'appel ne masque pas un hit de celle-ci.
+    """
+    misses = _local.__dict__.setdefault("cache_misses", {})
+    before = misses.get(cache, 0)
+    result = fn(*args, **kwargs)
+    if misses.get(cache, 0) == before:
+        inc("cache_hits_total", cache=cache)
+    return result
+
+
+def psnr(reference, candidate):
+    """PSNR (dB) entre deux images 8 bits (PIL ou tableaux), inf si identiques: écart de qualité des benchmarks"""
+    mse = float(np.mean((np.asarray(reference, dtype=np.float32) - np.asarray(candidate, dtype=np.float32)) ** 2))
+    return float("inf") if mse == 0 else float(10 * np.log10(255.0 ** 2 / mse))
+
+
+def results_path(filename):
+    """Chemin d'un fichier de résultats de benchmark (dossier créé au besoin)"""
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    return os.path.join(RESULTS_DIR, filename)
+
+
+def write_results(filename, report, echo=True):
+    """Écrit un rapport de benchmark JSON dans RESULTS_DIR (et l'affiche), renvoie son chemin"""
+    path = results_path(filename)
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2)
+    if echo:
+        print(json.dumps(report, indent=2))
+    return path
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}"
+
+
+def render_prometheus():
+    """Rend toutes les métriques au format texte Prometheus"""
+    lines = []
+    with _lock:
+        families = {}
+        for kind, store in (("counter", _counters), ("gauge", _gauges), ("histogram", _histograms)):
+            for (name, labels), value in store.items():
+                families.setdefault((name, kind), []).append((labels, value))
+
+        for (name, kind), samples in sorted(families.items()):
+            lines.append(f"# HELP {name} {_HELP.get(name, name)}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in samples:
+                if kind != "histogram":
+                    lines.append(f"{name}{_format_labels(labels)} {value}")
+                    continue
+                for bound, count in zip(LATENCY_BUCKETS, value["buckets"]):
+                    lines.append(f"{name}_bucket{_format_labels(labels, [('le', bound)])} {count}")
+                lines.append(f"{name}_bucket{_format_labels(labels, [('le', '+Inf')])} {value['count']}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {value['sum']:.6f}")
+                lines.append(f"{name}_count{_format_labels(labels)} {value['count']}")
+    return "\n".join(lines) + "\n"
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _remove_stale_metrics():
+    """Supprime les fichiers de métriques (et temporaires) laissés par des processus terminés"""
+    for path in glob.glob(os.path.join(METRICS_DIR, "generation_*")):
+        match = re.match(r"generation_(\d+)\.", os.path.basename(path))
+        if match and not _pid_alive(int(match.group(1))):
+            with contextlib.suppress(OSError):
+                os.remove(path)
+
+
+def flush_metrics():
+    """Écrit les métriques dans un fichier texte Prometheus (un fichier par processus)
+
+    Appelé une fois par génération. Les sessions Streamlit d'un même processus écrivent en parallèle:
+    fichier temporaire unique par écriture et remplacement sous verrou. Les fichiers des processus
+    terminés sont supprimés au passage. Une panne d'écriture n'interrompt jamais un rendu.
+    """
+    body = render_prometheus()
+    path = os.path.join(METRICS_DIR, f"generation_{os.getpid()}.prom")
+    try:
+        with _flush_lock:
+            os.makedirs(METRICS_DIR, exist_ok=True)
+            _remove_stale_metrics()
+            fd, tmp_path = tempfile.mkstemp(dir=METRICS_DIR, prefix=f"generation_{os.getpid()}.", suffix=".tmp")
+            try:
+                with os.fdopen(fd, "w") as f:
+                    f.write(body)
+                os.replace(tmp_path, path)
+            except BaseException:
+                with contextlib.suppress(OSError):
+                    os.remove(tmp_path)
+                raise
+    except OSError as e:
+        print(f"Metrics flush failed: {e}")
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server(port=METRICS_PORT):
+    """Démarre (une seule fois) un endpoint HTTP local exposant les métriques"""
+    global _server
+    if not port or _server is not None:
+        return _server
+    try:
+        _server = ThreadingHTTPServer(("127.0.0.1", int(port)), _MetricsHandler)
+    except OSError as e:
+        print(f"Metrics endpoint not started on port {port}: {e}")
+        return None
+    threading.Thread(target=_server.serve_forever, daemon=True).start()
+    print(f"Metrics endpoint listening on http://127.0.0.1:{port}/metrics")
+    return _server
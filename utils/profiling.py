@@ -0,0 +1,95 @@
+import os
+import sys
+import time
+import pstats
+import cProfile
+import threading
+import contextlib
+import torch
+import streamlit as st
+
+from config.constants import PROFILES_DIR, PROFILE_ENV_VAR, PROFILE_ADMIN_TOKEN
+
+
+def profiling_requested():
+    """Indique si la requête courante doit être profilée (variable d'environnement ou URL admin)"""
+    if os.environ.get(PROFILE_ENV_VAR) == "1":
+        return True
+    if not PROFILE_ADMIN_TOKEN:
+        return False
+    try:
+        return st.query_params.get("profile") == PROFILE_ADMIN_TOKEN
+    except Exception:
+        return False
+
+
+class _StackSampler(threading.Thread):
+    """Échantillonne la pile Python d'un thread (format « folded » pour flamegraph.pl / speedscope)"""
+
+    def __init__(self, thread_id, interval=0.01):
+        super().__init__(daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.counts = {}
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                frame = frame.f_back
+            if stack:
+                folded = ";".join(reversed(stack))
+                self.counts[folded] = self.counts.get(folded, 0) + 1
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+    def dump(self, path):
+        with open(path, "w") as f:
+            for folded, count in sorted(self.counts.items(), key=lambda item: -item[1]):
+                f.write(f"{folded} {count}\n")
+
+
+@contextlib.contextmanager
+def profile_request(name):
+    """Profile une génération (cProfile + profiler PyTorch) si le profilage est demandé"""
+    if not profiling_requested():
+        yield None
+        return
+
+    os.makedirs(PROFILES_DIR, exist_ok=True)
+    prefix = os.path.join(PROFILES_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}_{name}_{os.getpid()}")
+    activities = [torch.profiler.ProfilerActivity.CPU]
+    if torch.cuda.is_available():
+        activities.append(torch.profiler.ProfilerActivity.CUDA)
+
+    # Les piles Python sont échantillonnées à part: le traceur Python du profiler PyTorch
+    # et cProfile se disputeraient le même hook de profilage
+    sampler = _StackSampler(threading.get_ident())
+    profiler = cProfile.Profile()
+    torch_profiler = torch.profiler.profile(activities=activities, record_shapes=True, profile_memory=True)
+
+    st.info(f"Profilage activé pour cette génération: {prefix}_*")
+    sampler.start()
+    torch_profiler.__enter__()
+    profiler.enable()
+    try:
+        yield prefix
+    finally:
+        profiler.disable()
+        torch_profiler.__exit__(None, None, None)
+        sampler.stop()
+
+        profiler.dump_stats(f"{prefix}.prof")
+        with open(f"{prefix}_cprofile.txt", "w") as f:
+            pstats.Stats(profiler, stream=f).sort_stats("cumulative").print_stats(80)
+        with open(f"{prefix}_ops.txt", "w") as f:
+            f.write(torch_profiler.key_averages().table(sort_by="self_cpu_time_total", row_limit=100))
+        torch_profiler.export_chrome_trace(f"{prefix}_trace.json")
+        sampler.dump(f"{prefix}_stacks.folded")
+        print(f"Profile saved to {prefix}_* (cProfile, op table, Chrome trace, folded stacks)")
@@ -0,0 +1,55 @@
+import pytest
+
+pytest.importorskip("torch")    # config.constants importe torch
+
+from utils import cpu_tuning
+from utils.cpu_tuning import _parse_cpulist, worker_core_set
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("0-3\n", [0, 1, 2, 3]),
+    ("0,2,4", [0, 2, 4]),
+    ("0-1,8-9,12", [0, 1, 8, 9, 12]),
+    ("5", [5]),
+    ("", []),
+    ("0-2,", [0, 1, 2]),
+])
+def test_parse_cpulist(text, expected):
+    assert _parse_cpulist(text) == expected
+
+
+@pytest.fixture
+def two_nodes(monkeypatch):
+    nodes = [[0, 1, 2, 3, 4, 5, 6, 7], [8, 9, 10, 11, 12, 13, 14, 15]]
+    monkeypatch.setattr(cpu_tuning, "numa_nodes", lambda: nodes)
+    return nodes
+
+
+def test_one_worker_gets_every_node(two_nodes):
+    assert worker_core_set(0, 1) == list(range(16))
+
+
+def test_workers_split_nodes(two_nodes):
+    assert worker_core_set(0, 2) == two_nodes[0]
+    assert worker_core_set(1, 2) == two_nodes[1]
+
+
+@pytest.mark.parametrize("num_workers", [3, 4, 5, 8, 16])
+def test_more_workers_than_nodes_get_disjoint_cores(two_nodes, num_workers):
+    core_sets = [worker_core_set(w, num_workers) for w in range(num_workers)]
+    assert all(core_sets)
+    for w, cores in enumerate(core_sets):
+        assert set(cores) <= set(two_nodes[w % 2])
+        for other in core_sets[w + 1:]:
+            assert not set(cores) & set(other)
+
+
+def test_more_workers_than_cores_share_node(monkeypatch):
+    # Plus de workers que de cœurs: le dernier retombe sur le nœud entier, un recouvrement inévitable
+    monkeypatch.setattr(cpu_tuning, "numa_nodes", lambda: [[0, 1]])
+    assert [worker_core_set(w, 3) for w in range(3)] == [[0], [1], [0, 1]]
+
+
+@pytest.mark.parametrize("worker_index, num_workers", [(2, 2), (-1, 2), (0, 0)])
+def test_invalid_worker_index_uses_all_cores(two_nodes, worker_index, num_workers):
+    assert worker_core_set(worker_index, num_workers) == list(range(16))
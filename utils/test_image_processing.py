@@ -0,0 +1,122 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("torch")    # config.constants et les pipelines importent torch
+pytest.importorskip("cv2")
+pytest.importorskip("streamlit")
+
+from PIL import Image, ImageDraw
+
+from utils.image_processing import (
+    changed_region_mask, crop_model_size, furniture_item_masks, layout_signature, mask_crop_box, paste_back,
+)
+
+SIZE = (640, 480)
+GENERATED = (200, 30, 90)
+
+
+@pytest.fixture
+def room():
+    rng = np.random.default_rng(0)
+    return Image.fromarray(rng.integers(0, 256, (SIZE[1], SIZE[0], 3), dtype=np.uint8))
+
+
+def rect_mask(box):
+    mask = Image.new("L", SIZE, 0)
+    ImageDraw.Draw(mask).rectangle(box, fill=255)
+    return mask
+
+
+def test_crop_box_of_empty_mask():
+    assert mask_crop_box(Image.new("L", SIZE, 0)) is None
+
+
+def test_crop_box_pads_and_clamps():
+    assert mask_crop_box(rect_mask((300, 200, 399, 299)), padding=0.15) == (268, 168, 432, 332)
+    assert mask_crop_box(rect_mask((0, 0, 9, 9))) == (0, 0, 42, 42)
+    assert mask_crop_box(rect_mask((600, 440, 639, 479))) == (568, 408, 640, 480)
+    assert mask_crop_box(rect_mask((100, 100, 499, 199)), padding=0.25) == (0, 68, 600, 232)
+
+
+@pytest.mark.parametrize("crop_size, expected", [
+    ((164, 164), (512, 512)),
+    ((600, 300), (600, 304)),
+    ((2000, 1000), (1024, 512)),
+])
+def test_crop_model_size(crop_size, expected):
+    assert crop_model_size(*crop_size) == expected
+
+
+@pytest.mark.parametrize("feather", [0, 4, 16])
+def test_paste_back_is_bit_exact_outside_mask(room, feather):
+    mask = rect_mask((250, 150, 389, 329))
+    box = mask_crop_box(mask)
+    # La découpe revient à la résolution du modèle, pas à celle de la boîte
+    generated = Image.new("RGB", crop_model_size(box[2] - box[0], box[3] - box[1]), GENERATED)
+
+    result = np.asarray(paste_back(room, generated, mask, box, feather=feather))
+    original = np.asarray(room)
+    inside = np.asarray(mask) > 127
+
+    assert result.shape == original.shape
+    assert np.array_equal(result[~inside], original[~inside])
+    # Au-delà du fondu, la génération est reprise telle quelle
+    core = np.zeros_like(inside)
+    core[150 + 2 * feather + 1:330 - 2 * feather - 1, 250 + 2 * feather + 1:390 - 2 * feather - 1] = True
+    assert (result[core] == GENERATED).all()
+    if feather:
+        edge = result[150:330, 250][..., 0].astype(int)
+        assert (np.abs(edge - GENERATED[0]) > 0).any()
+
+
+def test_paste_back_ignores_soft_mask_values_below_threshold(room):
+    mask = rect_mask((250, 150, 389, 329))
+    ImageDraw.Draw(mask).rectangle((400, 150, 420, 329), fill=100)
+    box = mask_crop_box(mask)
+    generated = Image.new("RGB", (box[2] - box[0], box[3] - box[1]), GENERATED)
+    result = np.asarray(paste_back(room, generated, mask, box, feather=8))
+    assert np.array_equal(result[150:330, 400:421], np.asarray(room)[150:330, 400:421])
+
+
+def sprite_item(item_id, x, y, side=50):
+    return {"id": item_id, "image": Image.new("RGBA", (side, side), (80, 60, 40, 255)),
+            "position_x": x, "position_y": y, "scale": 1.0, "rotation": 0}
+
+
+def previous_render(items):
+    return {"layout": layout_signature(items), "item_masks": furniture_item_masks(SIZE, items)}
+
+
+def test_changed_region_none_when_layout_unchanged():
+    items = [sprite_item("chair", 150, 150), sprite_item("lamp", 500, 350)]
+    assert changed_region_mask(SIZE, previous_render(items), items, furniture_item_masks(SIZE, items)) is None
+
+
+def test_changed_region_covers_old_and_new_footprint():
+    before = [sprite_item("chair", 150, 150), sprite_item("lamp", 500, 350)]
+    after = [sprite_item("chair", 300, 200), sprite_item("lamp", 500, 350)]
+    mask = changed_region_mask(SIZE, previous_render(before), after, furniture_item_masks(SIZE, after), max_area=0.5)
+    mask_np = np.asarray(mask)
+
+    assert mask.size == SIZE
+    assert mask_np[150, 150] == 255            # ancienne place de la chaise: fond à repeindre
+    assert mask_np[200, 300] == 0              # pixels opaques de la chaise déplacée: conservés
+    assert mask_np[200, 300 - 25 - 5] == 255   # contour dilaté de la nouvelle place
+    assert not mask_np[300:400, 440:560].any()  # la lampe n'a pas bougé
+
+
+def test_changed_region_includes_added_and_removed_items():
+    before = [sprite_item("chair", 150, 150)]
+    after = [sprite_item("lamp", 500, 350)]
+    mask = np.asarray(changed_region_mask(SIZE, previous_render(before), after, furniture_item_masks(SIZE, after),
+                                          max_area=1.0))
+    assert mask[150, 150] == 255
+    assert mask[350, 500] == 0 and mask[350, 500 - 25 - 5] == 255
+
+
+def test_changed_region_falls_back_to_full_render_when_too_large():
+    before = [sprite_item("chair", 60, 60), sprite_item("lamp", 580, 420)]
+    after = [sprite_item("chair", 70, 60), sprite_item("lamp", 570, 420)]
+    item_masks = furniture_item_masks(SIZE, after)
+    assert changed_region_mask(SIZE, previous_render(before), after, item_masks, max_area=0.5) is None
+    assert changed_region_mask(SIZE, previous_render(before), after, item_masks, max_area=1.0) is not None